@@ -0,0 +1,297 @@
+"""
+Context assembly between retrieval and the chat LLM.
+
+Child chunks are 100 tokens with a 24 token overlap, so the top hits for a
+question are often neighbours on the same page that repeat each other. The
+packer fetches CHAT_RETRIEVAL_FETCH_K candidates, keeps CHAT_RETRIEVAL_K of
+them by maximal marginal relevance, merges neighbouring chunks of a page into
+one contiguous window with the overlap removed, and packs windows in score
+order until CHAT_CONTEXT_TOKEN_BUDGET prompt tokens are used.
+
+With owner_uuid set, only the current user's chunks are kept from an
+over-fetched vector index search (see SCOPED_CHILD_QUERY). With top_documents set,
+retrieval is two-stage: the document_summary index picks that many documents
+and their chunks are searched (DOCUMENT_CHILD_QUERY), together with the chunks
+of documents that have no summary yet (UNSUMMARIZED_CHILD_QUERY), so documents
+still being enriched, lazily enriched or cancelled stay reachable. With no
+summary at all, or no document_summary index yet, the normal search is used.
+
+Each window's source is the comma-separated uuids of the Child chunks it was
+built from, so the sources the chain returns still resolve through
+fetch_node_properties_by_uuid.
+"""
+import logging
+import math
+import operator
+from typing import Any, List, Optional
+
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.docstore.document import Document
+from langchain.schema.retriever import BaseRetriever
+from neo4j.exceptions import ClientError
+
+from config import AppConfig
+from worker.usage import count_tokens
+
+
+# The chunk's page comes back with it, so windows never span pages or documents
+CHILD_CONTEXT_QUERY = """
+    MATCH (node)<-[:HAS_CHILD]-(page:Page)
+    WITH node, score, head(collect(page.uuid)) AS page_uuid
+    RETURN node.text AS text, score,
+        {uuid: node.uuid, source: node.uuid, name: node.name, page_uuid: page_uuid, embedding: node.embedding} AS metadata
+    """
+
+# Scoped search: the vector index is over-fetched and its hits filtered to the owner's
+# chunks, through the indexed Page.owner_uuid so chunks shared with other users' pages
+# are included. The fetch is widened by SCOPED_OVERFETCH up to CHAT_SCOPED_MAX_FETCH
+# while fewer than k hits survive the filter.
+SCOPED_OVERFETCH = 4
+
+SCOPED_CHILD_QUERY = """
+    CALL db.index.vector.queryNodes($index, $fetch, $embedding) YIELD node, score
+    MATCH (page:Page {owner_uuid: $owner_uuid})-[:HAS_CHILD]->(node)
+    WITH node, score, head(collect(page.uuid)) AS page_uuid
+    ORDER BY score DESC LIMIT $k
+    RETURN node.text AS text, score,
+        {uuid: node.uuid, source: node.uuid, name: node.name, page_uuid: page_uuid, embedding: node.embedding} AS metadata
+    """
+
+# An owner whose chunks rank too low to fill even the widest fetch holds only a small
+# share of the index: their chunks are scored brute force instead
+SCOPED_CHILD_SCAN_QUERY = """
+    MATCH (page:Page {owner_uuid: $owner_uuid})-[:HAS_CHILD]->(node:Child)
+    WITH node, head(collect(page.uuid)) AS page_uuid
+    WITH node, page_uuid, vector.similarity.cosine(node.embedding, $embedding) AS score
+    ORDER BY score DESC LIMIT $k
+    RETURN node.text AS text, score,
+        {uuid: node.uuid, source: node.uuid, name: node.name, page_uuid: page_uuid, embedding: node.embedding} AS metadata
+    """
+
+# Two-stage retrieval: documents by their DocumentSummary, then chunks inside them
+DOCUMENT_SUMMARY_QUERY = """
+    CALL db.index.vector.queryNodes('document_summary', $n, $embedding) YIELD node, score
+    MATCH (d:Document)-[:HAS_DOCUMENT_SUMMARY]->(node)
+    RETURN d.uuid AS uuid
+    """
+
+# Owned documents are found through the indexed Page.owner_uuid, like the scoped chunk search
+SCOPED_DOCUMENT_SUMMARY_QUERY = """
+    MATCH (d:Document)-[:HAS_PAGE]->(:Page {owner_uuid: $owner_uuid})
+    WITH DISTINCT d
+    MATCH (d)-[:HAS_DOCUMENT_SUMMARY]->(s:DocumentSummary)
+    WITH d, vector.similarity.cosine(s.embedding, $embedding) AS score
+    ORDER BY score DESC LIMIT $n
+    RETURN d.uuid AS uuid
+    """
+
+DOCUMENT_CHILD_QUERY = """
+    MATCH (d:Document)-[:HAS_PAGE]->(page:Page)-[:HAS_CHILD]->(node:Child)
+    WHERE d.uuid IN $document_uuids AND ($owner_uuid IS NULL OR page.owner_uuid = $owner_uuid)
+    WITH node, head(collect(page.uuid)) AS page_uuid
+    WITH node, page_uuid, vector.similarity.cosine(node.embedding, $embedding) AS score
+    ORDER BY score DESC LIMIT $k
+    RETURN node.text AS text, score,
+        {uuid: node.uuid, source: node.uuid, name: node.name, page_uuid: page_uuid, embedding: node.embedding} AS metadata
+    """
+
+# Documents without a DocumentSummary are not in the summary index, so their chunks are
+# searched as well. Hits of summarized documents are dropped from the vector index
+# results, which are over-fetched by UNSUMMARIZED_OVERFETCH to make up for them.
+UNSUMMARIZED_OVERFETCH = 4
+
+UNSUMMARIZED_CHILD_QUERY = """
+    CALL db.index.vector.queryNodes($index, $fetch, $embedding) YIELD node, score
+    MATCH (d:Document)-[:HAS_PAGE]->(page:Page)-[:HAS_CHILD]->(node)
+    WHERE NOT EXISTS { (d)-[:HAS_DOCUMENT_SUMMARY]->(:DocumentSummary) }
+        AND ($owner_uuid IS NULL OR page.owner_uuid = $owner_uuid)
+    WITH node, score, head(collect(page.uuid)) AS page_uuid
+    ORDER BY score DESC LIMIT $k
+    RETURN node.text AS text, score,
+        {uuid: node.uuid, source: node.uuid, name: node.name, page_uuid: page_uuid, embedding: node.embedding} AS metadata
+    """
+
+SCOPED_UNSUMMARIZED_CHILD_SCAN_QUERY = """
+    MATCH (d:Document)-[:HAS_PAGE]->(page:Page {owner_uuid: $owner_uuid})-[:HAS_CHILD]->(node:Child)
+    WHERE NOT EXISTS { (d)-[:HAS_DOCUMENT_SUMMARY]->(:DocumentSummary) }
+    WITH node, head(collect(page.uuid)) AS page_uuid
+    WITH node, page_uuid, vector.similarity.cosine(node.embedding, $embedding) AS score
+    ORDER BY score DESC LIMIT $k
+    RETURN node.text AS text, score,
+        {uuid: node.uuid, source: node.uuid, name: node.name, page_uuid: page_uuid, embedding: node.embedding} AS metadata
+    """
+
+# Matches the document prompt of the "stuff" qa-with-sources chain
+DOCUMENT_TEMPLATE = "Content: {text}\nSource: {source}"
+
+
+def child_index(name: str):
+    """Position of a Child within its page, from names like '3-7'."""
+    try:
+        return int(str(name).rsplit("-", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def merge_overlap(left: str, right: str, max_overlap: int = 400) -> str:
+    """Append right to left, dropping the longest prefix of right that left already ends with."""
+    for size in range(min(len(left), len(right), max_overlap), 0, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return left + " " + right
+
+
+def normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else list(vector)
+
+
+def dot(a: List[float], b: List[float]) -> float:
+    return sum(map(operator.mul, a, b))
+
+
+def mmr(query_embedding: List[float], hits: list, k: int, lambda_mult: float) -> list:
+    """
+    Select k (document, score) hits, trading relevance to the query against similarity to hits already chosen.
+    Embeddings are normalized once, and each candidate keeps its highest similarity to the selected hits,
+    updated against the newest selection only, so a round is one dot product per candidate.
+    """
+    query = normalize(query_embedding)
+    # [doc, score, relevance, normalized embedding, max similarity to the selected hits]
+    candidates = []
+    for doc, score in hits:
+        if doc.metadata.get("embedding"):
+            vector = normalize(doc.metadata["embedding"])
+            candidates.append([doc, score, dot(query, vector), vector, None])
+    selected = []
+    while candidates and len(selected) < k:
+        best = max(range(len(candidates)), key=lambda i: lambda_mult * candidates[i][2] - (1 - lambda_mult) * (
+            0.0 if candidates[i][4] is None else candidates[i][4]))
+        doc, score, _, vector, _ = candidates.pop(best)
+        selected.append((doc, score))
+        for candidate in candidates:
+            similarity = dot(candidate[3], vector)
+            if candidate[4] is None or similarity > candidate[4]:
+                candidate[4] = similarity
+    return selected
+
+
+def merge_windows(hits: list) -> list:
+    """Merge hits that are neighbours on the same page into windows, best scoring window first."""
+    by_page = {}
+    for doc, score in hits:
+        by_page.setdefault(doc.metadata.get("page_uuid") or doc.metadata["uuid"], []).append((doc, score))
+
+    windows = []
+    for page_hits in by_page.values():
+        page_hits.sort(key=lambda hit: (child_index(hit[0].metadata.get("name")) is None, child_index(hit[0].metadata.get("name")) or 0))
+        window = None
+        for doc, score in page_hits:
+            index = child_index(doc.metadata.get("name"))
+            if window is not None and index is not None and window["end"] is not None and index <= window["end"] + 1:
+                window["text"] = merge_overlap(window["text"], doc.page_content)
+                window["uuids"].append(doc.metadata["uuid"])
+                window["end"] = index
+                window["score"] = max(window["score"], score)
+                continue
+            window = {"text": doc.page_content, "uuids": [doc.metadata["uuid"]], "end": index, "score": score}
+            windows.append(window)
+    return sorted(windows, key=lambda w: w["score"], reverse=True)
+
+
+def pack(windows: list, budget: int, model: str) -> tuple:
+    """Keep windows in score order while they fit the token budget. Returns (documents, tokens used)."""
+    documents, used = [], 0
+    for window in windows:
+        source = ", ".join(window["uuids"])
+        tokens = count_tokens(DOCUMENT_TEMPLATE.format(text=window["text"], source=source), model)
+        if used + tokens > budget:
+            continue
+        documents.append(Document(page_content=window["text"], metadata={"source": source, "score": window["score"]}))
+        used += tokens
+    return documents, used
+
+
+class PackedContextRetriever(BaseRetriever):
+    """Retriever for RetrievalQAWithSourcesChain that returns packed context windows. Use one per request."""
+
+    vectorstore: Any
+    model: str
+    fetch_k: int = AppConfig.CHAT_RETRIEVAL_FETCH_K
+    k: int = AppConfig.CHAT_RETRIEVAL_K
+    lambda_mult: float = AppConfig.CHAT_MMR_LAMBDA
+    token_budget: int = AppConfig.CHAT_CONTEXT_TOKEN_BUDGET
+    # Set to search only this user's chunks
+    owner_uuid: Optional[str] = None
+    # Set to first select this many documents by summary
+    top_documents: Optional[int] = None
+    stats: dict = {}
+    # Child uuids of the chunks selected for the context, whether or not the answer cites them
+    hit_uuids: List[str] = []
+
+    def run_query(self, query: str, params: dict) -> list:
+        with self.vectorstore._driver.session() as session:
+            return [record.data() for record in session.run(query, params)]
+
+    def run_hits(self, query: str, params: dict) -> list:
+        return [(Document(page_content=r["text"], metadata=r["metadata"]), r["score"]) for r in self.run_query(query, params)]
+
+    def select_documents(self, query_embedding: List[float]) -> List[str]:
+        query = DOCUMENT_SUMMARY_QUERY if self.owner_uuid is None else SCOPED_DOCUMENT_SUMMARY_QUERY
+        try:
+            rows = self.run_query(query, {"n": self.top_documents, "embedding": query_embedding, "owner_uuid": self.owner_uuid})
+        except ClientError as e:
+            # The document_summary index is created by the first summarize task; until then no document has a summary
+            logging.warning(f"Document summary search failed, using the chunk search: {e}")
+            return []
+        return [row["uuid"] for row in rows]
+
+    def scoped_hits(self, query: str, scan_query: str, params: dict, overfetch: int) -> list:
+        """Search the vector index for the owner's chunks, widening the fetch until k survive, else scan them."""
+        fetch = params["k"] * overfetch
+        while True:
+            hits = self.run_hits(query, {**params, "index": self.vectorstore.index_name, "fetch": fetch})
+            if len(hits) >= params["k"] or fetch >= AppConfig.CHAT_SCOPED_MAX_FETCH:
+                break
+            fetch = min(fetch * SCOPED_OVERFETCH, AppConfig.CHAT_SCOPED_MAX_FETCH)
+        if len(hits) < params["k"]:
+            hits = self.run_hits(scan_query, params)
+        return hits
+
+    def unsummarized_hits(self, params: dict) -> list:
+        if self.owner_uuid is not None:
+            return self.scoped_hits(UNSUMMARIZED_CHILD_QUERY, SCOPED_UNSUMMARIZED_CHILD_SCAN_QUERY, params, UNSUMMARIZED_OVERFETCH)
+        return self.run_hits(UNSUMMARIZED_CHILD_QUERY, {**params, "index": self.vectorstore.index_name,
+                                                        "fetch": self.fetch_k * UNSUMMARIZED_OVERFETCH})
+
+    def search(self, query_embedding: List[float]) -> list:
+        params = {"owner_uuid": self.owner_uuid, "embedding": query_embedding, "k": self.fetch_k}
+        if self.top_documents:
+            params["document_uuids"] = self.select_documents(query_embedding)
+            self.stats = {"documents": len(params["document_uuids"])}
+            if params["document_uuids"]:
+                selected = self.run_hits(DOCUMENT_CHILD_QUERY, params)
+                unsummarized = self.unsummarized_hits(params)
+                self.stats["unsummarized"] = len(unsummarized)
+                # A chunk shared by pages of both kinds of document is kept once
+                hits, seen = [], set()
+                for doc, score in sorted(selected + unsummarized, key=lambda hit: hit[1], reverse=True):
+                    if doc.metadata["uuid"] not in seen:
+                        seen.add(doc.metadata["uuid"])
+                        hits.append((doc, score))
+                return hits[:self.fetch_k]
+        if self.owner_uuid is None:
+            return self.vectorstore.similarity_search_with_score_by_vector(query_embedding, k=self.fetch_k)
+        return self.scoped_hits(SCOPED_CHILD_QUERY, SCOPED_CHILD_SCAN_QUERY, params, SCOPED_OVERFETCH)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        query_embedding = self.vectorstore.embedding.embed_query(query)
+        self.stats = {}
+        hits = self.search(query_embedding)
+        selected = mmr(query_embedding, hits, self.k, self.lambda_mult)
+        self.hit_uuids = [doc.metadata["uuid"] for doc, _ in selected]
+        windows = merge_windows(selected)
+        documents, tokens = pack(windows, self.token_budget, self.model)
+        self.stats = {**self.stats, "retrieved": len(hits), "selected": len(selected), "windows": len(windows),
+                      "packed": len(documents), "context_tokens": tokens}
+        return documents
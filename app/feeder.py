@@ -0,0 +1,133 @@
+"""
+Continuous backlog feeder for the ingest queue.
+
+Instead of loading every unprocessed Document and publishing them all at once,
+the feeder pages through the backlog with keyset pagination on the indexed
+Document uuid and only tops the ingest queue up to FEEDER_TARGET_DEPTH ready
+messages, never exceeding FEEDER_MAX_IN_FLIGHT unfinished tasks of its own.
+Memory and broker load stay flat however large the backlog is. Each page is
+ordered with the cost-aware scheduler before it is sent.
+
+Queued documents are marked with queued_at and skipped until
+FEEDER_REQUEUE_AFTER_SECONDS have passed without any pages being written, so
+several feeders (or a restart) never queue a document twice in that window.
+Tasks that are still unfinished after that long stop counting as in flight, so
+purged or lost tasks cannot stall the feeder.
+
+Usage:
+    python -m app.feeder [--once] [--generate-questions] [--generate-summaries]
+"""
+import argparse
+import logging
+import time
+
+from celery import states
+from neo4j import GraphDatabase
+
+from config import AppConfig
+from app.scheduler import schedule
+from app.task_client import get_task_infos, queue_depth, send_process_text_task
+
+
+FINISHED_STATES = states.READY_STATES | {AppConfig.PROCESSING_DONE, AppConfig.PROCESSING_FAILED, AppConfig.PROCESSING_CANCELLED}
+
+BACKLOG_PAGE_QUERY = """
+MATCH (a:Document)
+WHERE a.uuid > $after
+    AND NOT (a)-[:HAS_PAGE]->(:Page) and a.text <> '' and a.process=True AND a.cancel_requested IS NULL
+    AND (a.queued_at IS NULL OR a.queued_at < datetime() - duration({seconds: $requeue_after}))
+WITH a ORDER BY a.uuid LIMIT $limit
+RETURN a.uuid AS uuid, a.wordcount AS wordcount, size(a.text) AS chars,
+    [(ua:UserAction)-[:ADDED]-(a) | ua.useruuid][0] AS owner
+"""
+
+
+def next_documents(driver, after: str, limit: int) -> list:
+    with driver.session() as session:
+        result = session.run(BACKLOG_PAGE_QUERY, {"after": after, "limit": limit,
+                                                  "requeue_after": AppConfig.FEEDER_REQUEUE_AFTER_SECONDS})
+        return [record.data() for record in result]
+
+
+def queue_document(driver, job: dict, generateQuestions: bool, generateSummaries: bool):
+    with driver.session() as session:
+        text = session.run("MATCH (a:Document {uuid: $uuid}) RETURN a.text AS text", {"uuid": job["uuid"]}).single()["text"]
+        task = send_process_text_task(text, job["uuid"], generateQuestions, generateSummaries, job["priority"])
+        session.run("MATCH (a:Document {uuid: $uuid}) SET a.task_id = $task_id, a.queued_at = datetime()",
+                    {"uuid": job["uuid"], "task_id": task.id})
+    return task.id
+
+
+def unfinished(in_flight: dict) -> dict:
+    """
+    Keep the tasks (id -> time queued) that have not finished. Tasks purged, lost or
+    revoked before they started stay PENDING forever, so entries older than
+    FEEDER_REQUEUE_AFTER_SECONDS are dropped too, when their documents become requeueable.
+    """
+    if not in_flight:
+        return {}
+    expired = time.monotonic() - AppConfig.FEEDER_REQUEUE_AFTER_SECONDS
+    kept = {}
+    for info in get_task_infos(list(in_flight)):
+        if info["status"] in FINISHED_STATES:
+            continue
+        if in_flight[info["task_id"]] < expired:
+            logging.warning(f"Task {info['task_id']} still {info['status']} after {AppConfig.FEEDER_REQUEUE_AFTER_SECONDS}s, no longer counted in flight")
+            continue
+        kept[info["task_id"]] = in_flight[info["task_id"]]
+    return kept
+
+
+def run(driver, generateQuestions: bool, generateSummaries: bool, once: bool = False) -> int:
+    """Feed the backlog until it is empty (once) or forever. Returns the number of documents queued."""
+    cursor = ""
+    in_flight = {}
+    queued = 0
+    while True:
+        in_flight = unfinished(in_flight)
+        room = min(AppConfig.FEEDER_TARGET_DEPTH - queue_depth(AppConfig.INGEST_QUEUE),
+                   AppConfig.FEEDER_MAX_IN_FLIGHT - len(in_flight))
+        if room <= 0:
+            time.sleep(AppConfig.FEEDER_POLL_SECONDS)
+            continue
+
+        documents = next_documents(driver, cursor, min(room, AppConfig.FEEDER_PAGE_SIZE))
+        if not documents:
+            if cursor:
+                # End of the keyset; start over to pick up new and requeueable documents
+                cursor = ""
+                continue
+            if once and not in_flight:
+                return queued
+            time.sleep(AppConfig.FEEDER_POLL_SECONDS)
+            continue
+        cursor = documents[-1]["uuid"]
+
+        for job in schedule(documents):
+            try:
+                in_flight[queue_document(driver, job, generateQuestions, generateSummaries)] = time.monotonic()
+                queued += 1
+            except Exception as e:
+                logging.error(f"Failed to queue document {job['uuid']}: {e}")
+        logging.info(f"Queued {len(documents)} documents ({queued} total, {len(in_flight)} in flight)")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Feed unprocessed documents to the ingest queue with backpressure")
+    parser.add_argument("--once", action="store_true", help="Exit once the backlog is empty and every queued task finished")
+    parser.add_argument("--generate-questions", action="store_true")
+    parser.add_argument("--generate-summaries", action="store_true")
+    args = parser.parse_args()
+
+    AppConfig.initialize_environment_variables()
+    driver = GraphDatabase.driver(AppConfig.NEO4J_URI, auth=(AppConfig.NEO4J_USER, AppConfig.NEO4J_PASSWORD))
+    try:
+        queued = run(driver, args.generate_questions, args.generate_summaries, args.once)
+        logging.info(f"Backlog empty, queued {queued} documents")
+    finally:
+        driver.close()
+
+
+if __name__ == "__main__":
+    main()
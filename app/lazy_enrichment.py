@@ -0,0 +1,118 @@
+import logging
+
+from config import AppConfig
+from app.task_client import send_enrichment_tasks
+from worker.cancellation import release_enrichment_claims
+
+
+class EnrichmentBudget:
+    """
+    Sliding-window budget on the number of pages queued for lazy enrichment,
+    kept on an EnrichmentBudget node so every API process draws from the same one.
+    """
+
+    def __init__(self, max_pages: int, window_seconds: float, name: str = "lazy"):
+        self.max_pages = max_pages
+        self.window_seconds = window_seconds
+        self.name = name
+        self._constraint_ready = False
+
+    def ensure_constraint(self, driver):
+        # MERGE alone can create two budget nodes when processes race on the first request
+        if not self._constraint_ready:
+            with driver.session() as session:
+                session.run("CREATE CONSTRAINT enrichment_budget_name IF NOT EXISTS FOR (b:EnrichmentBudget) REQUIRE b.name IS UNIQUE")
+            self._constraint_ready = True
+
+    def claim(self, driver, page_uuids: list) -> dict:
+        """
+        Mark as many of the pages as the current window allows as queued for enrichment,
+        in the given order, and return the claimed page uuids grouped by document. Only
+        claimed pages are debited, in the same transaction, so pages another request
+        claimed first cost nothing.
+        """
+        self.ensure_constraint(driver)
+        # Writing updated_at first takes the node's lock, so concurrent requests read the
+        # spent list and the pages' claims in turn
+        with driver.session() as session:
+            result = session.run(
+                """
+                MERGE (b:EnrichmentBudget {name: $name})
+                SET b.updated_at = datetime()
+                WITH b, timestamp() AS now
+                WITH b, now, [t IN coalesce(b.spent, []) WHERE t > now - $window_ms] AS spent
+                CALL {
+                    UNWIND $uuids AS uuid
+                    MATCH (d:Document)-[:HAS_PAGE]->(p:Page {uuid: uuid})
+                    WHERE p.enrichment_queued IS NULL
+                    RETURN collect(p) AS pages, collect(d.uuid) AS documents
+                }
+                WITH b, now, spent, documents, pages[..CASE WHEN $max_pages > size(spent) THEN $max_pages - size(spent) ELSE 0 END] AS claimed
+                SET b.spent = spent + [p IN claimed | now]
+                FOREACH (p IN claimed | SET p.enrichment_queued = datetime())
+                WITH documents, claimed
+                UNWIND range(0, size(claimed) - 1) AS i
+                RETURN documents[i] AS document_uuid, collect(claimed[i].uuid) AS page_uuids
+                """,
+                {"name": self.name, "window_ms": int(self.window_seconds * 1000),
+                 "max_pages": self.max_pages, "uuids": page_uuids},
+            )
+            return {record["document_uuid"]: record["page_uuids"] for record in result}
+
+
+budget = EnrichmentBudget(AppConfig.LAZY_ENRICHMENT_BUDGET, AppConfig.LAZY_ENRICHMENT_WINDOW_SECONDS)
+
+
+def record_page_access(driver, child_uuids: list) -> list:
+    """
+    Increment the access counter of the pages holding the retrieved children and
+    return the uuids of hot pages that have not been enriched or queued yet.
+    Pages of cancelled documents are counted but not returned.
+    """
+    if not child_uuids:
+        return []
+    with driver.session() as session:
+        result = session.run(
+            """
+            MATCH (p:Page)-[:HAS_CHILD]->(c:Child)
+            WHERE c.uuid IN $uuids
+            WITH DISTINCT p
+            SET p.access_count = coalesce(p.access_count, 0) + 1, p.last_accessed = datetime()
+            WITH p
+            WHERE p.access_count >= $threshold
+                AND p.enrichment_queued IS NULL
+                AND NOT (p)-[:HAS_SUMMARY]->()
+                AND NOT EXISTS { MATCH (d:Document)-[:HAS_PAGE]->(p) WHERE d.cancel_requested IS NOT NULL }
+            RETURN p.uuid AS uuid
+            ORDER BY p.access_count DESC
+            """,
+            {"uuids": child_uuids, "threshold": AppConfig.HOT_PAGE_THRESHOLD},
+        )
+        return [record["uuid"] for record in result]
+
+
+def enrich_hot_pages(driver, child_uuids: list) -> list:
+    """
+    Count an access for every page behind the retrieved children and queue
+    question and summary generation for pages that crossed HOT_PAGE_THRESHOLD,
+    within the enrichment budget. Returns the queued task ids.
+    """
+    hot_pages = record_page_access(driver, child_uuids)
+    if not hot_pages:
+        return []
+
+    claimed = budget.claim(driver, hot_pages)
+    deferred = len(hot_pages) - sum(len(page_uuids) for page_uuids in claimed.values())
+    if deferred:
+        logging.info(f"Lazy enrichment budget exhausted or pages already claimed, deferring {deferred} hot pages")
+
+    # Only the claims and task messages are on the request path; the tasks run on the enrichment queue
+    task_ids = []
+    for document_uuid, page_uuids in claimed.items():
+        logging.info(f"Queueing lazy enrichment of {len(page_uuids)} pages for document {document_uuid}")
+        try:
+            task_ids.extend(send_enrichment_tasks(document_uuid, True, True, page_uuids))
+        except Exception:
+            release_enrichment_claims(driver, page_uuids)
+            raise
+    return task_ids
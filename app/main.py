@@ -1,15 +1,40 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+
+from config import AppConfig
+from .profiling import install_profiling
 from .routers import processing  
 from .routers import document  
 from .routers import chat  
+from .routers import usage
+from .routers import admin
+from .routers import utils
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Close the clients that were created lazily while serving requests
+    if chat.get_child_vectorstore.cache_info().currsize:
+        chat.get_child_vectorstore()._driver.close()
+    utils.driver.close()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 # Include the router from the processing module
 app.include_router(processing.router)
 app.include_router(document.router)
 app.include_router(chat.router)
+app.include_router(usage.router)
+app.include_router(admin.router)
 
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to Menome Processor API!"}
+
+
+# Admin-only request profiling; nothing is installed unless PROFILING_ENABLED (after all routes are added)
+if AppConfig.PROFILING_ENABLED:
+    install_profiling(app)
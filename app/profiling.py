@@ -0,0 +1,120 @@
+"""
+On-demand profiling of API requests (PROFILING_ENABLED).
+
+An admin flags a request with an `X-Profile: 1` header or `?profile=1`; other
+callers get a 403 rather than being able to fill PROFILE_DIR. The profiler
+samples only the thread running the request's endpoint: every route's endpoint
+is wrapped to register its thread (a threadpool worker for sync endpoints, the
+event loop for async ones) with the request's profiler, so concurrent requests
+on other threads stay out of the profile.
+
+ProfilingMiddleware is plain ASGI, so unflagged requests pass straight through
+and streaming responses are not buffered.
+"""
+import functools
+import inspect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders, QueryParams
+
+from config import AppConfig
+from worker.profiling import SamplingProfiler, new_profile_id, save_profile
+from app.routers.admin import get_admin_user
+from app.routers.utils import get_current_user
+
+
+PROFILE_FLAGS = {"1", "true", "yes"}
+
+# Profiler of the request being handled, set by ProfilingMiddleware; None when not profiled
+request_profiler: ContextVar = ContextVar("request_profiler", default=None)
+
+
+def profile_requested(scope) -> bool:
+    return (Headers(scope=scope).get("x-profile", "").lower() in PROFILE_FLAGS
+            or QueryParams(scope["query_string"]).get("profile", "").lower() in PROFILE_FLAGS)
+
+
+async def is_admin(scope) -> bool:
+    scheme, _, token = Headers(scope=scope).get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        get_admin_user(await get_current_user(token))
+    except HTTPException:
+        return False
+    return True
+
+
+@contextmanager
+def sampled_thread():
+    """Add the current thread to the request's profiler while the endpoint runs."""
+    profiler = request_profiler.get()
+    if profiler is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    profiler.thread_ids.add(thread_id)
+    try:
+        yield
+    finally:
+        profiler.thread_ids.discard(thread_id)
+
+
+def sampled_endpoint(call):
+    # FastAPI decides how to run the endpoint from the callable, so keep it sync or async
+    if inspect.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def endpoint(*args, **kwargs):
+            with sampled_thread():
+                return await call(*args, **kwargs)
+    else:
+        @functools.wraps(call)
+        def endpoint(*args, **kwargs):
+            with sampled_thread():
+                return call(*args, **kwargs)
+    return endpoint
+
+
+class ProfilingMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profile_requested(scope):
+            await self.app(scope, receive, send)
+            return
+        if not await is_admin(scope):
+            await JSONResponse({"detail": "Profiling is admin only"}, status_code=403)(scope, receive, send)
+            return
+
+        profiler = SamplingProfiler(AppConfig.PROFILE_SAMPLE_INTERVAL_MS / 1000, thread_ids=set())
+        profile_id = new_profile_id()
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("X-Profile-Id", profile_id)
+            await send(message)
+
+        token = request_profiler.set(profiler)
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop()
+            request_profiler.reset(token)
+            await run_in_threadpool(save_profile, profiler, f"{scope['method']} {scope['path']}", profile_id)
+
+
+def install_profiling(app):
+    """Wrap the endpoints of the routes added so far and add ProfilingMiddleware."""
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            route.dependant.call = sampled_endpoint(route.dependant.call)
+    app.add_middleware(ProfilingMiddleware)
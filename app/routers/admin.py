@@ -0,0 +1,48 @@
+import json
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse
+
+from config import AppConfig
+from models import User
+from app.routers.utils import get_current_user
+from worker.profiling import PROFILE_ID, list_profiles, profile_path
+
+
+router = APIRouter()
+
+PROFILE_FORMATS = {"svg": "image/svg+xml", "folded": "text/plain"}
+
+
+def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    if current_user.uuid != AppConfig.DEFAULT_USER_UUID:
+        raise HTTPException(status_code=403, detail="Admin only")
+    return current_user
+
+
+def existing_profile_path(profile_id: str, extension: str) -> str:
+    # The id becomes a file name, so only accept ids in the format save_profile generates
+    path = profile_path(profile_id, extension) if PROFILE_ID.match(profile_id) else None
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return path
+
+
+## Profiles captured with the X-Profile header, ?profile=1 or a profiled process_text_task
+@router.get("/admin/profiles", tags=["Admin"], summary="Most recent profiles, newest first")
+def get_profiles(limit: int = Query(default=50, ge=1, le=1000), admin: User = Depends(get_admin_user)):
+    return list_profiles(limit)
+
+
+@router.get("/admin/profiles/{profile_id}", tags=["Admin"], summary="Profile summary with the hottest functions by self and total samples")
+def get_profile(profile_id: str, admin: User = Depends(get_admin_user)):
+    with open(existing_profile_path(profile_id, "json")) as f:
+        return json.load(f)
+
+
+@router.get("/admin/profiles/{profile_id}/{format}", tags=["Admin"], summary="Flame graph as svg, or folded stacks for flamegraph.pl or speedscope")
+def get_profile_file(profile_id: str, format: str, admin: User = Depends(get_admin_user)):
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {sorted(PROFILE_FORMATS)}")
+    return FileResponse(existing_profile_path(profile_id, format), media_type=PROFILE_FORMATS[format])
@@ -1,26 +1,19 @@
 import os
-import sys
-from fastapi import APIRouter, Body
+from fastapi import APIRouter, Body, HTTPException, Response
 from config import AppConfig
-from app.routers.utils import fetch_node_properties_by_uuid, setup_graph_db
+from app.routers.utils import SOURCE_FIELDS, fetch_node_properties_by_uuid, setup_graph_db
 from pydantic import BaseModel
-import json
+import orjson
 
-from langchain.vectorstores import Neo4jVector
 from neo4j import GraphDatabase
 from neo4j.exceptions import ServiceUnavailable
+from functools import lru_cache
 
-from langchain.chains.summarize import load_summarize_chain
-from langchain.chains import RetrievalQAWithSourcesChain
-from langchain.chat_models import ChatOpenAI
-import openai
-
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.pydantic_v1 import BaseModel
 from models import User
 
 from fastapi import Depends
 from app.routers.utils import get_current_user, get_user_from_db, neo4j_datetime_to_python_datetime
+from app.lazy_enrichment import enrich_hot_pages
 
 import logging 
 import time
@@ -41,7 +34,6 @@ logging.getLogger("langchain").setLevel(logging.INFO)
 
 # Initialze environment:
 os.environ["OPENAI_API_KEY"] =AppConfig.OPENAI_API_KEY
-openai.api_key =  AppConfig.OPENAI_API_KEY
 
 # Initialize Neo4j driver (do this once, e.g., at the top of your file or in another module)
 uri = AppConfig.NEO4J_URI
@@ -52,57 +44,61 @@ class Question(BaseModel):
 
 
 
-# Try initializing the parent_retriever vector store
-try:
-    # setup Parent retriever for advanced RAG pattern
-    parent_query = """
-    MATCH (node)<-[:HAS_CHILD]-(parent)
-    WITH parent, max(score) AS score 
-    RETURN parent.uuid as uuid, parent.uuid as source, parent.text AS text, score, {} AS metadata LIMIT 5
-    """
-
-    parent_vectorstore = Neo4jVector.from_existing_index(
-        OpenAIEmbeddings(openai_api_key=AppConfig.OPENAI_API_KEY),
+# Vector stores and LLM clients are built on first use rather than at import,
+# so API startup and --reload cycles stay fast
+@lru_cache(maxsize=None)
+def get_query_embeddings():
+    # One backend instance per process, so a local model is loaded once and
+    # concurrent requests share its batching thread
+    from worker.embeddings import create_embeddings, check_index_dimensions
+    from app.routers.utils import driver
+    check_index_dimensions(driver)
+    return create_embeddings()
+
+
+def build_vectorstore(node_label: str, **kwargs):
+    from langchain.vectorstores import Neo4jVector
+    from app.routers.utils import driver
+
+    def from_existing_index():
+        return Neo4jVector.from_existing_index(
+            get_query_embeddings(),
+            url=AppConfig.NEO4J_URI,
+            username=AppConfig.NEO4J_USER,
+            password=AppConfig.NEO4J_PASSWORD,
+            node_label=node_label,
+            **kwargs,
+        )
+
+    try:
+        return from_existing_index()
+    except ServiceUnavailable as e:
+        if "Index not found" in str(e):  # Replace with the appropriate error message for your setup
+            # If the index does not exist, set it up and open it; a second failure
+            # raises, so the callers' lru_cache never keeps a missing vector store
+            setup_graph_db(driver, kwargs["index_name"], node_label)
+            return from_existing_index()
+        else:
+            raise e  # If the error is due to another reason, raise the exception
+
+
+# Child chunks with their page, for the context packer
+@lru_cache(maxsize=None)
+def get_child_vectorstore():
+    from app.context_packer import CHILD_CONTEXT_QUERY
+    return build_vectorstore(
+        "Child",
         index_name="parent_document",
-        url=AppConfig.NEO4J_URI,
-        username=AppConfig.NEO4J_USER,
-        password=AppConfig.NEO4J_PASSWORD,
-        retrieval_query=parent_query,
-        #text_node_property="text",
-        #node_label="Child",
+        retrieval_query=CHILD_CONTEXT_QUERY,
     )
-except ServiceUnavailable as e:
-    if "Index not found" in str(e):  # Replace with the appropriate error message for your setup
-        setup_graph_db()  # If the index does not exist, set it up
-    else:
-        raise e  # If the error is due to another reason, raise the exception
-
-
-# Try initializing the vector store
-try:
-    # setup Parent retriever for advanced RAG pattern
-    parent_query = """
-    MATCH (node)<-[:HAS_CHILD]-(parent)
-    WITH parent, max(score) AS score 
-    RETURN parent.uuid as uuid, parent.uuid as source, parent.text AS text, score, {} AS metadata LIMIT 5
-    """
-
-    typical_vectorstore = Neo4jVector.from_existing_index(
-        OpenAIEmbeddings(openai_api_key=AppConfig.OPENAI_API_KEY),
-        index_name="typical_rag",
-        url=AppConfig.NEO4J_URI,
-        username=AppConfig.NEO4J_USER,
-        password=AppConfig.NEO4J_PASSWORD,
-        #retrieval_query=parent_query,
-        text_node_property="text",
-        node_label="Child",
-        
-    )
-except ServiceUnavailable as e:
-    if "Index not found" in str(e):  # Replace with the appropriate error message for your setup
-        setup_graph_db()  # If the index does not exist, set it up
-    else:
-        raise e  # If the error is due to another reason, raise the exception
+
+
+CHAT_MODEL = "gpt-4-1106-preview"
+
+@lru_cache(maxsize=None)
+def get_chat_llm():
+    from langchain.chat_models import ChatOpenAI
+    return ChatOpenAI(temperature=1, max_tokens=4000, model_name=CHAT_MODEL, openai_api_key=AppConfig.OPENAI_API_KEY)
 
 
 class ChatRequest(BaseModel):
@@ -113,31 +109,55 @@ class ChatRequest(BaseModel):
              summary="Chat with source references",
              description="This endpoint provides a chat response along with sources of information. It uses the ChatOpenAI model for generating responses.",
              tags=["Chat", "Sources"])
-def chatSourcesquestion(question: str = Query(..., description="The question to be processed"), current_user: User = Depends(get_current_user)):
+def chatSourcesquestion(
+    question: str = Query(..., description="The question to be processed"),
+    scope: str = Query(default=AppConfig.CHAT_DEFAULT_SCOPE, description="'all' searches every document, 'user' only the current user's documents"),
+    retrieval: str = Query(default=AppConfig.CHAT_DEFAULT_RETRIEVAL, description="'chunks' searches chunks directly, 'two_stage' first selects documents by their summary and searches only their chunks"),
+    source_fields: str = Query(default=",".join(SOURCE_FIELDS), description="Comma-separated page fields returned with each source: children, questions, summaries; empty for none"),
+    max_text_chars: int = Query(default=None, ge=0, description="Cut every source text to this many characters"),
+    max_pages: int = Query(default=None, ge=0, description="Return at most this many pages per source document"),
+    current_user: User = Depends(get_current_user)):
+    if scope not in ("all", "user"):
+        raise HTTPException(status_code=400, detail="scope must be 'all' or 'user'")
+    if retrieval not in ("chunks", "two_stage"):
+        raise HTTPException(status_code=400, detail="retrieval must be 'chunks' or 'two_stage'")
+    fields = [field.strip() for field in source_fields.split(",") if field.strip()]
+    if any(field not in SOURCE_FIELDS for field in fields):
+        raise HTTPException(status_code=400, detail=f"source_fields must be a subset of {list(SOURCE_FIELDS)}")
     driver = GraphDatabase.driver(uri, auth=(AppConfig.NEO4J_USER, AppConfig.NEO4J_PASSWORD))  
 
     # Start measuring time
     start_time = time.time()
-    request_payload = json.dumps({"question": question}).encode('utf-8')
-    request_payload_size = sys.getsizeof(request_payload)
-
-    # Generate a response in chatGPT style based on the user's question
+    request_payload_size = len(question.encode('utf-8'))
+
+    # Generate a response in chatGPT style based on the user's question.
+    # Retrieved chunks are deduplicated, merged into page windows and packed
+    # into the prompt token budget before they reach the LLM.
+    from langchain.chains import RetrievalQAWithSourcesChain
+    from app.context_packer import PackedContextRetriever
+    owner_uuid = current_user.uuid if scope == "user" else None
+    retriever = PackedContextRetriever(vectorstore=get_child_vectorstore(), model=CHAT_MODEL,
+                                       owner_uuid=owner_uuid,
+                                       top_documents=AppConfig.CHAT_SUMMARY_TOP_DOCUMENTS if retrieval == "two_stage" else None)
     chain = RetrievalQAWithSourcesChain.from_chain_type(
-        ChatOpenAI(temperature=1, max_tokens=4000, model_name="gpt-4-1106-preview", openai_api_key=AppConfig.OPENAI_API_KEY),
+        get_chat_llm(),
         chain_type="stuff",
-        retriever=typical_vectorstore.as_retriever(search_kwargs={"k": 5, 'score_threshold': 0.5})
+        retriever=retriever,
     )
 
     # Measure time after setting up the chain
     setup_time = time.time()
 
-    langchain_response = chain({"question": question}, return_only_outputs=False)
+    from worker.usage import UsageLedger, append_chat_usage
+    ledger = UsageLedger()
+    with ledger.stage("chain"):
+        # The retriever embeds the question once
+        ledger.record_embeddings([question])
+        langchain_response = chain({"question": question}, return_only_outputs=False)
 
 
     # Measure time after getting the response
     langchain_response_time = time.time()
-    langchain_response_payload = json.dumps(langchain_response).encode('utf-8')
-    langchain_response_payload_size = sys.getsizeof(langchain_response_payload)
 
     # Extract 'answer' and 'sources' (UUIDs) from the chain response
     answer = langchain_response.get('answer', '')
@@ -146,10 +166,17 @@ def chatSourcesquestion(question: str = Query(..., description="The question to
     if isinstance(uuids, str):
         uuids = [uuid.strip() for uuid in uuids.split(",")]
 
+    # Count page hits from what was retrieved, not what the LLM chose to cite,
+    # and queue enrichment for pages that became hot
+    if AppConfig.ENRICHMENT_MODE == "lazy":
+        try:
+            enrich_hot_pages(driver, retriever.hit_uuids)
+        except Exception as e:
+            logging.error(f"Failed to record page access: {e}")
+
     # Fetch node properties from Neo4j based on UUIDs
-    nodes_data = fetch_node_properties_by_uuid(driver, uuids)
-    nodes_data_payload = json.dumps(nodes_data).encode('utf-8')
-    nodes_data_payload_size = sys.getsizeof(nodes_data_payload)
+    with ledger.stage("fetch"):
+        nodes_data = fetch_node_properties_by_uuid(driver, uuids, fields, max_text_chars, max_pages, owner_uuid)
 
     # Measure time after fetching data from Neo4j
     neo4j_fetch_time = time.time()
@@ -162,9 +189,22 @@ def chatSourcesquestion(question: str = Query(..., description="The question to
     
     driver.close()
 
-    return {
-        "answer": answer,
-        "sources": nodes_data,
+    usage = ledger.as_dict()
+    try:
+        append_chat_usage({"user": current_user.uuid, "question": question[:200], "sources": len(uuids),
+                           "context_tokens": retriever.stats.get("context_tokens"), **usage})
+    except OSError as e:
+        logging.error(f"Failed to record chat usage: {e}")
+
+    # The answer and sources are serialized once, measured, and embedded as is in the
+    # response body, which is returned directly instead of going through FastAPI's encoder
+    answer_payload = orjson.dumps(answer)
+    sources_payload = orjson.dumps(nodes_data, default=str)
+    body = orjson.dumps({
+        "answer": orjson.Fragment(answer_payload),
+        "sources": orjson.Fragment(sources_payload),
+        "context": retriever.stats,
+        "usage": usage,
         "timings": {
             "setup_duration": setup_duration,
             "langchain_response_duration": response_duration,
@@ -173,9 +213,10 @@ def chatSourcesquestion(question: str = Query(..., description="The question to
         },
         "payload_sizes": {
             "request_size": request_payload_size,
-            "response_size": langchain_response_payload_size,
-            "db_response_size": nodes_data_payload_size
+            "response_size": len(answer_payload),
+            "db_response_size": len(sources_payload)
         }
-    }
+    })
+    return Response(content=body, media_type="application/json")
 
 
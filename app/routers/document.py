@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from bs4 import BeautifulSoup, Comment
 from typing import List
 from jose import JWTError, jwt
@@ -10,11 +10,14 @@ import httpx
 
 from config import AppConfig
 from models import User, DocumentRequest, DefaultIcons, UserIn
-from worker.tasks import process_text_task, get_task_info, purge_celery_queue
-from app.routers.utils import get_current_user, get_user_from_db, neo4j_datetime_to_python_datetime
+from app.scheduler import estimate_tokens, priority_for
+from app.task_client import send_process_text_task, send_compaction_task, revoke_task
+from app.routers.admin import get_admin_user
+from app.routers.utils import driver, get_current_user, get_user_from_db, neo4j_datetime_to_python_datetime
+from worker.cancellation import clear_cancel, request_cancel
+from worker.compaction import delete_document
 
 
-from langchain.chat_models import ChatOpenAI
 from fastapi.security import OAuth2PasswordBearer
 from neo4j import GraphDatabase, Transaction  # Import Neo4j driver
 
@@ -22,7 +25,6 @@ import logging
 
 # Global Variables
 router = APIRouter()
-llm = ChatOpenAI(temperature=0, model="gpt-4-1106-preview")
 # Initialize environment variables if needed
 AppConfig.initialize_environment_variables()
 
@@ -190,9 +192,12 @@ async def add_document(request: DocumentRequest, current_user: User = Depends(ge
             result = session.run("MATCH (a:Document {uuid: $uuid}) RETURN a", {"uuid": documentId})
             document_data = result.single().value()
             text = document_data['text']
-            # Pass the generateQuestions and generateSummaries flags to the task
-            task = process_text_task.delay(text, documentId, True, True)
+            # Pass the generateQuestions and generateSummaries flags to the task;
+            # in lazy mode pages are enriched once chat traffic shows they are hot
+            enrich = AppConfig.ENRICHMENT_MODE == "eager"
+            task = send_process_text_task(text, documentId, enrich, enrich, priority_for(estimate_tokens(wordcount, len(text))))
             task_ids.append(task.id)
+            session.run("MATCH (a:Document {uuid: $uuid}) SET a.task_id = $task_id", {"uuid": documentId, "task_id": task.id})
             logging.info(f"Queued document {documentId} with task ID {task.id}")
     except Exception as e:
         logging.error(f"Failed to queue document {documentId}: {e}")
@@ -204,3 +209,86 @@ async def add_document(request: DocumentRequest, current_user: User = Depends(ge
             "task_ids": task_ids
         }
 
+
+
+## Ownership check for document changes: the user who added it, or the default admin user
+def check_document_access(session, documentId: str, current_user: User):
+    record = session.run(
+        """
+        MATCH (d:Document {uuid: $uuid})
+        RETURN EXISTS { (:UserAction {useruuid: $useruuid})-[:ADDED]-(d) } AS owned
+        """,
+        {"uuid": documentId, "useruuid": current_user.uuid},
+    ).single()
+    if record is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if not record["owned"] and current_user.uuid != AppConfig.DEFAULT_USER_UUID:
+        raise HTTPException(status_code=403, detail="Only the user who added a document can change it")
+
+
+@router.delete("/documents/{document_id}",
+               summary="Delete a document",
+               description="Removes the document and detaches its pages at once; its pages, chunks, questions and summaries are removed by a compaction task queued straight away",
+               tags=["Documents"])
+def delete_document_endpoint(document_id: str, current_user: User = Depends(get_current_user)):
+    with driver.session() as session:
+        check_document_access(session, document_id, current_user)
+    delete_document(driver, document_id)
+    task = send_compaction_task()
+    return {"message": f"Document {document_id} deleted", "compaction_task_id": task.id}
+
+
+def cancel_document_processing(document_id: str, current_user: User) -> dict:
+    with driver.session() as session:
+        check_document_access(session, document_id, current_user)
+    task_id = request_cancel(driver, document_id)
+    # Still queued: dropped by the worker; already running: stops before its next page
+    if task_id:
+        revoke_task(task_id)
+    return {"uuid": document_id, "task_id": task_id, "message": "Cancellation requested"}
+
+
+@router.post("/documents/{document_id}/cancel",
+             summary="Stop processing a document",
+             description="Running ingest and enrichment tasks stop before their next page and keep the pages already written; queued ones are dropped. The document is not picked up by /process-documents or the feeder until the cancellation is withdrawn",
+             tags=["Documents"])
+def cancel_document(document_id: str, current_user: User = Depends(get_current_user)):
+    return cancel_document_processing(document_id, current_user)
+
+
+@router.delete("/documents/{document_id}/cancel",
+               summary="Withdraw a cancellation",
+               description="Clears the cancel request and the cancelled_* fields so the document can be processed again",
+               tags=["Documents"])
+def withdraw_document_cancel(document_id: str, current_user: User = Depends(get_current_user)):
+    with driver.session() as session:
+        check_document_access(session, document_id, current_user)
+    clear_cancel(driver, document_id)
+    return {"uuid": document_id, "message": "Cancellation withdrawn"}
+
+
+@router.put("/documents/{document_id}/retention",
+            summary="Set how long a document is kept",
+            description="The document is deleted by the first compaction after the given number of days; 0 keeps it indefinitely",
+            tags=["Documents"])
+def set_document_retention(document_id: str, days: int = Query(..., ge=0), current_user: User = Depends(get_current_user)):
+    with driver.session() as session:
+        check_document_access(session, document_id, current_user)
+        record = session.run(
+            """
+            MATCH (d:Document {uuid: $uuid})
+            SET d.expires_at = CASE WHEN $days > 0 THEN datetime() + duration({days: $days}) ELSE null END
+            RETURN toString(d.expires_at) AS expires_at
+            """,
+            {"uuid": document_id, "days": days},
+        ).single()
+    return {"uuid": document_id, "expires_at": record["expires_at"]}
+
+
+@router.post("/documents/compact",
+             summary="Run graph compaction now",
+             description="Admin only. Deletes expired documents and orphaned or superseded pages, chunks, questions, summaries and user actions in batches. Poll /task/{task_id} for the report of nodes deleted and vector index entries reclaimed",
+             tags=["Documents"])
+def compact_documents(admin: User = Depends(get_admin_user)):
+    task = send_compaction_task()
+    return {"task_id": task.id}
@@ -1,15 +1,26 @@
 from fastapi import APIRouter, Query, Depends
 from fastapi import Depends, HTTPException, status, APIRouter
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
-from models import User,UserIn  # Import your User model
+from models import User, UserIn, TaskStatusRequest  # Import your User model
 from neo4j import GraphDatabase  # Import Neo4j driver
 import logging
+import asyncio
+import json
+import time
+from typing import List
 from datetime import datetime,  timedelta
 
-from worker.tasks import process_text_task, get_task_info, purge_celery_queue
+from app.scheduler import PENDING_DOCUMENTS_QUERY, pending_documents_params, schedule
+from app.task_client import send_process_text_task, send_divide_task, check_worker_health, get_task_info, get_task_infos, purge_celery_queue, revoke_task
+from app.routers.admin import get_admin_user
+from app.routers.document import cancel_document_processing
+from app.routers.utils import driver as shared_driver
 
 from config import AppConfig
 from dotenv import load_dotenv
@@ -113,45 +124,54 @@ async def process_documents(
     document_limit: int = Query(default=None, description="Limit on number of documents to process"),
     generateQuestions: bool = Query(default=False, description="Flag to generate questions"),
     generateSummaries: bool = Query(default=False, description="Flag to generate summaries"),
+    priority: int = Query(default=None, ge=0, le=AppConfig.QUEUE_MAX_PRIORITY, description="Celery priority for every queued document, overriding the cost-based priority"),
+    profileTasks: bool = Query(default=False, description="Profile each processing task; the profile id is returned in the task result"),
+    deadline_seconds: float = Query(default=None, gt=0, description="Stop each document's ingest this many seconds from now, keeping the pages written so far"),
     current_user: User = Depends(get_current_user)):
     logging.basicConfig(level=logging.INFO)
+    if profileTasks:
+        # Profiles are written to PROFILE_DIR, so only an admin can ask for them
+        if not AppConfig.PROFILING_ENABLED:
+            raise HTTPException(status_code=400, detail="Profiling is disabled (PROFILING_ENABLED)")
+        get_admin_user(current_user)
     
     # Setup neo4j driver
     driver = GraphDatabase.driver(AppConfig.NEO4J_URI, auth=(AppConfig.NEO4J_USER, AppConfig.NEO4J_PASSWORD))
 
-    query = "MATCH (a:Document) WHERE NOT (a)-[:HAS_PAGE]->(:Page) and a.text <> '' and a.process=True RETURN a.uuid as uuid"
-    if document_limit is not None:
-        query += f" LIMIT {document_limit}"
-    
     logging.info("Querying for documents to process.")
-    document_ids = []
     with driver.session() as session:
-        result = session.run(query)
-        document_ids = [record['uuid'] for record in result]
-    session.close()
+        result = session.run(PENDING_DOCUMENTS_QUERY, pending_documents_params(document_limit))
+        documents = [record.data() for record in result]
 
-    logging.info(f"Found {len(document_ids)} documents to process.")
+    # Cheapest documents first within each owner, fair share across owners
+    scheduled = schedule(documents, priority)
+    deadline = time.time() + deadline_seconds if deadline_seconds else None
+    if document_limit is not None:
+        scheduled = scheduled[:document_limit]
+    logging.info(f"Found {len(documents)} documents to process, queueing {len(scheduled)}.")
     
     task_ids = []
-    for document_id in document_ids:
-        try:
-            logging.info(f"Queueing document {document_id} for processing.")
-            with driver.session() as session:
-                result = session.run("MATCH (a:Document {uuid: $uuid}) RETURN a", {"uuid": document_id})
-                document_data = result.single().value()
-                text = document_data['text']
-                # Pass the generateQuestions and generateSummaries flags to the task
-                task = process_text_task.delay(text, document_id, generateQuestions, generateSummaries)
-                task_ids.append(task.id)
-                logging.info(f"Queued document {document_id} with task ID {task.id}")
-        except Exception as e:
-            logging.error(f"Failed to queue document {document_id}: {e}")
-        finally:
-            session.close()
-            driver.close()
+    try:
+        for job in scheduled:
+            document_id = job["uuid"]
+            try:
+                logging.info(f"Queueing document {document_id} for processing (~{job['tokens']} tokens, owner {job['owner']}, priority {job['priority']}).")
+                with driver.session() as session:
+                    result = session.run("MATCH (a:Document {uuid: $uuid}) RETURN a", {"uuid": document_id})
+                    document_data = result.single().value()
+                    text = document_data['text']
+                    # Pass the generateQuestions and generateSummaries flags to the task
+                    task = send_process_text_task(text, document_id, generateQuestions, generateSummaries, job["priority"], profileTasks, deadline)
+                    task_ids.append(task.id)
+                    session.run("MATCH (a:Document {uuid: $uuid}) SET a.task_id = $task_id, a.queued_at = datetime()", {"uuid": document_id, "task_id": task.id})
+                    logging.info(f"Queued document {document_id} with task ID {task.id}")
+            except Exception as e:
+                logging.error(f"Failed to queue document {document_id}: {e}")
+    finally:
+        driver.close()
 
     return {
-        "message": f"Processing started for {len(document_ids)} documents",
+        "message": f"Processing started for {len(scheduled)} documents",
         "task_ids": task_ids
     }
 
@@ -174,18 +194,178 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 ## Basic health check
 @router.post("/divide")
 async def divide(x: int, y: int):
-    from worker.tasks import divide
-    result = divide.delay(x, y)
+    result = send_divide_task(x, y)
     return {"task_id": result.id}
 
 
+## Worker health check: Neo4j connectivity and pool settings of a worker process
+@router.get("/health/worker", tags=["Queue Management"], summary="Check a worker consuming the given queue")
+async def worker_health(queue: str = Query(default="celery", description="Queue whose worker should answer, e.g. celery, ingest or enrichment")):
+    try:
+        return await run_in_threadpool(check_worker_health, queue)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"No healthy worker on queue {queue}: {e}")
+
+
 ## Returns the status of the submitted Task
 @router.get("/task/{task_id}")
 async def get_task_status(task_id: str): 
     """
     Return the status of the submitted Task
     """
-    return get_task_info(task_id)
+    return await run_in_threadpool(get_task_info, task_id)
+
+
+
+## Cancels a task through the document it processes
+@router.post("/task/{task_id}/cancel", tags=["Process"]
+             , description="Cancels the document the task is processing: the task stops before its next page, keeping the pages already written, and later tasks for the document are dropped. A task not tied to a document can only be revoked, before it starts, by an admin"
+             , summary="Cancel a queued or running processing task")
+def cancel_task(task_id: str, current_user: User = Depends(get_current_user)):
+    info = get_task_info(task_id)
+    document_id = (info.get("progress") or {}).get("documentId")
+    if document_id is None:
+        with shared_driver.session() as session:
+            record = session.run("MATCH (d:Document {task_id: $task_id}) RETURN d.uuid AS uuid", {"task_id": task_id}).single()
+        document_id = record["uuid"] if record else None
+    if document_id is None:
+        # Nothing to check ownership against
+        get_admin_user(current_user)
+        revoke_task(task_id)
+        return {"task_id": task_id, "uuid": None, "message": "Task revoked"}
+    # Checks access to the document before anything is revoked
+    result = cancel_document_processing(document_id, current_user)
+    revoke_task(task_id)
+    return {**result, "task_id": task_id}
+
+
+## Returns the status of many tasks in one call
+@router.post("/tasks/status", tags=["Process"]
+             , description="Return aggregate and per-task status for many tasks"
+             , summary="Resolve the states of many tasks, given by id or by the documents they process, in one backend round trip")
+async def get_tasks_status(request: TaskStatusRequest):
+    task_ids = list(request.task_ids or [])
+
+    # Documents record the id of the task that last processed them
+    if request.document_ids:
+        def fetch_document_task_ids():
+            driver = GraphDatabase.driver(AppConfig.NEO4J_URI, auth=(AppConfig.NEO4J_USER, AppConfig.NEO4J_PASSWORD))
+            with driver.session() as session:
+                result = session.run(
+                    "MATCH (a:Document) WHERE a.uuid IN $uuids AND a.task_id IS NOT NULL RETURN a.task_id AS task_id",
+                    {"uuids": request.document_ids})
+                ids = [record["task_id"] for record in result]
+            driver.close()
+            return ids
+        task_ids.extend(await run_in_threadpool(fetch_document_task_ids))
+
+    # Keep order, drop duplicates
+    task_ids = list(dict.fromkeys(task_ids))
+    if not task_ids:
+        raise HTTPException(status_code=400, detail="Provide task_ids or document_ids")
+
+    infos = await run_in_threadpool(get_task_infos, task_ids)
+
+    counts = {}
+    for info in infos:
+        counts[info["status"]] = counts.get(info["status"], 0) + 1
+
+    page = max(request.page, 1)
+    page_size = min(max(request.page_size, 1), 1000)
+    start = (page - 1) * page_size
+    return {
+        "total": len(infos),
+        "counts": counts,
+        "page": page,
+        "page_size": page_size,
+        "tasks": infos[start:start + page_size]
+    }
+
+
+# Terminal task states: once reached, a task is dropped from a progress stream
+FINISHED_STATES = {"SUCCESS", "FAILURE", "REVOKED", AppConfig.PROCESSING_DONE, AppConfig.PROCESSING_FAILED, AppConfig.PROCESSING_CANCELLED}
+
+async def poll_task_changes(task_ids: set, last_seen: dict, last_changed: dict) -> tuple:
+    """
+    Fetch the current info for task_ids off the event loop and return the entries
+    that changed since last_seen, and the entries that timed out. Finished tasks are
+    removed from task_ids, and so are tasks whose info has not changed for
+    PROGRESS_STREAM_IDLE_TIMEOUT seconds: unknown ids stay PENDING forever.
+    """
+    infos = await run_in_threadpool(get_task_infos, list(task_ids))
+    now = time.monotonic()
+    changes, timed_out = [], []
+    for info in infos:
+        task_id = info["task_id"]
+        if last_seen.get(task_id) != info:
+            last_seen[task_id] = info
+            last_changed[task_id] = now
+            changes.append(info)
+        if info["status"] in FINISHED_STATES:
+            task_ids.discard(task_id)
+        elif now - last_changed[task_id] >= AppConfig.PROGRESS_STREAM_IDLE_TIMEOUT:
+            task_ids.discard(task_id)
+            timed_out.append(info)
+    return changes, timed_out
+
+
+## Streams progress for one or many tasks as server-sent events
+@router.get("/tasks/stream", tags=["Process"]
+            , description="Stream progress for one or many tasks as server-sent events"
+            , summary="Pushes a progress event whenever a task changes state or page, a timeout event for a task idle for PROGRESS_STREAM_IDLE_TIMEOUT seconds (such as an unknown id), and closes once all tasks are finished or timed out")
+async def stream_task_progress(task_ids: List[str] = Query(..., description="Task ids to follow")):
+    async def event_stream():
+        pending = set(task_ids)
+        last_seen, last_changed = {}, {}
+        while pending:
+            changes, timed_out = await poll_task_changes(pending, last_seen, last_changed)
+            for info in changes:
+                yield f"event: progress\ndata: {json.dumps(info, default=str)}\n\n"
+            for info in timed_out:
+                yield f"event: timeout\ndata: {json.dumps(info, default=str)}\n\n"
+            if pending:
+                await asyncio.sleep(AppConfig.PROGRESS_STREAM_INTERVAL)
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+## Pushes task progress over a websocket
+@router.websocket("/ws/tasks")
+async def task_progress_socket(websocket: WebSocket):
+    """
+    Clients send {"task_ids": [...]} at any time to add tasks to follow.
+    The server pushes a JSON message for every task whose info changed, the
+    info with "timed_out": true for a task idle for PROGRESS_STREAM_IDLE_TIMEOUT
+    seconds, and {"error": ...} for a message it cannot read.
+    """
+    await websocket.accept()
+    pending = set()
+    last_seen, last_changed = {}, {}
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive_json(), timeout=AppConfig.PROGRESS_STREAM_INTERVAL)
+                task_ids = message.get("task_ids") if isinstance(message, dict) else None
+                if not isinstance(task_ids, list) or not all(isinstance(task_id, str) for task_id in task_ids):
+                    await websocket.send_text(json.dumps({"error": 'Expected {"task_ids": [...]} with string task ids'}))
+                else:
+                    # Following a task again restarts its idle timeout
+                    for task_id in task_ids:
+                        last_seen.pop(task_id, None)
+                    pending.update(task_ids)
+            except asyncio.TimeoutError:
+                pass
+            except ValueError:
+                await websocket.send_text(json.dumps({"error": "Messages must be JSON"}))
+            if pending:
+                changes, timed_out = await poll_task_changes(pending, last_seen, last_changed)
+                for info in changes:
+                    await websocket.send_text(json.dumps(info, default=str))
+                for info in timed_out:
+                    await websocket.send_text(json.dumps({**info, "timed_out": True}, default=str))
+    except WebSocketDisconnect:
+        logging.info("Task progress websocket closed")
 
 
 ## Purge all tasks in the Celery queue
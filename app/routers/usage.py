@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from models import User
+from app.routers.admin import get_admin_user
+from app.routers.utils import driver
+from worker.usage import DOCUMENT_STAGES, FIELDS, TOKEN_FIELDS, usage_property, read_chat_usage
+
+
+# Usage spans every user's documents and questions, so the routes are for admins only
+router = APIRouter()
+
+ORDER_BY = {"tokens": "usage_tokens", "seconds": "usage_seconds"}
+
+
+# Only the keys document_usage reads, so the document text never leaves the database
+DOCUMENT_USAGE_PROPERTIES = """
+    d {.uuid, .name, .wordcount, usage: [key IN keys(d) WHERE key STARTS WITH 'usage_' | [key, d[key]]]} AS properties
+    """
+
+
+def usage_properties(record) -> dict:
+    properties = dict(record["properties"])
+    return {**properties, **dict(properties.pop("usage"))}
+
+
+def document_usage(properties: dict) -> dict:
+    stages = {}
+    for stage in DOCUMENT_STAGES:
+        usage = {field: properties.get(usage_property(stage, field)) or 0 for field in FIELDS}
+        if any(usage.values()):
+            stages[stage] = usage
+    return {
+        "uuid": properties.get("uuid"),
+        "name": properties.get("name"),
+        "wordcount": properties.get("wordcount"),
+        "tokens": properties.get("usage_tokens") or 0,
+        "seconds": properties.get("usage_seconds") or 0,
+        "stages": stages,
+    }
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+## Most expensive documents
+@router.get("/usage/documents", tags=["Usage"], summary="Documents ordered by tokens or seconds spent processing them")
+def usage_documents(
+    order_by: str = Query(default="tokens", description="tokens or seconds"),
+    limit: int = Query(default=20, ge=1, le=1000),
+    admin: User = Depends(get_admin_user)):
+    if order_by not in ORDER_BY:
+        raise HTTPException(status_code=400, detail=f"order_by must be one of {sorted(ORDER_BY)}")
+    with driver.session() as session:
+        result = session.run(
+            f"""
+            MATCH (d:Document) WHERE d.usage_tokens IS NOT NULL
+            WITH d ORDER BY d.{ORDER_BY[order_by]} DESC LIMIT $limit
+            RETURN {DOCUMENT_USAGE_PROPERTIES}
+            """,
+            {"limit": limit},
+        )
+        return [document_usage(usage_properties(record)) for record in result]
+
+
+@router.get("/usage/documents/{document_id}", tags=["Usage"], summary="Per stage usage of one document")
+def usage_document(document_id: str, admin: User = Depends(get_admin_user)):
+    with driver.session() as session:
+        record = session.run(f"MATCH (d:Document {{uuid: $uuid}}) RETURN {DOCUMENT_USAGE_PROPERTIES}", {"uuid": document_id}).single()
+    if record is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document_usage(usage_properties(record))
+
+
+## Totals per processing stage
+@router.get("/usage/stages", tags=["Usage"], summary="Usage summed over all documents, per processing stage")
+def usage_stages(admin: User = Depends(get_admin_user)):
+    sums = ", ".join(
+        f"sum(coalesce(d.{usage_property(stage, field)}, 0)) AS {usage_property(stage, field)}"
+        for stage in DOCUMENT_STAGES for field in FIELDS
+    )
+    with driver.session() as session:
+        record = session.run(f"MATCH (d:Document) WHERE d.usage_tokens IS NOT NULL RETURN count(d) AS documents, {sums}").single()
+    return {
+        "documents": record["documents"],
+        "stages": {stage: {field: record[usage_property(stage, field)] for field in FIELDS} for stage in DOCUMENT_STAGES},
+    }
+
+
+## Chat requests
+@router.get("/usage/chat", tags=["Usage"], summary="Chat usage over the last days: totals, latency percentiles and the most expensive questions")
+def usage_chat(
+    days: int = Query(default=7, ge=1, le=90),
+    limit: int = Query(default=10, ge=0, le=100),
+    admin: User = Depends(get_admin_user)):
+    today = datetime.now(timezone.utc)
+    totals = dict.fromkeys(FIELDS, 0)
+    seconds, top, requests = [], [], 0
+    for record in read_chat_usage([today - timedelta(days=n) for n in range(days)]):
+        requests += 1
+        for field in FIELDS:
+            totals[field] += record["totals"].get(field, 0)
+        seconds.append(record["totals"]["seconds"])
+        top.append(record)
+        # Keep the most expensive questions only
+        if len(top) > 4 * max(limit, 1):
+            top = sorted(top, key=lambda r: r["totals"]["tokens"], reverse=True)[:limit]
+    totals["tokens"] = sum(totals[field] for field in TOKEN_FIELDS)
+    return {
+        "requests": requests,
+        "totals": totals,
+        "seconds_p50": percentile(seconds, 0.5),
+        "seconds_p95": percentile(seconds, 0.95),
+        "most_expensive": sorted(top, key=lambda r: r["totals"]["tokens"], reverse=True)[:limit],
+    }
@@ -7,10 +7,6 @@ from neo4j import GraphDatabase
 from config import AppConfig
 from models import User, UserIn
 
-from langchain.chains.summarize import load_summarize_chain
-from langchain.chat_models import ChatOpenAI
-from langchain.docstore.document import Document
-
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -65,38 +61,49 @@ def get_user_from_db(username: str):
 
 
 ## fetches node properties by uuid
-def fetch_node_properties_by_uuid(driver, uuids: list):
+# Page collections a sources payload can include
+SOURCE_FIELDS = ("children", "questions", "summaries")
+
+
+def fetch_node_properties_by_uuid(driver, uuids: list, fields=SOURCE_FIELDS, max_text_chars: int = None, max_pages: int = None,
+                                  owner_uuid: str = None):
+    """
+    Documents and pages of the matched Child chunks. Only the page collections
+    in fields are queried, texts are cut to max_text_chars and each document
+    keeps its first max_pages pages (None keeps everything). With owner_uuid
+    set, only that user's pages are returned, so a chunk dedup shared with
+    another user's page never resolves to their document.
+    """
     output = []
+    text = "CASE WHEN $max_text_chars IS NULL THEN {0}.text ELSE left({0}.text, $max_text_chars) END"
+    # Questions and summaries are pattern comprehensions, so unrequested ones are never expanded
+    collections = {
+        "questions": f"[(p)-[:HAS_QUESTION]->(q:Question) | {{uuid: q.uuid, name: q.name, text: {text.format('q')}}}] AS questions",
+        "summaries": f"[(p)-[:HAS_SUMMARY]->(s:Summary) | {{uuid: s.uuid, name: s.name, text: {text.format('s')}}}] AS summaries",
+    }
     with driver.session() as session:
         # Query to fetch specific node properties based on UUIDs
-        query = """
+        query = f"""
             MATCH (d:Document)-[]-(p:Page)-[]-(c:Child)
-            WHERE c.uuid IN $uuids
-            OPTIONAL MATCH (p)-[]-(q:Question)
-            OPTIONAL MATCH (p)-[]-(s:Summary)
-
-            WITH d, p, 
-                collect(DISTINCT {uuid: q.uuid, name: q.name, text: q.text}) AS questions,
-                collect(DISTINCT {uuid: s.uuid, name: s.name, text: s.text}) AS summaries,
-                collect(DISTINCT {uuid: c.uuid, name: c.name, text: c.text}) AS children
+            WHERE c.uuid IN $uuids AND ($owner_uuid IS NULL OR p.owner_uuid = $owner_uuid)
+
+            WITH d, p, collect(DISTINCT {{uuid: c.uuid, name: c.name, text: {text.format('c')}}}) AS children
+            WITH d, p, children{"".join(f", {collections[field]}" for field in collections if field in fields)}
             ORDER BY d.name, toInteger(replace(p.name, 'Page ', ''))
 
             WITH d,
-                collect({
+                collect({{
                     uuid: p.uuid, 
-                    name: p.name, 
-                    summaries: summaries, 
-                    questions: questions, 
-                    children: children
-                }) AS pages
+                    name: p.name{"".join(f", {field}: {field}" for field in SOURCE_FIELDS if field in fields)}
+                }}) AS pages
             RETURN 
                 d.uuid AS doc_uuid, d.name AS doc_name, d.addeddate AS doc_addeddate, 
                 d.imageurl AS doc_imageurl, d.publisher AS doc_publisher, 
                 d.thumbnail AS doc_thumbnail, d.url AS doc_url, d.wordcount AS doc_wordcount,
-                pages
+                CASE WHEN $max_pages IS NULL THEN pages ELSE pages[..$max_pages] END AS pages
 
         """
-        results = session.run(query, uuids=uuids)
+        results = session.run(query, uuids=uuids, max_text_chars=max_text_chars, max_pages=max_pages, owner_uuid=owner_uuid)
             
         
         for record in results:
@@ -127,6 +134,11 @@ def fetch_node_properties_by_uuid(driver, uuids: list):
 ## generates a summary of text being returned
 def summarize_text_with_openai(text: str) -> str:
     """Generate a summary for the given text using OpenAI."""
+    # Imported here to keep langchain out of API startup
+    from langchain.chains.summarize import load_summarize_chain
+    from langchain.chat_models import ChatOpenAI
+    from langchain.docstore.document import Document
+
     llm = ChatOpenAI(temperature=0, model_name=AppConfig.OPENAI_CHAT_MODEL)
     #loader=langchain.document_loaders.TextLoader(text)
     docs = [Document(page_content=text)]
@@ -155,9 +167,9 @@ def setup_graph_db(driver, index_name, node_label="Child", property_name="embedd
     query = f"""
     CALL db.index.vector.createNodeIndex(
       '{index_name}',      // index name
-      '{node_label},             // node label
+      '{node_label}',            // node label
       '{property_name}',         // node property
-      1536,                // vector size
+      {AppConfig.EMBEDDING_DIMENSION},  // vector size
       'cosine'             // similarity metric
     )
     """
@@ -0,0 +1,81 @@
+"""
+Cost-aware, per-user fair ordering of the processing backlog.
+
+Each document's ingest cost is estimated in tokens from its wordcount (or its
+text length when wordcount is missing). Within one owner the cheapest documents
+go first (shortest job first); across owners, start-time fair queuing gives
+every owner the same share of worker time, so one user's large documents never
+sit in front of everybody else's short ones. Owners come from the
+(:UserAction)-[:ADDED]-(:Document) relationships written when documents are added.
+
+The resulting order is the publish order, and each document is routed with a
+Celery priority: short documents at INGEST_PRIORITY, large ones at
+SCHEDULER_LARGE_DOCUMENT_PRIORITY so documents queued later can still overtake
+them. An explicit priority override on the request replaces both.
+"""
+from typing import List
+
+from config import AppConfig
+
+
+# Each owner's pending documents, cheapest first and at most $per_owner of them (null for all).
+# The fair schedule takes an owner's documents in that same order, so its first N jobs are always
+# among the N cheapest of each owner (large documents never get the higher priority, see
+# SCHEDULER_LARGE_DOCUMENT_PRIORITY): a limited call never loads the rest of the backlog. The text
+# is only measured for documents without a wordcount, as in estimate_tokens.
+PENDING_DOCUMENTS_QUERY = """
+MATCH (a:Document)
+WHERE NOT (a)-[:HAS_PAGE]->(:Page) and a.text <> '' and a.process=True AND a.cancel_requested IS NULL
+OPTIONAL MATCH (ua:UserAction)-[:ADDED]-(a)
+WITH a, head(collect(ua.useruuid)) AS owner
+WITH a, owner, CASE WHEN coalesce(a.wordcount, 0) > 0 THEN null ELSE size(a.text) END AS chars
+WITH a, owner, chars, CASE WHEN chars IS NULL THEN toInteger(a.wordcount * $tokens_per_word) ELSE chars / 4 END AS tokens
+ORDER BY tokens
+WITH owner, collect({uuid: a.uuid, wordcount: a.wordcount, chars: chars}) AS documents
+UNWIND CASE WHEN $per_owner IS NULL THEN documents ELSE documents[..$per_owner] END AS document
+RETURN document.uuid AS uuid, document.wordcount AS wordcount, document.chars AS chars, owner
+"""
+
+
+def pending_documents_params(limit: int = None) -> dict:
+    return {"per_owner": limit, "tokens_per_word": AppConfig.SCHEDULER_TOKENS_PER_WORD}
+
+
+def estimate_tokens(wordcount: int = None, chars: int = None) -> int:
+    if wordcount:
+        return int(wordcount * AppConfig.SCHEDULER_TOKENS_PER_WORD)
+    # Roughly four characters per token for English text
+    return (chars or 0) // 4
+
+
+def priority_for(tokens: int, override: int = None) -> int:
+    if override is not None:
+        return override
+    if tokens >= AppConfig.SCHEDULER_LARGE_DOCUMENT_TOKENS:
+        return AppConfig.SCHEDULER_LARGE_DOCUMENT_PRIORITY
+    return AppConfig.INGEST_PRIORITY
+
+
+def schedule(documents: List[dict], priority_override: int = None) -> List[dict]:
+    """
+    Order documents (dicts with uuid, wordcount, chars and owner) for publishing.
+
+    Returns new dicts with the estimated tokens, the owner's virtual finish time
+    and the Celery priority, in the order they should be sent.
+    """
+    by_owner = {}
+    for document in documents:
+        tokens = estimate_tokens(document.get("wordcount"), document.get("chars"))
+        owner = document.get("owner") or AppConfig.DEFAULT_USER_UUID
+        by_owner.setdefault(owner, []).append({**document, "owner": owner, "tokens": tokens})
+
+    scheduled = []
+    for owner, jobs in by_owner.items():
+        # Shortest job first within an owner; the running sum is the virtual
+        # time at which the owner's fair share would have finished each job
+        finish = 0
+        for job in sorted(jobs, key=lambda job: job["tokens"]):
+            finish += max(job["tokens"], 1)
+            scheduled.append({**job, "finish": finish, "priority": priority_for(job["tokens"], priority_override)})
+
+    return sorted(scheduled, key=lambda job: (-job["priority"], job["finish"], job["tokens"]))
@@ -0,0 +1,47 @@
+"""
+Import-time budget check for the API.
+
+Imports app.main in a fresh interpreter and fails if it takes longer than
+API_IMPORT_BUDGET_SECONDS, listing the slowest imports. Run it after changing
+imports in the API:
+
+    python -m app.startup_check
+"""
+import subprocess
+import sys
+
+from config import AppConfig
+
+
+def measure_import(module: str = "app.main"):
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; "
+        "print(time.perf_counter() - start)"
+    )
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), name.strip()))
+    return float(result.stdout.strip().splitlines()[-1]), sorted(imports, reverse=True)
+
+
+def main():
+    seconds, imports = measure_import()
+    print(f"app.main imported in {seconds:.3f}s (budget {AppConfig.API_IMPORT_BUDGET_SECONDS:.3f}s)")
+    for cumulative, name in imports[:15]:
+        print(f"  {cumulative / 1e6:8.3f}s  {name}")
+    if seconds > AppConfig.API_IMPORT_BUDGET_SECONDS:
+        print("Import-time budget exceeded")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
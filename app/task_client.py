@@ -0,0 +1,140 @@
+"""
+Lightweight Celery client for the API.
+
+Tasks are sent by name and states read from the result backend, without
+importing worker code. Creating the app opens no connections; the broker is
+contacted on the first send.
+"""
+from typing import List
+import logging
+
+from celery import Celery, states
+from celery.result import AsyncResult
+from celery.exceptions import CeleryError
+from celery.backends.base import KeyValueStoreBackend
+from celery.app.control import Inspect
+
+from config import AppConfig
+from worker.routing import configure_queues, send_process_text, queue_enrichment, DIVIDE_TASK, HEALTH_CHECK_TASK, COMPACT_GRAPH_TASK
+
+
+celery_client = Celery("menome_api", broker=AppConfig.CELERY_BROKER_URL, backend=AppConfig.CELERY_RESULT_BACKEND_URL)
+configure_queues(celery_client)
+celery_client.conf.broker_transport_options = {'confirm_publish': True}
+
+
+def send_process_text_task(text: str, documentId: str, generateQuestions: bool, generateSummaries: bool, priority: int = None,
+                           profile: bool = False, deadline: float = None):
+    return send_process_text(celery_client, text, documentId, generateQuestions, generateSummaries, priority, profile, deadline)
+
+
+def send_enrichment_tasks(documentId: str, generateQuestions: bool, generateSummaries: bool, page_uuids: List[str] = None) -> List[str]:
+    return queue_enrichment(celery_client, documentId, generateQuestions, generateSummaries, page_uuids)
+
+
+def send_compaction_task():
+    return celery_client.send_task(COMPACT_GRAPH_TASK)
+
+
+def revoke_task(task_id: str):
+    """Discard a task that has not started yet; a running task stops through its document's cancel flag."""
+    celery_client.control.revoke(task_id)
+
+
+def send_divide_task(x, y):
+    return celery_client.send_task(DIVIDE_TASK, args=[x, y])
+
+
+def check_worker_health(queue: str, timeout: float = 10) -> dict:
+    """Run the health check task on a worker consuming `queue` and wait for its report."""
+    result = celery_client.send_task(HEALTH_CHECK_TASK, queue=queue)
+    return result.get(timeout=timeout)
+
+
+def queue_depth(queue: str) -> int:
+    """Messages ready in a broker queue, read with a passive declare (no consumer needed)."""
+    with celery_client.connection_for_write() as connection:
+        return connection.default_channel.queue_declare(queue=queue, passive=True).message_count
+
+
+def purge_celery_queue():
+    i = Inspect(app=celery_client)
+    active_queues = i.active_queues()
+    if active_queues:
+        for queue in active_queues.keys():
+            celery_client.control.purge()
+
+
+def task_info_from_state(task_id: str, status: str, result) -> dict:
+    """Shape a task's state and result/meta into the info dict returned by the API."""
+    # Task done: return the value
+    if status in states.READY_STATES:
+        if isinstance(result, Exception):
+            return {"task_id": str(task_id), "error": str(result), "status": status}
+        return {"task_id": str(task_id), "result": result, "status": status}
+
+    # Task Not Ready: return the last reported progress, if any
+    info = {"task_id": str(task_id), "status": status}
+    if isinstance(result, dict):
+        info["progress"] = result
+    return info
+
+
+def get_task_info(task_id: str):
+    """
+    Return the state of a task without blocking on its result.
+
+    Results are only read once the task is ready, at which point the backend
+    already holds them. While running, the coalesced progress meta is returned.
+    """
+    try:
+        task = AsyncResult(task_id, app=celery_client)
+        return task_info_from_state(task_id, task.state, task.info)
+
+    except CeleryError as e:
+        # Handle general Celery errors
+        return {
+            "task_id": str(task_id),
+            "error": str(e),
+            "status": "ERROR"
+        }
+
+    except Exception as e:
+        # Handle other exceptions
+        return {
+            "task_id": str(task_id),
+            "error": f"An error occurred: {e}",
+            "status": "FAILURE"
+        }
+
+
+def get_task_infos(task_ids: List[str]) -> List[dict]:
+    """
+    Return the info for many tasks at once.
+
+    The redis result backend (CELERY_RESULT_BACKEND_URL), like any key/value
+    backend, is read with a single mget round trip. Other backends fall back
+    to one lookup per task.
+    """
+    backend = celery_client.backend
+    if not isinstance(backend, KeyValueStoreBackend):
+        return [get_task_info(task_id) for task_id in task_ids]
+
+    try:
+        keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+        values = backend.mget(keys)
+    except Exception as e:
+        logging.error(f"Batch task lookup failed, falling back to single lookups: {e}")
+        return [get_task_info(task_id) for task_id in task_ids]
+
+    # redis returns the values in key order, the cache backends a dict by key
+    if hasattr(values, "items"):
+        values = [values.get(key) for key in keys]
+    infos = []
+    for task_id, value in zip(task_ids, values):
+        if value is None:
+            infos.append(task_info_from_state(task_id, states.PENDING, None))
+            continue
+        meta = backend.decode_result(value)
+        infos.append(task_info_from_state(task_id, meta["status"], meta.get("result")))
+    return infos
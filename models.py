@@ -4,7 +4,6 @@ from datetime import datetime
 from typing import Optional
 from enum import Enum
 from typing import List
-from langchain.pydantic_v1 import Field
 
 class Token(BaseModel):
     access_token: str
@@ -44,6 +43,12 @@ class DocumentResponse(BaseModel):
     thumbnail: str
     wordcount: int
 
+class TaskStatusRequest(BaseModel):
+    task_ids: Optional[List[str]] = None
+    document_ids: Optional[List[str]] = None
+    page: int = 1
+    page_size: int = 100
+
 # Add typing for input
 class Question(BaseModel):
     question: str
@@ -0,0 +1,12 @@
+"""
+Tests run from the repository root with `python -m pytest`, in the API image
+(which has both app and worker) with the usual /code/config/.env mounted.
+
+Worker modules create their Celery app on import, so the broker and result
+backend are pointed at Celery's in-memory transports; Neo4j is replaced by the
+fakes in tests/fakes.py and nothing else needs to be running.
+"""
+import os
+
+os.environ.setdefault("CELERY_BROKER_URL", "memory://")
+os.environ.setdefault("CELERY_RESULT_BACKEND_URL", "cache+memory://")
@@ -0,0 +1,104 @@
+"""Stand-ins for the Neo4j driver and a bound Celery task."""
+import re
+from types import SimpleNamespace
+
+
+class Record(dict):
+    """A result record; keys the query did not return read as None."""
+
+    def __missing__(self, key):
+        return None
+
+    def data(self):
+        return dict(self)
+
+
+class Result:
+    def __init__(self, rows):
+        self.records = [Record(row) for row in rows]
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def single(self):
+        return self.records[0] if self.records else None
+
+    def consume(self):
+        return SimpleNamespace(counters=SimpleNamespace(nodes_deleted=0, properties_set=0))
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, parameters=None, **kwargs):
+        return self.driver.execute(query, {**(parameters or {}), **kwargs})
+
+    # Transaction functions get the session itself as their transaction
+    def execute_write(self, work, *args, **kwargs):
+        return work(self, *args, **kwargs)
+
+    execute_read = write_transaction = read_transaction = execute_write
+
+    def close(self):
+        pass
+
+
+class FakeDriver:
+    """
+    Neo4j driver stand-in. Each query is answered by the first handler whose
+    pattern matches it (regex, searched in the whitespace-collapsed query) with
+    the rows it returns; other queries return no rows. With record=True the
+    queries and their parameters are kept in .queries.
+    """
+
+    def __init__(self, handlers=None, record=True):
+        self.handlers = [(re.compile(pattern), handler) for pattern, handler in (handlers or {}).items()]
+        self.record = record
+        self.queries = []
+
+    def session(self, **kwargs):
+        return FakeSession(self)
+
+    def execute(self, query, params):
+        query = " ".join(query.split())
+        if self.record:
+            self.queries.append((query, params))
+        for pattern, handler in self.handlers:
+            if pattern.search(query):
+                return Result(handler(params) if callable(handler) else handler)
+        return Result([])
+
+    def ran(self, pattern: str) -> list:
+        """Parameters of the recorded queries matching pattern."""
+        return [params for query, params in self.queries if re.search(pattern, query)]
+
+    def close(self):
+        pass
+
+
+class FakeTask:
+    """A bound task: keeps the last state reported and has a fixed request id."""
+
+    def __init__(self, task_id: str = "task-1"):
+        self.request = SimpleNamespace(id=task_id)
+        self.state = None
+
+    def update_state(self, state=None, meta=None):
+        self.state = (state, meta)
+
+    def retry(self, **kwargs):
+        raise RuntimeError(f"retry requested: {kwargs}")
+
+
+class WordEncoding:
+    """Tokenizer stand-in counting words, so tests need no tiktoken download."""
+
+    def encode(self, text: str) -> list:
+        return text.split()
@@ -0,0 +1,187 @@
+"""Batch backfills against worker.batch_stub_server: prepare, submit, poll, ingest and resume."""
+import json
+import os
+
+import pytest
+
+pytest.importorskip("langchain")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient
+
+from config import AppConfig
+from worker import batch_enrichment
+from worker.batch_enrichment import JOB_CLAIMING, BatchClient, manifest_path, open_manifests, prepare_job, run_step
+from worker.batch_stub_server import app as stub_app
+from tests.fakes import FakeDriver
+
+
+class Graph:
+    """Pages of one document, with the batch claim and enrichment the backfill reads and writes."""
+
+    def __init__(self, count: int):
+        self.pages = {
+            f"page-{n}": {"name": f"Page {n}", "text": f"text of page {n} " * 5, "batch_job": None, "batch_failures": 0,
+                          "questions": [], "summaries": []}
+            for n in range(1, count + 1)
+        }
+        self.driver = FakeDriver({
+            r"SET p.batch_job = \$job_id": self.claim,
+            r"Page \{batch_job: \$job_id\}": self.claimed,
+            r"SET p.batch_failures .* REMOVE p.batch_job": self.release,
+            r"REMOVE p.batch_job": self.finish,
+            r"MERGE \(q:Question": self.write_questions,
+            r"MERGE \(p\)-\[:HAS_SUMMARY\]": self.write_summaries,
+        })
+        self.embeddings = Embeddings()
+
+    def claim(self, params):
+        open_pages = [page for page in self.pages.values()
+                      if page["batch_job"] is None and page["batch_failures"] < params["max_failures"]
+                      and not (page["questions"] and page["summaries"])]
+        for page in open_pages[:params["limit"]]:
+            page["batch_job"] = params["job_id"]
+        return []
+
+    def claimed(self, params):
+        return [{"document_uuid": "doc", "uuid": uuid, "name": page["name"], "text": page["text"],
+                 "has_questions": bool(page["questions"]), "has_summary": bool(page["summaries"])}
+                for uuid, page in self.pages.items() if page["batch_job"] == params["job_id"]]
+
+    def release(self, params):
+        for uuid in params["uuids"]:
+            page = self.pages[uuid]
+            if page["batch_job"] == params["job_id"]:
+                page["batch_failures"] += 1
+                page["batch_job"] = None
+        return []
+
+    def finish(self, params):
+        for uuid in params["uuids"]:
+            if self.pages[uuid]["batch_job"] == params["job_id"]:
+                self.pages[uuid]["batch_job"] = None
+        return []
+
+    def write_questions(self, params):
+        questions = {}
+        for question in params["questions"]:
+            assert question["embedding"] == [float(len(question["text"]))]
+            questions.setdefault(question["page_uuid"], []).append(question["text"])
+        for uuid, texts in questions.items():
+            self.pages[uuid]["questions"].append(texts)
+        return []
+
+    def write_summaries(self, params):
+        for summary in params["summaries"]:
+            self.pages[summary["page_uuid"]]["summaries"].append(summary["text"])
+        return []
+
+
+class Embeddings:
+    """Counts embed_documents calls; ingest never embeds one text at a time."""
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+
+@pytest.fixture
+def graph(monkeypatch, tmp_path):
+    monkeypatch.setattr(AppConfig, "BATCH_WORK_DIR", str(tmp_path))
+    return Graph(3)
+
+
+@pytest.fixture
+def client():
+    client = BatchClient("http://stub/v1", "test-key")
+    client.http = TestClient(stub_app, base_url="http://stub/v1")
+    return client
+
+
+def run_to_completion(graph, client, limit: int) -> int:
+    for steps in range(1, 10):
+        if not run_step(graph.driver, client, graph.embeddings, limit)["open_jobs"]:
+            return steps
+    raise AssertionError("backfill did not finish")
+
+
+def assert_enriched_once(graph):
+    for uuid, page in graph.pages.items():
+        assert len(page["questions"]) == 1 and len(page["summaries"]) == 1, uuid
+        assert page["batch_failures"] == 0 and page["batch_job"] is None, uuid
+
+
+def test_backfill_enriches_every_page_once(graph, client):
+    # Two jobs of at most two pages: each is prepared and submitted, then polled and ingested on the next step
+    assert run_to_completion(graph, client, limit=2) == 3
+
+    assert_enriched_once(graph)
+    assert graph.pages["page-1"]["summaries"][0].startswith("Summary: ")
+    assert graph.pages["page-1"]["questions"][0][0].startswith("What does the text say about")
+    assert not open_manifests()
+
+
+def test_backfill_resumes_a_job_interrupted_after_claiming(graph, client, monkeypatch):
+    write_job_input = batch_enrichment.write_job_input
+
+    def crash(driver, manifest):
+        raise RuntimeError("worker killed")
+
+    monkeypatch.setattr(batch_enrichment, "write_job_input", crash)
+    with pytest.raises(RuntimeError):
+        prepare_job(graph.driver, 2)
+    [manifest] = open_manifests()
+    assert manifest["status"] == JOB_CLAIMING
+    assert [page["batch_job"] for page in graph.pages.values()] == [manifest["job_id"]] * 2 + [None]
+
+    monkeypatch.setattr(batch_enrichment, "write_job_input", write_job_input)
+    run_to_completion(graph, client, limit=2)
+
+    assert_enriched_once(graph)
+    with open(manifest_path(manifest["job_id"])) as f:
+        resumed = json.load(f)
+    assert sorted(resumed["pages"]) == ["page-1", "page-2"] and resumed["released"] == []
+
+
+def test_job_that_claims_nothing_leaves_no_manifest(graph, client, tmp_path):
+    for page in graph.pages.values():
+        page["batch_failures"] = batch_enrichment.MAX_PAGE_FAILURES
+
+    assert prepare_job(graph.driver, 2) is None
+    assert run_step(graph.driver, client, graph.embeddings, 2) == {"open_jobs": []}
+    assert not os.listdir(tmp_path)
+
+
+def test_page_missing_one_of_its_results_is_released_and_resubmitted(graph, client, monkeypatch):
+    download = client.download
+
+    def lose_one_line(file_id):
+        return "".join(line + "\n" for line in download(file_id).splitlines() if '"summary:page-1"' not in line)
+
+    monkeypatch.setattr(client, "download", lose_one_line)
+    run_step(graph.driver, client, graph.embeddings, 3)
+    run_step(graph.driver, client, graph.embeddings, 3)
+
+    page = graph.pages["page-1"]
+    assert len(page["questions"]) == 1 and not page["summaries"]
+    # Released by the first job, and claimed again by the next one
+    assert page["batch_failures"] == 1 and page["batch_job"] is not None
+    assert all(other["batch_job"] is None for uuid, other in graph.pages.items() if uuid != "page-1")
+
+    monkeypatch.setattr(client, "download", download)
+    run_to_completion(graph, client, limit=3)
+    assert len(page["questions"]) == 1 and len(page["summaries"]) == 1
+
+
+def test_results_are_ingested_in_chunks(graph, client, monkeypatch):
+    monkeypatch.setattr(AppConfig, "BATCH_INGEST_LINES", 4)
+
+    run_to_completion(graph, client, limit=3)
+
+    # Six result lines, one embed_documents call and write transaction per chunk of four
+    assert_enriched_once(graph)
+    assert len(graph.embeddings.calls) == 2
+    assert len(graph.driver.ran(r"MERGE \(q:Question")) == 2
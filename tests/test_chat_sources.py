@@ -0,0 +1,75 @@
+"""Scoped chat only returns sources from the current user's pages."""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langchain")
+pytest.importorskip("fastapi")
+
+import orjson
+from langchain.chains import RetrievalQAWithSourcesChain
+
+from app.routers import chat
+from config import AppConfig
+from tests.fakes import FakeDriver, WordEncoding
+from worker import usage
+
+
+# The chunk was linked by dedup to a page of each owner
+PAGES = [
+    {"owner": "user-a", "doc_uuid": "doc-a", "doc_name": "A's contract", "pages": [{"uuid": "page-a", "name": "Page 1"}]},
+    {"owner": "user-b", "doc_uuid": "doc-b", "doc_name": "B's contract", "pages": [{"uuid": "page-b", "name": "Page 1"}]},
+]
+
+
+def sources_rows(params):
+    assert params["uuids"] == ["shared-chunk"]
+    return [row for row in PAGES if params["owner_uuid"] in (None, row["owner"])]
+
+
+def test_scoped_chat_leaves_out_other_owners_pages_of_a_shared_chunk(monkeypatch, tmp_path):
+    driver = FakeDriver({r"WHERE c.uuid IN \$uuids": sources_rows})
+    chains = []
+
+    def from_chain_type(llm, chain_type, retriever):
+        chains.append(retriever)
+        return lambda inputs, return_only_outputs: {"answer": "Yes", "sources": "shared-chunk"}
+
+    monkeypatch.setattr(chat.GraphDatabase, "driver", lambda *args, **kwargs: driver)
+    monkeypatch.setattr(chat, "get_child_vectorstore", lambda: SimpleNamespace(_driver=driver, index_name="parent_document"))
+    monkeypatch.setattr(chat, "get_chat_llm", lambda: None)
+    monkeypatch.setattr(RetrievalQAWithSourcesChain, "from_chain_type", staticmethod(from_chain_type))
+    monkeypatch.setattr(AppConfig, "ENRICHMENT_MODE", "eager")
+    monkeypatch.setattr(AppConfig, "USAGE_LOG_DIR", str(tmp_path))
+    # The usage ledger counts the question's tokens without downloading a tiktoken encoding
+    monkeypatch.setattr(usage, "embedding_encoding", WordEncoding)
+
+    response = chat.chatSourcesquestion(
+        question="Is there a contract?", scope="user", retrieval="chunks", source_fields="", max_text_chars=None,
+        max_pages=None, current_user=SimpleNamespace(uuid="user-a"))
+
+    [source] = orjson.loads(response.body)["sources"]
+    assert source["document"]["uuid"] == "doc-a"
+    assert chains[0].owner_uuid == "user-a"
+    [params] = driver.ran(r"WHERE c.uuid IN \$uuids")
+    assert params["owner_uuid"] == "user-a"
+
+
+def test_missing_index_is_created_before_the_vector_store_is_cached(monkeypatch):
+    from langchain.vectorstores import Neo4jVector
+    from neo4j.exceptions import ServiceUnavailable
+
+    created, attempts = [], []
+
+    def from_existing_index(embeddings, **kwargs):
+        attempts.append((kwargs["index_name"], kwargs["node_label"]))
+        if not created:
+            raise ServiceUnavailable("Index not found")
+        return "store"
+
+    monkeypatch.setattr(Neo4jVector, "from_existing_index", staticmethod(from_existing_index))
+    monkeypatch.setattr(chat, "get_query_embeddings", lambda: None)
+    monkeypatch.setattr(chat, "setup_graph_db", lambda driver, index_name, node_label: created.append((index_name, node_label)))
+
+    assert chat.build_vectorstore("Page", index_name="typical_rag") == "store"
+    assert created == [("typical_rag", "Page")] and attempts == [("typical_rag", "Page")] * 2
@@ -0,0 +1,55 @@
+"""Compaction is admin only and removes the UserActions left without a document."""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from config import AppConfig
+from worker import compaction
+from tests.fakes import FakeDriver
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from app.routers import document
+    from app.routers.utils import get_current_user
+
+    monkeypatch.setattr(document, "send_compaction_task", lambda: SimpleNamespace(id="compaction-1"))
+    user = {}
+    app = FastAPI()
+    app.include_router(document.router)
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(uuid=user["uuid"])
+
+    def as_user(uuid):
+        user["uuid"] = uuid
+        return TestClient(app)
+    return as_user
+
+
+def test_only_the_admin_can_compact(client):
+    assert client("someone-else").post("/documents/compact").status_code == 403
+    response = client(AppConfig.DEFAULT_USER_UUID).post("/documents/compact")
+    assert response.status_code == 200 and response.json() == {"task_id": "compaction-1"}
+
+
+def test_deleting_a_document_drops_user_actions_left_without_one():
+    driver = FakeDriver()
+
+    compaction.delete_document(driver, "doc")
+
+    [(query, params)] = driver.queries
+    assert params == {"uuid": "doc"}
+    assert "DETACH DELETE d" in query and "WHERE NOT (ua)-[:ADDED]-(:Document) DETACH DELETE ua" in query
+
+
+def test_compaction_removes_orphaned_user_actions():
+    driver = FakeDriver({r"RETURN count\(n\) AS size": [{"size": 0}]})
+
+    report = compaction.compact(driver)
+
+    assert "user_actions" in report["deleted"]
+    assert driver.ran(r"MATCH \(n:UserAction\) WHERE NOT \(n\)-\[:ADDED\]-\(:Document\) CALL")
@@ -0,0 +1,93 @@
+"""Two-stage retrieval keeps documents without a summary reachable."""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langchain")
+
+from neo4j.exceptions import ClientError
+
+from app.context_packer import PackedContextRetriever, mmr, SCOPED_OVERFETCH, UNSUMMARIZED_OVERFETCH
+from config import AppConfig
+from tests.fakes import FakeDriver
+
+
+def chunk(uuid: str, score: float) -> dict:
+    return {"text": uuid, "score": score, "metadata": {"uuid": uuid, "source": uuid, "name": "0-1", "page_uuid": f"page-{uuid}"}}
+
+
+def retriever(driver, plain_hits=()) -> PackedContextRetriever:
+    vectorstore = SimpleNamespace(_driver=driver, index_name="parent_document",
+                                  similarity_search_with_score_by_vector=lambda embedding, k: list(plain_hits))
+    return PackedContextRetriever(vectorstore=vectorstore, model="gpt-4", fetch_k=3, top_documents=2)
+
+
+def test_two_stage_adds_chunks_of_unsummarized_documents():
+    driver = FakeDriver({
+        r"queryNodes\('document_summary'": [{"uuid": "summarized"}],
+        r"NOT EXISTS": [chunk("unsummarized-1", 0.8), chunk("shared", 0.5), chunk("unsummarized-2", 0.1)],
+        r"IN \$document_uuids": [chunk("summarized-1", 0.9), chunk("shared", 0.5)],
+    })
+    packer = retriever(driver)
+
+    hits = packer.search([1.0, 0.0])
+
+    assert [doc.metadata["uuid"] for doc, _ in hits] == ["summarized-1", "unsummarized-1", "shared"]
+    assert packer.stats == {"documents": 1, "unsummarized": 3}
+    [params] = driver.ran(r"NOT EXISTS")
+    assert params["index"] == "parent_document" and params["fetch"] == 3 * UNSUMMARIZED_OVERFETCH
+
+
+def test_two_stage_without_summaries_uses_the_plain_search():
+    driver = FakeDriver()
+    packer = retriever(driver, plain_hits=[("plain", 1.0)])
+
+    assert packer.search([1.0, 0.0]) == [("plain", 1.0)]
+    assert packer.stats == {"documents": 0}
+    assert not driver.ran(r"NOT EXISTS")
+
+
+def test_two_stage_without_the_summary_index_uses_the_plain_search():
+    def missing_index(params):
+        raise ClientError("There is no such vector schema index: document_summary")
+
+    driver = FakeDriver({r"queryNodes\('document_summary'": missing_index})
+    packer = retriever(driver, plain_hits=[("plain", 1.0)])
+
+    assert packer.search([1.0, 0.0]) == [("plain", 1.0)]
+    assert packer.stats == {"documents": 0}
+
+
+def scoped_retriever(driver) -> PackedContextRetriever:
+    vectorstore = SimpleNamespace(_driver=driver, index_name="parent_document")
+    return PackedContextRetriever(vectorstore=vectorstore, model="gpt-4", fetch_k=3, owner_uuid="user")
+
+
+def test_scoped_search_widens_the_index_fetch_until_enough_hits_survive():
+    # The owner's chunks only show up once the index is fetched 48 deep
+    driver = FakeDriver({r"queryNodes\(\$index": lambda params: [chunk(f"c{n}", 0.5) for n in range(3)] if params["fetch"] >= 48 else []})
+
+    hits = scoped_retriever(driver).search([1.0, 0.0])
+
+    assert len(hits) == 3
+    assert [params["fetch"] for params in driver.ran(r"queryNodes\(\$index")] == [3 * SCOPED_OVERFETCH, 48]
+    assert not driver.ran(r"vector.similarity.cosine")
+
+
+def test_scoped_search_scans_an_owner_too_small_to_fill_the_widest_fetch(monkeypatch):
+    monkeypatch.setattr(AppConfig, "CHAT_SCOPED_MAX_FETCH", 100)
+    driver = FakeDriver({r"vector.similarity.cosine": [chunk("only", 0.2)]})
+
+    hits = scoped_retriever(driver).search([1.0, 0.0])
+
+    assert [doc.metadata["uuid"] for doc, _ in hits] == ["only"]
+    assert [params["fetch"] for params in driver.ran(r"queryNodes\(\$index")] == [12, 48, 100]
+
+
+def test_mmr_prefers_a_diverse_hit_over_a_near_copy():
+    def hit(uuid, embedding):
+        return SimpleNamespace(metadata={"uuid": uuid, "embedding": embedding}), 1.0
+
+    hits = [hit("best", [1.0, 0.1]), hit("copy", [2.0, 0.21]), hit("other", [0.6, 0.8]), hit("none", None)]
+
+    assert [doc.metadata["uuid"] for doc, _ in mmr([1.0, 0.0], hits, 2, 0.3)] == ["best", "other"]
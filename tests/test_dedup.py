@@ -0,0 +1,93 @@
+"""Duplicate chunks within a page and across committed pages."""
+import pytest
+
+pytest.importorskip("langchain")
+
+from config import AppConfig
+from worker import dedup
+from tests.fakes import FakeDriver
+
+BOILERPLATE = "Accept all cookies to continue reading the article on our website today"
+
+
+@pytest.fixture(autouse=True)
+def chunk_index(monkeypatch):
+    monkeypatch.setattr(AppConfig, "DEDUP_MAX_DISTANCE", 3)
+    index = dedup.SimHashIndex(100)
+    monkeypatch.setattr(dedup, "chunk_index", index)
+    return index
+
+
+def children(page: int, texts: list) -> list:
+    return [{"text": text, "id": f"child-{page}-{n}", "name": f"{page}-{n}"} for n, text in enumerate(texts, 1)]
+
+
+def stats() -> dict:
+    return {"duplicates": 0, "embeddings_saved": 0, "nodes_saved": 0}
+
+
+def embed(text: str) -> list:
+    return [float(len(text))]
+
+
+@pytest.mark.parametrize("mode, written, links", [("reuse", 3, []), ("link", 2, ["child-1-1"]), ("drop", 2, [])])
+def test_repeats_within_a_page_are_duplicates(mode, written, links):
+    counts = stats()
+    page = children(1, [BOILERPLATE, "The body of the page", BOILERPLATE.upper() + "!"])
+
+    to_write, found_links, new_chunks = dedup.dedupe_children(FakeDriver(), page, embed, mode, counts)
+
+    assert len(to_write) == written and found_links == links
+    assert counts["duplicates"] == 1 and counts["embeddings_saved"] == 1
+    assert [uuid for _, uuid in new_chunks] == ["child-1-1", "child-1-2"]
+    if mode == "reuse":
+        assert to_write[2]["embedding"] == to_write[0]["embedding"]
+
+
+def test_chunks_are_matched_by_later_pages_only_once_indexed(chunk_index):
+    driver = FakeDriver({r"MATCH \(c:Child \{uuid: uuid\}\)": lambda params: [
+        {"hash": None, "uuid": uuid, "embedding": [1.0]} for uuid in params["uuids"]]})
+    first = children(1, [BOILERPLATE])
+    _, _, new_chunks = dedup.dedupe_children(driver, first, embed, "reuse", stats())
+    assert not chunk_index.entries
+
+    counts = stats()
+    dedup.dedupe_children(driver, children(2, [BOILERPLATE.upper()]), embed, "reuse", counts)
+    assert counts["duplicates"] == 0
+
+    dedup.index_chunks(new_chunks)
+    dedup.dedupe_children(driver, children(3, [BOILERPLATE.upper()]), embed, "reuse", counts)
+    assert counts["duplicates"] == 1
+
+
+@pytest.mark.parametrize("mode", ["link", "drop"])
+def test_chunks_of_other_owners_are_reused(mode):
+    driver = FakeDriver({r"MATCH \(c:Child \{text_hash: candidate.hash\}\)": lambda params: [
+        {"id": params["candidates"][0]["id"], "uuid": "theirs", "embedding": [1.0], "owner_uuid": "user-b"}]})
+    counts = stats()
+
+    to_write, links, _ = dedup.dedupe_children(driver, children(1, [BOILERPLATE]), embed, mode, counts, owner_uuid="user-a")
+
+    assert links == [] and to_write[0]["embedding"] == [1.0]
+    assert counts["duplicates"] == 1 and counts["nodes_saved"] == 0
+
+
+def test_link_mode_links_chunks_of_the_same_owner():
+    driver = FakeDriver({r"MATCH \(c:Child \{text_hash: candidate.hash\}\)": lambda params: [
+        {"id": params["candidates"][0]["id"], "uuid": "mine", "embedding": [1.0], "owner_uuid": "user-a"}]})
+
+    to_write, links, _ = dedup.dedupe_children(driver, children(1, [BOILERPLATE]), embed, "link", stats(), owner_uuid="user-a")
+
+    assert links == ["mine"] and to_write == []
+
+
+def test_exact_matches_prefer_the_chunks_own_node():
+    driver = FakeDriver({r"MATCH \(c:Child \{text_hash: candidate.hash\}\)": lambda params: [
+        {"id": "child-1-1", "uuid": "child-1-1", "embedding": [1.0], "owner_uuid": "user-a"}]})
+    counts = stats()
+
+    to_write, links, _ = dedup.dedupe_children(driver, children(1, [BOILERPLATE]), embed, "link", counts, owner_uuid="user-a")
+
+    assert links == [] and to_write[0]["embedding"] == [1.0] and counts["duplicates"] == 0
+    [params] = driver.ran(r"ORDER BY c.uuid = candidate.id DESC LIMIT 1")
+    assert params["candidates"] == [{"hash": dedup.text_hash(BOILERPLATE), "id": "child-1-1"}]
@@ -0,0 +1,29 @@
+"""The document summary is queued once, by the batch that completes the page summaries."""
+import pytest
+
+pytest.importorskip("langchain")
+
+from config import AppConfig
+from worker import tasks
+from tests.fakes import FakeDriver
+
+
+@pytest.mark.parametrize("summarized, queued", [(4, []), (10, ["doc"])])
+def test_summary_batches_queue_the_document_summary_when_every_page_has_one(monkeypatch, summarized, queued):
+    driver = FakeDriver({
+        r"AS cancelled": [{"cancelled": False}],
+        r"AS summarized": [{"page_count": 10, "summarized": summarized}],
+    })
+    summaries = []
+    monkeypatch.setattr(AppConfig, "DOCUMENT_SUMMARIES_ENABLED", True)
+    monkeypatch.setattr(tasks, "get_driver", lambda: driver)
+    monkeypatch.setattr(tasks, "get_llm", lambda: None)
+    monkeypatch.setattr(tasks, "get_embeddings", lambda: None)
+    monkeypatch.setattr(tasks, "load_pages", lambda driver, documentId, page_uuids: [])
+    monkeypatch.setattr(tasks, "generate_summaries", lambda *args: None)
+    monkeypatch.setattr(tasks, "queue_document_summary", lambda app, documentId: summaries.append(documentId))
+
+    result = tasks.generate_summaries_task.apply(args=["doc", ["page-1"]], task_id="task-1")
+
+    assert result.get()["message"] == "Success"
+    assert summaries == queued
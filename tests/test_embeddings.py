@@ -0,0 +1,131 @@
+"""Hashing and local embedding backends, and the vector index dimension check."""
+import math
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langchain")
+
+from config import AppConfig
+from worker.embeddings import HashingEmbeddings, LocalEmbeddings, check_index_dimensions, create_embeddings
+from tests.fakes import FakeDriver
+
+
+def cosine(a, b) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+def test_hashing_embeddings_are_deterministic_unit_vectors():
+    embeddings = HashingEmbeddings(64)
+    [first, second] = embeddings.embed_documents(["the vector index", "the vector index"])
+
+    assert len(first) == 64 and first == second
+    assert math.isclose(math.sqrt(sum(v * v for v in first)), 1.0)
+    assert embeddings.embed_query("The Vector index!") == first
+    assert embeddings.embed_query("") == [0.0] * 64
+
+
+def test_hashing_embeddings_rank_shared_words_closer():
+    embeddings = HashingEmbeddings(256)
+    query = embeddings.embed_query("graph database vector index")
+
+    near = embeddings.embed_query("a vector index in a graph database")
+    far = embeddings.embed_query("celery workers consume the enrichment queue")
+    assert cosine(query, near) > cosine(query, far)
+
+
+class FakeVector(list):
+    def tolist(self):
+        return list(self)
+
+
+class FakeSentenceTransformer:
+    """Encodes a text as [len(text), dimension - 1 zeros] and records the size of every batch."""
+
+    dimension = 4
+    batches = []
+
+    def __init__(self, model_path, device):
+        self.model_path = model_path
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def encode(self, texts, batch_size, normalize_embeddings, convert_to_numpy):
+        self.batches.append(len(texts))
+        return [FakeVector([float(len(text))] + [0.0] * (self.dimension - 1)) for text in texts]
+
+
+@pytest.fixture
+def sentence_transformers(monkeypatch):
+    FakeSentenceTransformer.batches = []
+    monkeypatch.setitem(sys.modules, "sentence_transformers", SimpleNamespace(SentenceTransformer=FakeSentenceTransformer))
+    return FakeSentenceTransformer
+
+
+def test_local_embeddings_batch_texts_up_to_the_limit(sentence_transformers):
+    embeddings = LocalEmbeddings("/models/test", 4, max_batch_size=4, batch_wait_ms=200)
+    texts = ["x" * n for n in range(1, 11)]
+
+    vectors = embeddings.embed_documents(texts)
+
+    assert [vector[0] for vector in vectors] == [float(n) for n in range(1, 11)]
+    assert sentence_transformers.batches == [4, 4, 2]
+
+
+def test_local_embeddings_coalesce_concurrent_queries(sentence_transformers):
+    embeddings = LocalEmbeddings("/models/test", 4, max_batch_size=64, batch_wait_ms=200)
+    embeddings.embed_query("warm up")
+    results = {}
+
+    def query(n):
+        results[n] = embeddings.embed_query("y" * n)
+
+    threads = [threading.Thread(target=query, args=(n,)) for n in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert {n: vector[0] for n, vector in results.items()} == {n: float(n) for n in range(1, 9)}
+    assert sum(sentence_transformers.batches[1:]) == 8 and len(sentence_transformers.batches) < 9
+
+
+def test_local_embeddings_wait_comes_from_config(sentence_transformers, monkeypatch):
+    monkeypatch.setattr(AppConfig, "EMBEDDING_BATCH_WAIT_MS", 7)
+    monkeypatch.setattr(AppConfig, "EMBEDDING_MAX_BATCH_SIZE", 16)
+
+    embeddings = create_embeddings("local")
+
+    assert embeddings.batch_wait == 0.007 and embeddings.max_batch_size == 16
+
+
+def test_local_embeddings_reject_a_model_of_another_dimension(sentence_transformers):
+    with pytest.raises(ValueError, match="4-dimensional"):
+        LocalEmbeddings("/models/test", 1536, max_batch_size=4, batch_wait_ms=2).embed_query("text")
+
+
+def test_local_embeddings_need_sentence_transformers(monkeypatch):
+    monkeypatch.setitem(sys.modules, "sentence_transformers", None)
+    with pytest.raises(ImportError, match="requirements-local.txt"):
+        LocalEmbeddings("/models/test", 4, max_batch_size=4, batch_wait_ms=2).embed_query("text")
+
+
+def index_driver(dimensions: dict) -> FakeDriver:
+    return FakeDriver({r"SHOW INDEXES": [{"name": name, "dimensions": dims} for name, dims in dimensions.items()]})
+
+
+def test_check_index_dimensions_accepts_matching_indexes():
+    indexes = {"parent_document": 256, "summary": 256}
+    assert check_index_dimensions(index_driver(indexes), 256) == indexes
+
+
+def test_check_index_dimensions_lists_mismatched_indexes():
+    driver = index_driver({"parent_document": 1536, "summary": 256, "typical_rag": 1536})
+
+    with pytest.raises(ValueError) as error:
+        check_index_dimensions(driver, 256)
+    assert "'parent_document': 1536" in str(error.value) and "'typical_rag': 1536" in str(error.value)
+    assert "summary" not in str(error.value)
@@ -0,0 +1,67 @@
+"""Fused enrichment falls back to the per-page prompts when the model returns no entries."""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langchain")
+
+from langchain.docstore.document import Document
+
+from config import AppConfig
+from worker import processing_functions
+from tests.fakes import FakeTask
+
+
+class NoCache:
+    def key(self, *args, **kwargs):
+        return args
+
+    def get(self, key):
+        return None
+
+    def put(self, key, value, tokens, seconds):
+        pass
+
+
+class Chain:
+    def __init__(self, output):
+        self.output = output
+        self.calls = 0
+
+    def run(self, *args, **kwargs):
+        self.calls += 1
+        return self.output
+
+    invoke = run
+
+
+class Prompt:
+    """Stands in for SUMMARY_PROMPT: prompt | llm gives the chain."""
+
+    def __init__(self, chain):
+        self.chain = chain
+
+    def __or__(self, llm):
+        return self.chain
+
+
+def test_empty_fused_response_uses_the_per_page_prompts(monkeypatch):
+    enrichment = Chain(SimpleNamespace(pages=[]))
+    questions = Chain(SimpleNamespace(questions=["What is on the page?"]))
+    summary = Chain(SimpleNamespace(content="A page summary"))
+    monkeypatch.setattr(processing_functions, "create_structured_output_chain",
+                        lambda schema, llm, prompt: enrichment if prompt is processing_functions.ENRICHMENT_PROMPT else questions)
+    monkeypatch.setattr(processing_functions, "SUMMARY_PROMPT", Prompt(summary))
+    monkeypatch.setattr(processing_functions, "llm_cache", NoCache())
+    monkeypatch.setattr(processing_functions, "count_tokens", lambda text, model: len(text.split()))
+    monkeypatch.setattr(AppConfig, "ENRICHMENT_PACK_MAX_PAGES", 2)
+    written = []
+    monkeypatch.setattr(processing_functions, "write_questions", lambda driver, doc, page, value, embeddings: written.append((page, value)))
+    monkeypatch.setattr(processing_functions, "write_summary", lambda driver, doc, page, value, embeddings, stage=None: written.append((page, value)))
+    pages = [Document(page_content=f"text of page {n}", metadata={"page_number": n}) for n in (1, 2)]
+
+    processing_functions.enrich_pages(FakeTask(), SimpleNamespace(model_name="gpt-4"), pages, "doc", None, None)
+
+    assert written == [(1, ["What is on the page?"]), (1, "A page summary"), (2, ["What is on the page?"]), (2, "A page summary")]
+    # One call for the pack, then one per page on its own
+    assert enrichment.calls == 3 and questions.calls == 2 and summary.calls == 2
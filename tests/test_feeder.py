@@ -0,0 +1,45 @@
+"""The feeder stops counting tasks that never finish, so it cannot stall."""
+import pytest
+
+pytest.importorskip("celery")
+
+from app import feeder
+from config import AppConfig
+from tests.fakes import FakeDriver
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(feeder.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(AppConfig, "FEEDER_REQUEUE_AFTER_SECONDS", 60)
+    return now
+
+
+def test_unfinished_drops_finished_and_expired_tasks(clock, monkeypatch):
+    states = {"done": "SUCCESS", "lost": "PENDING", "running": "PROGRESS"}
+    monkeypatch.setattr(feeder, "get_task_infos", lambda ids: [{"task_id": i, "status": states[i]} for i in ids])
+
+    in_flight = feeder.unfinished({"done": 990.0, "lost": 900.0, "running": 990.0})
+
+    assert in_flight == {"running": 990.0}
+
+
+def test_once_exits_when_queued_tasks_are_lost(clock, monkeypatch):
+    backlog = [[{"uuid": "doc", "wordcount": 10, "chars": 50, "owner": "user"}]]
+    driver = FakeDriver({
+        r"RETURN a.uuid AS uuid": lambda params: backlog.pop() if backlog and not params["after"] else [],
+        r"RETURN a.text AS text": [{"text": "some text"}],
+    })
+    monkeypatch.setattr(feeder, "queue_depth", lambda queue: 0)
+    monkeypatch.setattr(feeder, "send_process_text_task", lambda *args: type("Task", (), {"id": "lost"}))
+    # The task was purged from the broker, so it never leaves PENDING
+    monkeypatch.setattr(feeder, "get_task_infos", lambda ids: [{"task_id": i, "status": "PENDING"} for i in ids])
+
+    def sleep(seconds):
+        clock[0] += 30
+
+    monkeypatch.setattr(feeder.time, "sleep", sleep)
+
+    assert feeder.run(driver, False, False, once=True) == 1
+    assert clock[0] > 1060
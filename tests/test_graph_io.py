@@ -0,0 +1,23 @@
+"""Exports leave out processing state that would be stale after a reload."""
+import json
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from worker.graph_io import decode_properties, encode_properties
+
+
+DOCUMENT = {
+    "uuid": "doc", "name": "Report", "checkpoint_stage": "summaries",
+    "task_id": "task-1", "queued_at": "2024-01-01", "checkpoint_questions": 3, "checkpoint_questions_task": "task-1",
+}
+
+
+def test_transient_state_is_not_exported():
+    assert json.loads(encode_properties({**DOCUMENT, "enrichment_queued": True, "batch_job": "job-1"})) == {
+        "uuid": "doc", "name": "Report", "checkpoint_stage": "summaries"}
+
+
+def test_transient_state_in_older_exports_is_not_restored():
+    assert decode_properties(json.dumps(DOCUMENT)) == {"uuid": "doc", "name": "Report", "checkpoint_stage": "summaries"}
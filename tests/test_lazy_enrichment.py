@@ -0,0 +1,64 @@
+"""Lazy enrichment queues hot pages within the shared budget and releases claims it cannot keep."""
+import pytest
+
+pytest.importorskip("celery")
+
+from app import lazy_enrichment
+from tests.fakes import FakeDriver
+
+
+def graph(granted: int) -> FakeDriver:
+    return FakeDriver({
+        r"SET p.access_count": [{"uuid": "page-1"}, {"uuid": "page-2"}],
+        # The budget grants `granted` pages, and page-2 went to another request
+        r"MERGE \(b:EnrichmentBudget": lambda params: [{"document_uuid": "doc", "page_uuids": [uuid for uuid in params["uuids"] if uuid != "page-2"][:granted]}],
+    })
+
+
+def test_hot_pages_are_queued_within_the_budget(monkeypatch):
+    sent = []
+    monkeypatch.setattr(lazy_enrichment, "send_enrichment_tasks", lambda *args: sent.append(args) or ["task"])
+    driver = graph(granted=1)
+
+    assert lazy_enrichment.enrich_hot_pages(driver, ["child-1", "child-2"]) == ["task"]
+
+    assert sent == [("doc", True, True, ["page-1"])]
+    [budget] = driver.ran(r"MERGE \(b:EnrichmentBudget")
+    assert budget["uuids"] == ["page-1", "page-2"] and budget["name"] == "lazy"
+
+
+def test_only_pages_claimed_are_debited_from_the_budget(monkeypatch):
+    driver = graph(granted=2)
+    monkeypatch.setattr(lazy_enrichment, "send_enrichment_tasks", lambda *args: ["task"])
+
+    lazy_enrichment.enrich_hot_pages(driver, ["child-1", "child-2"])
+
+    [(query, _)] = [(query, params) for query, params in driver.queries if "EnrichmentBudget {" in query]
+    assert "SET b.spent = spent + [p IN claimed | now]" in query
+    assert "SET p.enrichment_queued" in query
+
+
+def test_claims_are_released_when_queueing_fails(monkeypatch):
+    def unavailable(*args):
+        raise ConnectionError("broker down")
+
+    monkeypatch.setattr(lazy_enrichment, "send_enrichment_tasks", unavailable)
+    driver = graph(granted=2)
+
+    with pytest.raises(ConnectionError):
+        lazy_enrichment.enrich_hot_pages(driver, ["child-1"])
+    assert driver.ran(r"REMOVE p.enrichment_queued") == [{"uuids": ["page-1"]}]
+
+
+def test_failed_enrichment_task_releases_its_pages(monkeypatch):
+    from worker import tasks
+
+    driver = FakeDriver()
+    monkeypatch.setattr(tasks, "get_driver", lambda: driver)
+
+    tasks.generate_summaries_task.on_failure(RuntimeError("LLM error"), "task-1", ["doc", ["page-1"]], {}, None)
+    tasks.enrich_document_task.on_failure(RuntimeError("LLM error"), "task-2", ["doc"], {"page_uuids": ["page-2"]}, None)
+    # Whole-document runs claim nothing
+    tasks.generate_questions_task.on_failure(RuntimeError("LLM error"), "task-3", ["doc", None], {}, None)
+
+    assert driver.ran(r"REMOVE p.enrichment_queued") == [{"uuids": ["page-1"]}, {"uuids": ["page-2"]}]
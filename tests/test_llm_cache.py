@@ -0,0 +1,21 @@
+"""LLM cache statistics are reported per task, not per worker process."""
+import pytest
+
+pytest.importorskip("langchain")
+
+from worker.llm_cache import LLMCache
+
+
+def test_stats_since_a_snapshot_count_only_later_lookups(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite"), max_entries=10, max_bytes=10000, max_age_seconds=60)
+    cache.put("page-1", {"summary": "one"}, tokens=100, seconds=2.0)
+    cache.get("page-1")
+    cache.get("page-2")
+
+    since = cache.counters()
+    cache.get("page-1")
+    cache.get("page-1")
+    cache.get("page-3")
+
+    assert cache.stats(since) == {"hits": 2, "misses": 1, "hit_rate": 2 / 3, "tokens_saved": 200, "seconds_saved": 4.0}
+    assert cache.stats()["hits"] == 3
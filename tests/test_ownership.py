@@ -0,0 +1,25 @@
+"""Ownership resolves to a single, stable owner per document."""
+import pytest
+
+pytest.importorskip("neo4j")
+
+from worker import ownership
+from tests.fakes import FakeDriver
+
+
+def test_backfill_picks_one_owner_per_document(monkeypatch):
+    monkeypatch.setattr(ownership, "_indexes_ready", True)
+    driver = FakeDriver()
+
+    ownership.backfill(driver, batch_size=10)
+
+    [(query, params)] = driver.queries
+    assert params == {"batch_size": 10}
+    assert "RETURN ua.useruuid AS owner ORDER BY owner LIMIT 1 }" in query
+    assert "SET p.owner_uuid = owner" in query and "SET c.owner_uuid = owner" in query
+
+
+def test_document_owner_matches_the_backfill_choice():
+    driver = FakeDriver({r"ORDER BY owner LIMIT 1": [{"owner": "user-a"}]})
+
+    assert ownership.document_owner(driver, "doc") == "user-a"
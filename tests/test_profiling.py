@@ -0,0 +1,70 @@
+"""Request profiling is admin only and samples just the thread running the request."""
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import profiling
+from config import AppConfig
+from worker.profiling import profile_path
+
+
+def busy(seconds: float):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def other_request_work(stop: threading.Event):
+    while not stop.is_set():
+        busy(0.01)
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(AppConfig, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(AppConfig, "PROFILE_SAMPLE_INTERVAL_MS", 1)
+    app = FastAPI()
+
+    @app.get("/work")
+    def work():
+        busy(0.2)
+        return {"ok": True}
+
+    profiling.install_profiling(app)
+    return TestClient(app)
+
+
+def test_non_admin_cannot_profile(client, tmp_path):
+    response = client.get("/work", headers={"X-Profile": "1"})
+
+    assert response.status_code == 403
+    assert not list(tmp_path.iterdir())
+    assert client.get("/work").json() == {"ok": True}
+
+
+def test_profile_samples_only_the_request_thread(client, monkeypatch):
+    async def admin(scope):
+        return True
+
+    monkeypatch.setattr(profiling, "is_admin", admin)
+    stop = threading.Event()
+    other = threading.Thread(target=other_request_work, args=(stop,))
+    other.start()
+    try:
+        response = client.get("/work?profile=1")
+    finally:
+        stop.set()
+        other.join()
+
+    assert response.status_code == 200
+    with open(profile_path(response.headers["X-Profile-Id"], "folded")) as f:
+        stacks = f.read()
+    assert "work (test_profiling.py" in stacks
+    assert "other_request_work" not in stacks
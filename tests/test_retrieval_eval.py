@@ -0,0 +1,32 @@
+"""Scoring of retrieval runs: recall@k and MRR under a score threshold, and target parsing."""
+import pytest
+
+pytest.importorskip("neo4j")
+pytest.importorskip("langchain")
+
+from worker.retrieval_eval import parse_target, percentile, ranked_pages, score_run
+
+
+def test_recall_and_mrr_drop_hits_under_the_threshold():
+    questions = [{"page": "p1"}, {"page": "p2"}, {"page": "p3"}]
+    results = [
+        ranked_pages([("p1", 0.9), ("p1", 0.8), ("p4", 0.7)]),
+        ranked_pages([("p4", 0.9), ("p2", 0.85), ("p1", 0.2)]),
+        ranked_pages([("p4", 0.9), ("p3", 0.5)]),
+    ]
+
+    assert results[0] == [("p1", 0.9), ("p4", 0.7)]
+    assert score_run(questions, results, 0.0) == {"recall": 1.0, "mrr": pytest.approx((1 + 1 / 2 + 1 / 2) / 3)}
+    # p3 only scores 0.5, so it is no longer retrieved
+    assert score_run(questions, results, 0.8) == {"recall": pytest.approx(2 / 3), "mrr": pytest.approx((1 + 1 / 2) / 3)}
+    assert (percentile([3.0, 1.0, 2.0], 0.5), percentile([], 0.95)) == (2.0, None)
+
+
+def test_parse_target_rejects_an_unknown_index():
+    assert parse_target("neo4j:index=summary") == {"name": "neo4j:index=summary", "kind": "neo4j", "index": "summary"}
+    assert parse_target("inprocess:chunk=200,backend=hashing,dim=64")["chunk"] == 200
+
+    with pytest.raises(ValueError, match="index must be one of"):
+        parse_target("neo4j:index=questions")
+    with pytest.raises(ValueError, match="expected neo4j"):
+        parse_target("faiss:index=parent_document")
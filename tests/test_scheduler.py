@@ -0,0 +1,45 @@
+"""Backlog order: shortest job first per owner, fair share across owners, large documents deprioritized."""
+import pytest
+
+pytest.importorskip("decouple")
+
+from app import scheduler
+from config import AppConfig
+
+
+@pytest.fixture(autouse=True)
+def priorities(monkeypatch):
+    monkeypatch.setattr(AppConfig, "SCHEDULER_TOKENS_PER_WORD", 1.0)
+    monkeypatch.setattr(AppConfig, "SCHEDULER_LARGE_DOCUMENT_TOKENS", 1000)
+    monkeypatch.setattr(AppConfig, "SCHEDULER_LARGE_DOCUMENT_PRIORITY", 5)
+    monkeypatch.setattr(AppConfig, "INGEST_PRIORITY", 8)
+
+
+def document(uuid: str, owner: str, wordcount: int) -> dict:
+    return {"uuid": uuid, "owner": owner, "wordcount": wordcount, "chars": None}
+
+
+def test_shortest_job_first_within_an_owner():
+    jobs = scheduler.schedule([document("long", "a", 300), document("short", "a", 100), document("mid", "a", 200)])
+
+    assert [job["uuid"] for job in jobs] == ["short", "mid", "long"]
+    assert [job["finish"] for job in jobs] == [100, 300, 600]
+
+
+def test_owners_share_the_workers_fairly():
+    jobs = scheduler.schedule([document(f"a{n}", "a", 100) for n in range(3)] + [document("b0", "b", 150), document("b1", "b", 150)])
+
+    # a finishes at 100, 200, 300 and b at 150, 300: b's documents are interleaved with a's
+    assert [job["uuid"][0] for job in jobs] == ["a", "b", "a", "a", "b"]
+
+
+def test_large_documents_get_the_lower_priority():
+    jobs = scheduler.schedule([document("large", "a", 5000), document("small", "b", 600), document("none", None, None)])
+
+    assert {job["uuid"]: job["priority"] for job in jobs} == {"large": 5, "small": 8, "none": 8}
+    assert jobs[-1]["uuid"] == "large"
+    assert [job["priority"] for job in scheduler.schedule([document("large", "a", 5000)], priority_override=9)] == [9]
+
+
+def test_priority_for_splits_at_the_large_document_threshold():
+    assert (scheduler.priority_for(999), scheduler.priority_for(1000), scheduler.priority_for(1000, override=2)) == (8, 5, 2)
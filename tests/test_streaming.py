@@ -0,0 +1,91 @@
+"""
+Peak memory of streaming ingest stays flat as documents get longer.
+
+Each document is ingested by process_text in a fresh process, through the
+streaming path with dedup, page writes, the usage ledger and batched
+enrichment queuing, against a fake driver that keeps nothing. Both the
+Python allocation peak (tracemalloc) and the growth of the resident set
+high-water mark must stay about the same for a document ten times longer.
+"""
+import multiprocessing
+import resource
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+pytest.importorskip("celery")
+pytest.importorskip("langchain")
+
+PAGES = 50
+FACTOR = 10
+TOLERANCE = 1.5
+# Allocator and interpreter noise in the resident set, in KiB
+RSS_SLACK_KIB = 4 * 1024
+
+
+def synthetic_text(pages: int) -> str:
+    # Sentences of pseudo-random words, about 40 per 2000 character page, so chunks are not duplicates
+    return "".join(
+        " ".join(f"w{(n * 7919 + i * 104729) % 100003}" for i in range(8)) + ".\n"
+        for n in range(pages * 40)
+    )
+
+
+def ingest_peak(pages: int):
+    """Ingest a synthetic document of about `pages` pages; returns (tracemalloc peak bytes, RSS growth KiB, enrichment tasks)."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    from config import AppConfig
+    from worker import dedup, tasks, usage
+    from worker.embeddings import HashingEmbeddings
+    from tests.fakes import FakeDriver, FakeTask, WordEncoding
+
+    # A fresh process per document, so the module state can be set directly
+    AppConfig.INGEST_STREAMING_THRESHOLD_CHARS = 0
+    AppConfig.INGEST_STREAMING_WINDOW_CHARS = 20000
+    AppConfig.INGEST_STREAMING_ENRICHMENT_PAGES = 200
+    AppConfig.DEDUP_MODE = "reuse"
+    dedup.chunk_index = dedup.SimHashIndex(100)
+    usage.embedding_encoding = WordEncoding
+    # The document exists and is not cancelled; every other query returns no rows
+    driver = FakeDriver({r"AS cancelled": [{"cancelled": False}]}, record=False)
+    splitters = (
+        RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=0),
+        RecursiveCharacterTextSplitter(chunk_size=400, chunk_overlap=50),
+    )
+    embeddings = HashingEmbeddings(256)
+    tasks.get_driver = lambda: driver
+    tasks.get_splitters = lambda: splitters
+    tasks.get_embeddings = lambda: embeddings
+    tasks.queue_enrichment = lambda app, documentId, questions, summaries, page_uuids=None: ["enrichment"]
+
+    def ingest(text: str) -> dict:
+        result = tasks.process_text(FakeTask(), text, "document", True, True)
+        assert result["message"] == "Success", result
+        return result
+
+    # Tokenizer and ledger caches are loaded outside the measurement
+    ingest(synthetic_text(2))
+    text = synthetic_text(pages)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    result = ingest(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    return peak, rss_growth, len(result["enrichment_task_ids"])
+
+
+def run_isolated(pages: int):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(ingest_peak, pages).result()
+
+
+def test_streaming_ingest_peak_memory_is_flat():
+    small_peak, small_rss, _ = run_isolated(PAGES)
+    large_peak, large_rss, enrichment_tasks = run_isolated(PAGES * FACTOR)
+
+    assert enrichment_tasks > 1, "enrichment was not queued in page batches"
+    assert large_peak <= small_peak * TOLERANCE, f"allocation peak {small_peak} -> {large_peak} bytes"
+    assert large_rss <= small_rss * TOLERANCE + RSS_SLACK_KIB, f"resident set growth {small_rss} -> {large_rss} KiB"
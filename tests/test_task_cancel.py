@@ -0,0 +1,57 @@
+"""Cancelling a task checks the caller may change its document before anything is revoked."""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import document, processing
+from config import AppConfig
+from tests.fakes import FakeDriver
+
+
+@pytest.fixture
+def client(monkeypatch):
+    revoked = []
+    driver = FakeDriver({
+        r"Document \{task_id: \$task_id\}": lambda params: [{"uuid": "doc"}] if params["task_id"] == "ingest-1" else [],
+        r"RETURN EXISTS": lambda params: [{"owned": params["useruuid"] == "owner"}],
+    })
+    monkeypatch.setattr(processing, "shared_driver", driver)
+    monkeypatch.setattr(document, "driver", driver)
+    monkeypatch.setattr(processing, "get_task_info", lambda task_id: {"task_id": task_id, "status": "PENDING"})
+    monkeypatch.setattr(processing, "revoke_task", revoked.append)
+    monkeypatch.setattr(document, "revoke_task", revoked.append)
+    monkeypatch.setattr(document, "request_cancel", lambda driver, document_id: None)
+    user = {}
+    app = FastAPI()
+    app.include_router(processing.router)
+    app.dependency_overrides[processing.get_current_user] = lambda: SimpleNamespace(uuid=user["uuid"])
+
+    def as_user(uuid):
+        user["uuid"] = uuid
+        return TestClient(app)
+    return as_user, revoked
+
+
+def test_other_users_cannot_revoke_a_document_task(client):
+    as_user, revoked = client
+
+    assert as_user("someone-else").post("/task/ingest-1/cancel").status_code == 403
+    assert revoked == []
+
+    assert as_user("owner").post("/task/ingest-1/cancel").json()["uuid"] == "doc"
+    assert revoked == ["ingest-1"]
+
+
+def test_only_the_admin_can_revoke_a_task_without_a_document(client):
+    as_user, revoked = client
+
+    assert as_user("owner").post("/task/other-1/cancel").status_code == 403
+    assert revoked == []
+
+    assert as_user(AppConfig.DEFAULT_USER_UUID).post("/task/other-1/cancel").json()["message"] == "Task revoked"
+    assert revoked == ["other-1"]
@@ -0,0 +1,26 @@
+"""Task states are read from a key/value result backend in one round trip."""
+import pytest
+
+pytest.importorskip("celery")
+
+from celery import states
+
+from app.task_client import celery_client, get_task_infos
+
+
+def test_get_task_infos_reads_all_states_with_one_mget(monkeypatch):
+    backend = celery_client.backend
+    backend.store_result("done", {"message": "Success"}, states.SUCCESS)
+    backend.store_result("running", {"stage": "pages", "page": 3}, states.STARTED)
+    calls = []
+    mget = backend.mget
+    monkeypatch.setattr(backend, "mget", lambda keys: calls.append(keys) or mget(keys))
+
+    infos = get_task_infos(["done", "running", "unknown"])
+
+    assert len(calls) == 1
+    assert infos == [
+        {"task_id": "done", "result": {"message": "Success"}, "status": states.SUCCESS},
+        {"task_id": "running", "status": states.STARTED, "progress": {"stage": "pages", "page": 3}},
+        {"task_id": "unknown", "status": states.PENDING},
+    ]
@@ -0,0 +1,47 @@
+"""Progress streams end for task ids that never start and reject malformed messages."""
+import json
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import processing
+from config import AppConfig
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(AppConfig, "PROGRESS_STREAM_INTERVAL", 0.01)
+    monkeypatch.setattr(AppConfig, "PROGRESS_STREAM_IDLE_TIMEOUT", 0.05)
+    done = {"task_id": "done", "result": {"message": "Success"}, "status": "SUCCESS"}
+    monkeypatch.setattr(processing, "get_task_infos", lambda task_ids: [
+        done if task_id == "done" else {"task_id": task_id, "status": "PENDING"} for task_id in task_ids])
+    app = FastAPI()
+    app.include_router(processing.router)
+    return TestClient(app)
+
+
+def test_stream_times_out_unknown_ids(client):
+    body = client.get("/tasks/stream", params={"task_ids": ["done", "unknown"]}).text
+
+    events = [block.split("\n") for block in body.strip().split("\n\n")]
+    events = [(event[0], json.loads(event[1][len("data: "):]).get("task_id")) for event in events]
+    assert sorted(events[:2]) == [("event: progress", "done"), ("event: progress", "unknown")]
+    assert events[2:] == [("event: timeout", "unknown"), ("event: done", None)]
+
+
+def test_socket_answers_malformed_messages_with_an_error(client):
+    with client.websocket_connect("/ws/tasks") as socket:
+        socket.send_text("not json")
+        assert "error" in socket.receive_json()
+        socket.send_json(["unknown"])
+        assert "error" in socket.receive_json()
+        socket.send_json({"task_ids": "unknown"})
+        assert "error" in socket.receive_json()
+
+        socket.send_json({"task_ids": ["unknown"]})
+        assert socket.receive_json() == {"task_id": "unknown", "status": "PENDING"}
+        assert socket.receive_json() == {"task_id": "unknown", "status": "PENDING", "timed_out": True}
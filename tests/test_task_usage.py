@@ -0,0 +1,41 @@
+"""A failing usage write never changes how an enrichment task ends."""
+import pytest
+
+pytest.importorskip("langchain")
+
+from worker import tasks
+from tests.fakes import FakeDriver
+
+
+@pytest.fixture
+def task_env(monkeypatch):
+    driver = FakeDriver({r"AS cancelled": [{"cancelled": False}]})
+    monkeypatch.setattr(tasks, "get_driver", lambda: driver)
+    monkeypatch.setattr(tasks, "get_llm", lambda: None)
+    monkeypatch.setattr(tasks, "get_embeddings", lambda: None)
+    monkeypatch.setattr(tasks, "load_pages", lambda driver, documentId, page_uuids: [])
+
+    def unavailable(*args):
+        raise ConnectionError("neo4j unavailable")
+
+    monkeypatch.setattr(tasks, "record_document_usage", unavailable)
+
+
+def test_enrichment_succeeds_when_usage_cannot_be_recorded(task_env, monkeypatch):
+    monkeypatch.setattr(tasks, "generate_questions", lambda *args: None)
+
+    result = tasks.generate_questions_task.apply(args=["doc", ["page-1"]], task_id="task-1")
+
+    assert result.get()["message"] == "Success"
+
+
+def test_enrichment_error_is_not_hidden_by_the_usage_write(task_env, monkeypatch):
+    def fail(*args):
+        raise ValueError("LLM error")
+
+    monkeypatch.setattr(tasks, "enrich_pages", fail)
+
+    result = tasks.enrich_document_task.apply(args=["doc", ["page-1"]], task_id="task-1")
+
+    with pytest.raises(ValueError, match="LLM error"):
+        result.get()
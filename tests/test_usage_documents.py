@@ -0,0 +1,50 @@
+"""Usage listings read only the usage keys of each document, never its text."""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import usage
+from app.routers.utils import get_current_user
+from tests.fakes import FakeDriver
+
+
+def test_usage_documents_returns_only_usage_keys(monkeypatch):
+    row = {"properties": {"uuid": "doc", "name": "Report", "wordcount": 900,
+                          "usage": [["usage_tokens", 1200], ["usage_seconds", 4.5], ["usage_pages_prompt_tokens", 1200]]}}
+    driver = FakeDriver({r"MATCH \(d:Document": [row]})
+    monkeypatch.setattr(usage, "driver", driver)
+    app = FastAPI()
+    app.include_router(usage.router)
+    app.dependency_overrides[usage.get_admin_user] = lambda: SimpleNamespace(uuid="admin")
+
+    [document] = TestClient(app).get("/usage/documents", params={"limit": 5}).json()
+
+    assert (document["uuid"], document["wordcount"], document["tokens"], document["seconds"]) == ("doc", 900, 1200, 4.5)
+    assert document["stages"]["pages"]["prompt_tokens"] == 1200
+    [(query, params)] = driver.queries
+    assert "properties(d)" not in query and params == {"limit": 5}
+
+
+def test_usage_chat_is_admin_only(monkeypatch, tmp_path):
+    from config import AppConfig
+    from worker.usage import append_chat_usage
+
+    monkeypatch.setattr(AppConfig, "USAGE_LOG_DIR", str(tmp_path))
+    append_chat_usage({"user": "user-a", "question": "What is in my contract?", "sources": 1,
+                       "totals": {"tokens": 100, "seconds": 1.0}})
+    app = FastAPI()
+    app.include_router(usage.router)
+    client = TestClient(app)
+
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(uuid="user-b")
+    response = client.get("/usage/chat")
+    assert response.status_code == 403 and "contract" not in response.text
+
+    app.dependency_overrides[usage.get_admin_user] = lambda: SimpleNamespace(uuid=AppConfig.DEFAULT_USER_UUID)
+    [record] = client.get("/usage/chat").json()["most_expensive"]
+    assert record["question"] == "What is in my contract?"
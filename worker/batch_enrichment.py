@@ -0,0 +1,418 @@
+"""
+Offline enrichment for backfills through a JSONL batch endpoint.
+
+Pages missing Question or Summary nodes are written as chat-completion requests
+into JSONL files, submitted to an OpenAI-compatible batch endpoint, polled until
+complete and bulk-ingested into the graph, BATCH_INGEST_LINES output lines
+per write transaction and embed_documents call. Each job keeps a manifest in
+BATCH_WORK_DIR, written before its pages are claimed with p.batch_job, so an
+interrupted backfill resumes every open job where it stopped (reading a job's
+pages back from the graph when it stopped right after claiming them) and
+never resubmits its pages. Ingesting a job clears the claim of every page whose
+requests all came back and releases the others for a later job.
+
+Usage:
+    python -m worker.batch_enrichment run [--limit N] [--poll-interval SECONDS]
+    python -m worker.batch_enrichment status
+
+Point BATCH_API_BASE_URL at worker.batch_stub_server for local runs and tests.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+import httpx
+from neo4j import GraphDatabase
+from langchain.utils.openai_functions import convert_pydantic_to_openai_function
+
+from config import AppConfig
+from .embeddings import create_embeddings, check_index_dimensions
+from .processing_functions import QUESTIONS_PROMPT, SUMMARY_PROMPT, Questions, node_uuid
+
+
+# Job states, in order
+JOB_CLAIMING = "claiming"
+JOB_PREPARED = "prepared"
+JOB_SUBMITTED = "submitted"
+JOB_COMPLETED = "completed"
+JOB_INGESTED = "ingested"
+
+ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+# Pages whose requests failed this many times are left out of new jobs
+MAX_PAGE_FAILURES = 3
+
+
+class BatchClient:
+    """Minimal client for an OpenAI-compatible files + batches API."""
+
+    def __init__(self, base_url: str, api_key: str, timeout: float = 60):
+        self.http = httpx.Client(base_url=base_url, headers={"Authorization": f"Bearer {api_key}"}, timeout=timeout)
+
+    def upload(self, path: str) -> str:
+        with open(path, "rb") as f:
+            response = self.http.post("/files", data={"purpose": "batch"}, files={"file": (os.path.basename(path), f)})
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def create_batch(self, input_file_id: str) -> dict:
+        response = self.http.post("/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": AppConfig.BATCH_COMPLETION_WINDOW,
+        })
+        response.raise_for_status()
+        return response.json()
+
+    def get_batch(self, batch_id: str) -> dict:
+        response = self.http.get(f"/batches/{batch_id}")
+        response.raise_for_status()
+        return response.json()
+
+    def download(self, file_id: str) -> str:
+        response = self.http.get(f"/files/{file_id}/content")
+        response.raise_for_status()
+        return response.text
+
+
+def to_openai_messages(prompt, **kwargs) -> list:
+    return [{"role": ROLES[m.type], "content": m.content} for m in prompt.format_messages(**kwargs)]
+
+
+def build_requests(page: dict, model: str) -> list:
+    """Chat-completion requests for whatever the page is missing, using the interactive prompts."""
+    requests = []
+    if not page["has_questions"]:
+        function = convert_pydantic_to_openai_function(Questions)
+        requests.append({
+            "custom_id": f"questions:{page['uuid']}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "temperature": 0,
+                "messages": to_openai_messages(QUESTIONS_PROMPT, input=page["text"]),
+                "tools": [{"type": "function", "function": function}],
+                "tool_choice": {"type": "function", "function": {"name": function["name"]}},
+            },
+        })
+    if not page["has_summary"]:
+        requests.append({
+            "custom_id": f"summary:{page['uuid']}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "temperature": 0,
+                "messages": to_openai_messages(SUMMARY_PROMPT, question=page["text"]),
+            },
+        })
+    return requests
+
+
+## Job bookkeeping
+
+def manifest_path(job_id: str) -> str:
+    return os.path.join(AppConfig.BATCH_WORK_DIR, job_id, "manifest.json")
+
+
+def save_manifest(manifest: dict):
+    path = manifest_path(manifest["job_id"])
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def open_manifests() -> list:
+    if not os.path.isdir(AppConfig.BATCH_WORK_DIR):
+        return []
+    manifests = []
+    for job_id in sorted(os.listdir(AppConfig.BATCH_WORK_DIR)):
+        path = manifest_path(job_id)
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest["status"] != JOB_INGESTED:
+                manifests.append(manifest)
+    return manifests
+
+
+## Steps
+
+def prepare_job(driver, limit: int):
+    """Claim up to `limit` pages missing enrichment for a new job and write their requests to a JSONL file."""
+    job_id = time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:8]
+    # The manifest exists before any page carries the job id, so a crash after the claim is resumed
+    manifest = {"job_id": job_id, "status": JOB_CLAIMING, "pages": {}}
+    os.makedirs(os.path.dirname(manifest_path(job_id)), exist_ok=True)
+    save_manifest(manifest)
+    with driver.session() as session:
+        session.run(
+            """
+            MATCH (:Document)-[:HAS_PAGE]->(p:Page)
+            WHERE p.batch_job IS NULL
+                AND coalesce(p.batch_failures, 0) < $max_failures
+                AND (NOT (p)-[:HAS_QUESTION]->() OR NOT (p)-[:HAS_SUMMARY]->())
+            WITH p LIMIT $limit
+            SET p.batch_job = $job_id
+            """,
+            {"limit": limit, "job_id": job_id, "max_failures": MAX_PAGE_FAILURES},
+        ).consume()
+    return write_job_input(driver, manifest)
+
+
+def write_job_input(driver, manifest: dict):
+    """Write the requests of the pages claimed by a job and mark it prepared; a job that claimed nothing is removed."""
+    job_id = manifest["job_id"]
+    with driver.session() as session:
+        result = session.run(
+            """
+            MATCH (d:Document)-[:HAS_PAGE]->(p:Page {batch_job: $job_id})
+            RETURN d.uuid AS document_uuid, p.uuid AS uuid, p.name AS name, p.text AS text,
+                EXISTS { (p)-[:HAS_QUESTION]->() } AS has_questions,
+                EXISTS { (p)-[:HAS_SUMMARY]->() } AS has_summary
+            """,
+            {"job_id": job_id},
+        )
+        pages = [record.data() for record in result]
+    if not pages:
+        shutil.rmtree(os.path.dirname(manifest_path(job_id)), ignore_errors=True)
+        return None
+
+    input_path = os.path.join(AppConfig.BATCH_WORK_DIR, job_id, "input.jsonl")
+    requested = {}
+    with open(input_path, "w") as f:
+        for page in pages:
+            requests = build_requests(page, AppConfig.OPENAI_CHAT_MODEL)
+            requested[page["uuid"]] = [request["custom_id"] for request in requests]
+            for request in requests:
+                f.write(json.dumps(request) + "\n")
+
+    manifest.update(
+        status=JOB_PREPARED,
+        input_path=input_path,
+        pages={page["uuid"]: {"document_uuid": page["document_uuid"], "name": page["name"], "requests": requested[page["uuid"]]}
+               for page in pages},
+    )
+    save_manifest(manifest)
+    logging.info(f"Prepared batch job {job_id} for {len(pages)} pages")
+    return manifest
+
+
+def submit_job(client: BatchClient, manifest: dict):
+    input_file_id = client.upload(manifest["input_path"])
+    batch = client.create_batch(input_file_id)
+    manifest.update(status=JOB_SUBMITTED, input_file_id=input_file_id, batch_id=batch["id"])
+    save_manifest(manifest)
+    logging.info(f"Submitted batch job {manifest['job_id']} as batch {batch['id']}")
+
+
+def poll_job(client: BatchClient, manifest: dict):
+    batch = client.get_batch(manifest["batch_id"])
+    if batch["status"] == "completed":
+        output_path = os.path.join(AppConfig.BATCH_WORK_DIR, manifest["job_id"], "output.jsonl")
+        with open(output_path, "w") as f:
+            f.write(client.download(batch["output_file_id"]) if batch.get("output_file_id") else "")
+        manifest.update(status=JOB_COMPLETED, output_path=output_path)
+        save_manifest(manifest)
+    elif batch["status"] in ("failed", "expired", "cancelled"):
+        # Everything that did not come back is released for a later job
+        logging.error(f"Batch {manifest['batch_id']} ended as {batch['status']}")
+        manifest.update(status=JOB_COMPLETED, output_path=None)
+        save_manifest(manifest)
+
+
+def parse_output_line(line: dict):
+    """Return (kind, page_uuid, value) for a batch output line, or (kind, page_uuid, None) on error."""
+    kind, page_uuid = line["custom_id"].split(":", 1)
+    response = line.get("response") or {}
+    if line.get("error") or response.get("status_code") != 200:
+        return kind, page_uuid, None
+    message = response["body"]["choices"][0]["message"]
+    if kind == "questions":
+        arguments = message["tool_calls"][0]["function"]["arguments"]
+        return kind, page_uuid, json.loads(arguments)["questions"][:AppConfig.MAX_QUESTIONS_PER_PAGE]
+    return kind, page_uuid, message["content"]
+
+
+WRITE_QUESTIONS = """
+    UNWIND $pages AS page
+    MATCH (p:Page {uuid: page.uuid})-[:HAS_QUESTION]->(old:Question)
+    WHERE NOT old.uuid IN page.question_uuids
+    DETACH DELETE old
+    """
+
+MERGE_QUESTIONS = """
+    UNWIND $questions AS question
+    MATCH (p:Page {uuid: question.page_uuid})
+    MERGE (q:Question {uuid: question.uuid})
+    SET q.text = question.text, q.name = question.name, q.datecreated = datetime(), q.source = p.uuid
+    MERGE (q)<-[:HAS_QUESTION]-(p)
+    WITH q, question
+    CALL db.create.setVectorProperty(q, 'embedding', question.embedding)
+    YIELD node
+    RETURN count(*)
+    """
+
+MERGE_SUMMARIES = """
+    UNWIND $summaries AS summary
+    MATCH (p:Page {uuid: summary.page_uuid})
+    MERGE (p)-[:HAS_SUMMARY]->(s:Summary)
+    SET s.text = summary.text, s.datecreated = datetime(), s.uuid = summary.uuid, s.source = p.uuid
+    WITH s, summary
+    CALL db.create.setVectorProperty(s, 'embedding', summary.embedding)
+    YIELD node
+    RETURN count(*)
+    """
+
+
+def write_results(driver, embeddings, pages: dict, results: list):
+    """
+    Write a chunk of (kind, page_uuid, value) results in one transaction, with every
+    question and summary embedded by a single embed_documents call. Node uuids and
+    the replacement of a page's older questions match write_questions and write_summary.
+    """
+    questions, summaries, question_pages = [], [], []
+    for kind, page_uuid, value in results:
+        page = pages[page_uuid]
+        page_number = int(page["name"].replace("Page ", ""))
+        if kind == "questions":
+            rows = [
+                {"page_uuid": page_uuid, "uuid": node_uuid(page["document_uuid"], "question", page_number, iq+1),
+                 "name": f"{page_number}-{iq+1}", "text": q}
+                for iq, q in enumerate(value) if q
+            ]
+            questions += rows
+            question_pages.append({"uuid": page_uuid, "question_uuids": [row["uuid"] for row in rows]})
+        else:
+            summaries.append({"page_uuid": page_uuid, "uuid": node_uuid(page["document_uuid"], "summary", page_number), "text": value})
+    rows = questions + summaries
+    if not rows:
+        return
+    for row, embedding in zip(rows, embeddings.embed_documents([row["text"] for row in rows])):
+        row["embedding"] = embedding
+
+    def write(tx):
+        tx.run(WRITE_QUESTIONS, {"pages": question_pages})
+        tx.run(MERGE_QUESTIONS, {"questions": questions})
+        tx.run(MERGE_SUMMARIES, {"summaries": summaries})
+
+    with driver.session() as session:
+        session.execute_write(write)
+
+
+def ingest_job(driver, embeddings, manifest: dict):
+    """Write the job's results to the graph; pages with failed or missing requests are released for a later job."""
+    pages = manifest["pages"]
+    ingested = set(manifest.get("ingested", []))
+    failed = set()
+
+    def flush(chunk: list):
+        write_results(driver, embeddings, pages, [result for _, result in chunk])
+        # Lines count as ingested only once their chunk is committed
+        ingested.update(custom_id for custom_id, _ in chunk)
+        manifest["ingested"] = sorted(ingested)
+        save_manifest(manifest)
+
+    if manifest.get("output_path"):
+        chunk = []
+        with open(manifest["output_path"]) as f:
+            for raw in f:
+                if not raw.strip():
+                    continue
+                line = json.loads(raw)
+                if line["custom_id"] in ingested:
+                    continue
+                kind, page_uuid, value = parse_output_line(line)
+                if value is None:
+                    failed.add(page_uuid)
+                    continue
+                chunk.append((line["custom_id"], (kind, page_uuid, value)))
+                if len(chunk) >= AppConfig.BATCH_INGEST_LINES:
+                    flush(chunk)
+                    chunk = []
+        if chunk:
+            flush(chunk)
+
+    # A page keeps its claim only if every one of its requests came back (manifests from
+    # before requests were recorded assume both)
+    unanswered = {uuid for uuid, page in pages.items()
+                  if not set(page.get("requests", [f"questions:{uuid}", f"summary:{uuid}"])) <= ingested}
+    release = sorted(failed | unanswered)
+    with driver.session() as session:
+        session.run(
+            """
+            MATCH (p:Page) WHERE p.uuid IN $uuids AND p.batch_job = $job_id
+            SET p.batch_failures = coalesce(p.batch_failures, 0) + 1
+            REMOVE p.batch_job
+            """,
+            {"uuids": release, "job_id": manifest["job_id"]},
+        )
+        session.run(
+            "MATCH (p:Page) WHERE p.uuid IN $uuids AND p.batch_job = $job_id REMOVE p.batch_job",
+            {"uuids": sorted(set(pages) - set(release)), "job_id": manifest["job_id"]},
+        )
+    manifest.update(status=JOB_INGESTED, ingested=sorted(ingested), released=release)
+    save_manifest(manifest)
+    logging.info(f"Ingested batch job {manifest['job_id']}: {len(ingested)} results, {len(release)} pages released")
+
+
+def run_step(driver, client: BatchClient, embeddings, limit: int) -> dict:
+    """Advance every open job by one step, then prepare and submit a new job if none is in flight."""
+    manifests = open_manifests()
+    for manifest in manifests:
+        if manifest["status"] == JOB_CLAIMING:
+            if write_job_input(driver, manifest) is None:
+                manifest["status"] = JOB_INGESTED
+        if manifest["status"] == JOB_PREPARED:
+            submit_job(client, manifest)
+        elif manifest["status"] == JOB_SUBMITTED:
+            poll_job(client, manifest)
+        if manifest["status"] == JOB_COMPLETED:
+            ingest_job(driver, embeddings, manifest)
+
+    in_flight = [m for m in manifests if m["status"] != JOB_INGESTED]
+    if not in_flight:
+        manifest = prepare_job(driver, limit)
+        if manifest:
+            submit_job(client, manifest)
+            in_flight.append(manifest)
+    return {"open_jobs": [{"job_id": m["job_id"], "status": m["status"], "pages": len(m["pages"])} for m in in_flight]}
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Backfill questions and summaries through a batch endpoint")
+    parser.add_argument("command", choices=["run", "status"])
+    parser.add_argument("--limit", type=int, default=AppConfig.BATCH_MAX_PAGES_PER_JOB, help="Pages per batch job")
+    parser.add_argument("--poll-interval", type=float, default=60, help="Seconds between polls")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for manifest in open_manifests():
+            print(f"{manifest['job_id']}: {manifest['status']} ({len(manifest['pages'])} pages)")
+        return
+
+    AppConfig.initialize_environment_variables()
+    driver = GraphDatabase.driver(AppConfig.NEO4J_URI, auth=(AppConfig.NEO4J_USER, AppConfig.NEO4J_PASSWORD))
+    client = BatchClient(AppConfig.BATCH_API_BASE_URL, AppConfig.OPENAI_API_KEY)
+    embeddings = create_embeddings()
+    try:
+        check_index_dimensions(driver)
+        while True:
+            state = run_step(driver, client, embeddings, args.limit)
+            if not state["open_jobs"]:
+                logging.info("Backfill complete, no pages left to enrich")
+                break
+            time.sleep(args.poll_interval)
+    finally:
+        driver.close()
+
+
+if __name__ == "__main__":
+    main()
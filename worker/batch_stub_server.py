@@ -0,0 +1,86 @@
+"""
+Local stand-in for the files + batches endpoints used by worker.batch_enrichment.
+
+Batches complete as soon as they are polled, with deterministic answers derived
+from the request text, so backfills can be exercised without calling OpenAI:
+
+    uvicorn worker.batch_stub_server:app --port 8100
+    BATCH_API_BASE_URL=http://localhost:8100/v1 python -m worker.batch_enrichment run
+"""
+import json
+import uuid
+
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+app = FastAPI()
+
+files = {}
+batches = {}
+
+
+class BatchRequest(BaseModel):
+    input_file_id: str
+    endpoint: str
+    completion_window: str
+
+
+def stub_answer(request: dict) -> dict:
+    body = request["body"]
+    text = body["messages"][-1]["content"]
+    words = " ".join(text.split()[-12:])
+    if body.get("tools"):
+        arguments = json.dumps({"questions": [f"What does the text say about {words}?", f"Why does {words} matter?"]})
+        function_name = body["tools"][0]["function"]["name"]
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{"id": "call_" + uuid.uuid4().hex[:8], "type": "function",
+                            "function": {"name": function_name, "arguments": arguments}}],
+        }
+    else:
+        message = {"role": "assistant", "content": f"Summary: {words}"}
+    return {
+        "id": "batch_req_" + uuid.uuid4().hex[:8],
+        "custom_id": request["custom_id"],
+        "response": {"status_code": 200, "body": {"choices": [{"index": 0, "message": message}]}},
+        "error": None,
+    }
+
+
+@app.post("/v1/files")
+async def upload_file(purpose: str = Form(...), file: UploadFile = File(...)):
+    file_id = "file-" + uuid.uuid4().hex
+    files[file_id] = (await file.read()).decode("utf-8")
+    return {"id": file_id, "object": "file", "purpose": purpose}
+
+
+@app.get("/v1/files/{file_id}/content", response_class=PlainTextResponse)
+async def file_content(file_id: str):
+    if file_id not in files:
+        raise HTTPException(status_code=404, detail="File not found")
+    return files[file_id]
+
+
+@app.post("/v1/batches")
+async def create_batch(request: BatchRequest):
+    if request.input_file_id not in files:
+        raise HTTPException(status_code=404, detail="Input file not found")
+    batch_id = "batch_" + uuid.uuid4().hex
+    batches[batch_id] = {"id": batch_id, "object": "batch", "status": "in_progress",
+                         "input_file_id": request.input_file_id, "output_file_id": None}
+    return batches[batch_id]
+
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    batch = batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if batch["status"] == "in_progress":
+        lines = [json.loads(line) for line in files[batch["input_file_id"]].splitlines() if line.strip()]
+        output_file_id = "file-" + uuid.uuid4().hex
+        files[output_file_id] = "".join(json.dumps(stub_answer(line)) + "\n" for line in lines)
+        batch.update(status="completed", output_file_id=output_file_id)
+    return batch
@@ -0,0 +1,109 @@
+"""
+Cooperative cancellation and deadlines for processing tasks.
+
+Cancelling a document sets d.cancel_requested. Ingest and enrichment tasks hold
+a CancellationToken and call check() between pages; it reads the flag at most
+every CANCEL_CHECK_INTERVAL_SECONDS and raises TaskCancelled once the flag is
+set or the task's deadline has passed. Each page is written in one transaction
+with its checkpoint, so a cancelled task leaves whole pages only: the task
+records d.cancelled_at, d.cancelled_stage and d.cancel_reason, returns, and the
+worker slot is free for the next task. Celery's soft time limit
+(TASK_SOFT_TIME_LIMIT_SECONDS) is handled the same way, as a backstop for a
+single page that runs too long.
+
+Pages claimed for lazy enrichment (p.enrichment_queued) are released when the
+task that was queued for them is cancelled or fails, so they can be queued again.
+"""
+import logging
+import time
+
+from celery.exceptions import SoftTimeLimitExceeded
+
+from config import AppConfig
+
+
+class TaskCancelled(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+# Exceptions that stop a task cleanly, between pages or from the soft time limit
+CANCELLATION_ERRORS = (TaskCancelled, SoftTimeLimitExceeded)
+
+
+def cancel_reason(error: Exception) -> str:
+    return error.reason if isinstance(error, TaskCancelled) else "time_limit"
+
+
+def task_deadline(deadline: float = None):
+    """The task's deadline as a timestamp: the one it was queued with, else TASK_DEADLINE_SECONDS from now."""
+    if deadline is None and AppConfig.TASK_DEADLINE_SECONDS > 0:
+        return time.time() + AppConfig.TASK_DEADLINE_SECONDS
+    return deadline
+
+
+class CancellationToken:
+    def __init__(self, driver, documentId: str, deadline: float = None, interval: float = None):
+        self.driver = driver
+        self.documentId = documentId
+        self.deadline = deadline
+        self.interval = AppConfig.CANCEL_CHECK_INTERVAL_SECONDS if interval is None else interval
+        self._last_check = None
+
+    def cancel_requested(self) -> bool:
+        with self.driver.session() as session:
+            record = session.run(
+                "MATCH (d:Document {uuid: $uuid}) RETURN d.cancel_requested IS NOT NULL AS cancelled",
+                {"uuid": self.documentId},
+            ).single()
+        # A deleted document is cancelled too
+        return record is None or record["cancelled"]
+
+    def check(self):
+        if self.deadline is not None and time.time() > self.deadline:
+            raise TaskCancelled("deadline")
+        now = time.monotonic()
+        if self._last_check is None or now - self._last_check >= self.interval:
+            self._last_check = now
+            if self.cancel_requested():
+                raise TaskCancelled("cancelled")
+
+
+def request_cancel(driver, documentId: str):
+    """Flag a document as cancelled. Returns the id of its ingest task, to revoke it while still queued."""
+    with driver.session() as session:
+        record = session.run(
+            """
+            MATCH (d:Document {uuid: $uuid})
+            SET d.cancel_requested = coalesce(d.cancel_requested, datetime())
+            RETURN d.task_id AS task_id
+            """,
+            {"uuid": documentId},
+        ).single()
+    return record["task_id"] if record else None
+
+
+def clear_cancel(driver, documentId: str):
+    with driver.session() as session:
+        session.run(
+            "MATCH (d:Document {uuid: $uuid}) REMOVE d.cancel_requested, d.cancelled_at, d.cancelled_stage, d.cancel_reason",
+            {"uuid": documentId},
+        )
+
+
+def mark_cancelled(driver, documentId: str, stage: str, reason: str):
+    logging.info(f"Stopped {stage} for document {documentId}: {reason}")
+    with driver.session() as session:
+        session.run(
+            """
+            MATCH (d:Document {uuid: $uuid})
+            SET d.cancelled_at = datetime(), d.cancelled_stage = $stage, d.cancel_reason = $reason
+            """,
+            {"uuid": documentId, "stage": stage, "reason": reason},
+        )
+
+
+def release_enrichment_claims(driver, page_uuids: list):
+    with driver.session() as session:
+        session.run("MATCH (p:Page) WHERE p.uuid IN $uuids REMOVE p.enrichment_queued", {"uuids": page_uuids})
@@ -0,0 +1,127 @@
+"""
+Graph compaction: document deletion, retention and orphan cleanup.
+
+Deleting a document only removes the Document node and detaches its pages in
+one small transaction; ingest likewise detaches children and pages that a
+re-run no longer produced (superseded). Everything left without a parent is
+then removed by compact() in bounded batches (CALL {} IN TRANSACTIONS), in
+dependency order, so no transaction grows with the size of a document:
+
+    Page without a Document -> Child, Question, Summary without a Page
+    DocumentSummary without a Document
+    UserAction that no longer ADDED any Document
+
+compact() also expires documents past their expires_at or older than
+DOCUMENT_RETENTION_DAYS, and reports the vector index entries reclaimed.
+"""
+import logging
+
+from config import AppConfig
+
+
+# Vector index and label, as created by setup_database.ipynb (document_summary by worker.document_summary)
+VECTOR_INDEXES = {
+    "parent_document": "Child",
+    "typical_rag": "Page",
+    "hypothetical_questions": "Question",
+    "summary": "Summary",
+    "document_summary": "DocumentSummary",
+}
+
+# Removed in this order: deleting pages orphans their children, questions and summaries
+ORPHANS = [
+    ("pages", "MATCH (n:Page) WHERE NOT (:Document)-[:HAS_PAGE]->(n)"),
+    ("children", "MATCH (n:Child) WHERE NOT (:Page)-[:HAS_CHILD]->(n)"),
+    ("questions", "MATCH (n:Question) WHERE NOT (:Page)-[:HAS_QUESTION]->(n)"),
+    ("summaries", "MATCH (n:Summary) WHERE NOT (:Page)-[:HAS_SUMMARY]->(n)"),
+    ("document_summaries", "MATCH (n:DocumentSummary) WHERE NOT (:Document)-[:HAS_DOCUMENT_SUMMARY]->(n)"),
+    ("user_actions", "MATCH (n:UserAction) WHERE NOT (n)-[:ADDED]-(:Document)"),
+]
+
+
+def vector_index_sizes(driver) -> dict:
+    """Entries in each vector index: the nodes of its label that carry an embedding."""
+    sizes = {}
+    with driver.session() as session:
+        for index, label in VECTOR_INDEXES.items():
+            sizes[index] = session.run(f"MATCH (n:{label}) WHERE n.embedding IS NOT NULL RETURN count(n) AS size").single()["size"]
+    return sizes
+
+
+def delete_document(driver, documentId: str) -> bool:
+    """Remove a Document, detach its pages and drop the UserActions left without a document; the pages and their nodes are left for compact()."""
+    with driver.session() as session:
+        summary = session.run(
+            """
+            MATCH (d:Document {uuid: $uuid})
+            OPTIONAL MATCH (ua:UserAction)-[:ADDED]-(d)
+            WITH d, collect(ua) AS actions
+            DETACH DELETE d
+            WITH actions
+            UNWIND actions AS ua
+            WITH ua WHERE NOT (ua)-[:ADDED]-(:Document)
+            DETACH DELETE ua
+            """,
+            {"uuid": documentId},
+        ).consume()
+    return summary.counters.nodes_deleted > 0
+
+
+def detach_superseded_pages(driver, documentId: str, page_count: int):
+    """Record the page count of the latest ingest and detach pages past it, left over from an earlier, longer run."""
+    with driver.session() as session:
+        session.run(
+            """
+            MATCH (d:Document {uuid: $uuid})
+            SET d.page_count = $page_count
+            WITH d
+            MATCH (d)-[r:HAS_PAGE]->(p:Page)
+            WHERE toInteger(replace(p.name, 'Page ', '')) > $page_count
+            DELETE r
+            """,
+            {"uuid": documentId, "page_count": page_count},
+        )
+
+
+def expire_documents(driver) -> int:
+    """Delete documents past their expires_at, or older than DOCUMENT_RETENTION_DAYS when set."""
+    with driver.session() as session:
+        summary = session.run(
+            """
+            MATCH (d:Document)
+            WHERE d.expires_at < datetime()
+                OR ($retention_days > 0 AND d.addeddate IS NOT NULL
+                    AND datetime(d.addeddate) < datetime() - duration({days: $retention_days}))
+            CALL { WITH d DETACH DELETE d } IN TRANSACTIONS OF $batch_size ROWS
+            """,
+            {"retention_days": AppConfig.DOCUMENT_RETENTION_DAYS, "batch_size": AppConfig.COMPACTION_BATCH_SIZE},
+        ).consume()
+    return summary.counters.nodes_deleted
+
+
+def delete_orphans(driver) -> dict:
+    deleted = {}
+    with driver.session() as session:
+        for name, match in ORPHANS:
+            summary = session.run(
+                match + " CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF $batch_size ROWS",
+                {"batch_size": AppConfig.COMPACTION_BATCH_SIZE},
+            ).consume()
+            deleted[name] = summary.counters.nodes_deleted
+    return deleted
+
+
+def compact(driver) -> dict:
+    before = vector_index_sizes(driver)
+    deleted = {"documents": expire_documents(driver)}
+    deleted.update(delete_orphans(driver))
+    after = vector_index_sizes(driver)
+    report = {
+        "deleted": deleted,
+        "vector_indexes": {
+            index: {"before": before[index], "after": after[index], "reclaimed": before[index] - after[index]}
+            for index in VECTOR_INDEXES
+        },
+    }
+    logging.info(f"Compaction finished: {report}")
+    return report
@@ -0,0 +1,227 @@
+"""
+Exact and near-duplicate detection for Child chunks.
+
+Exact duplicates are found across the whole graph through the indexed
+c.text_hash property. Near duplicates (navigation, cookie banners, footers
+with small variations) are found with 64-bit SimHash fingerprints in a banded
+in-memory index of the chunks recently ingested by this worker process, and
+among the earlier chunks of the same page. Chunks enter the process index only
+once their page is committed, so a failed write never leaves matches to
+chunks that do not exist.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from config import AppConfig
+
+
+BITS = 64
+BANDS = 4
+BAND_BITS = BITS // BANDS
+WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(WORD.findall(text.lower()))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(normalize(text).encode("utf-8")).hexdigest()
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    words = normalize(text).split()
+    shingles = [" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+    weights = [0] * BITS
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(BITS) if weights[bit] > 0)
+
+
+def to_signed(value: int) -> int:
+    """Neo4j integers are signed 64-bit."""
+    return value - (1 << BITS) if value >= 1 << (BITS - 1) else value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex:
+    """
+    Banded SimHash index with LRU eviction. Two fingerprints within BANDS - 1 bits
+    of each other share at least one band, so every match within max_distance < BANDS
+    is found by probing the query's bands.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.bands = [dict() for _ in range(BANDS)]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _band_keys(fingerprint: int):
+        mask = (1 << BAND_BITS) - 1
+        return [fingerprint >> (band * BAND_BITS) & mask for band in range(BANDS)]
+
+    def find(self, fingerprint: int, max_distance: int):
+        with self._lock:
+            best = None
+            for band, key in enumerate(self._band_keys(fingerprint)):
+                for candidate in self.bands[band].get(key, ()):
+                    distance = hamming(fingerprint, candidate)
+                    if distance <= max_distance and (best is None or distance < best[0]):
+                        best = (distance, candidate)
+            if best is None:
+                return None
+            self.entries.move_to_end(best[1])
+            return self.entries[best[1]]
+
+    def add(self, fingerprint: int, chunk_uuid: str):
+        with self._lock:
+            if fingerprint in self.entries:
+                self.entries.move_to_end(fingerprint)
+                return
+            self.entries[fingerprint] = chunk_uuid
+            for band, key in enumerate(self._band_keys(fingerprint)):
+                self.bands[band].setdefault(key, set()).add(fingerprint)
+            while len(self.entries) > self.max_entries:
+                old, _ = self.entries.popitem(last=False)
+                for band, key in enumerate(self._band_keys(old)):
+                    self.bands[band][key].discard(old)
+                    if not self.bands[band][key]:
+                        del self.bands[band][key]
+
+
+chunk_index = SimHashIndex(AppConfig.DEDUP_INDEX_SIZE)
+
+
+_index_ready = False
+
+def ensure_index(driver):
+    global _index_ready
+    if not _index_ready:
+        with driver.session() as session:
+            session.run("CREATE INDEX child_text_hash IF NOT EXISTS FOR (c:Child) ON (c.text_hash)")
+        _index_ready = True
+
+
+def record_dedup_stats(driver, documentId, stats: dict):
+    with driver.session() as session:
+        session.run(
+            """
+            MATCH (d:Document {uuid: $document_uuid})
+            SET d.dedup_duplicates = $duplicates,
+                d.dedup_embeddings_saved = $embeddings_saved,
+                d.dedup_nodes_saved = $nodes_saved
+            """,
+            {"document_uuid": documentId, **stats},
+        )
+
+
+def find_duplicates(driver, texts: list, fingerprints: list, ids: list) -> list:
+    """
+    Return, for each chunk text, None or the uuid, embedding and owner of an
+    existing Child with the same or nearly the same text. An exact match on the
+    chunk's own id (written by an earlier run of its document) is preferred.
+    """
+    hashes = [text_hash(text) for text in texts]
+
+    near = {}
+    for i, fingerprint in enumerate(fingerprints):
+        match = chunk_index.find(fingerprint, AppConfig.DEDUP_MAX_DISTANCE)
+        if match:
+            near[i] = match
+
+    with driver.session() as session:
+        result = session.run(
+            """
+            UNWIND $candidates AS candidate
+            CALL {
+                WITH candidate
+                MATCH (c:Child {text_hash: candidate.hash})
+                RETURN c ORDER BY c.uuid = candidate.id DESC LIMIT 1
+            }
+            RETURN candidate.id AS id, c.uuid AS uuid, c.embedding AS embedding, c.owner_uuid AS owner_uuid
+            UNION
+            UNWIND $uuids AS uuid
+            MATCH (c:Child {uuid: uuid})
+            RETURN null AS id, c.uuid AS uuid, c.embedding AS embedding, c.owner_uuid AS owner_uuid
+            """,
+            {"candidates": [{"hash": h, "id": id} for h, id in zip(hashes, ids)], "uuids": list(set(near.values()))},
+        )
+        by_id, by_uuid = {}, {}
+        for record in result:
+            found = {"uuid": record["uuid"], "embedding": record["embedding"], "owner_uuid": record["owner_uuid"]}
+            if record["id"] is not None:
+                by_id[record["id"]] = found
+            else:
+                by_uuid[record["uuid"]] = found
+
+    return [by_id.get(id) or by_uuid.get(near.get(i)) for i, id in enumerate(ids)]
+
+
+def dedupe_children(driver, children: list, embed, mode: str, stats: dict, owner_uuid: str = None):
+    """
+    Resolve a page's children (dicts with text, id and name) against existing chunks.
+
+    New chunks get an embedding from embed(text). Duplicates are handled per mode:
+    'reuse' copies the existing embedding onto a new node, 'link' attaches the
+    existing node to the page instead, 'drop' leaves the chunk out as boilerplate.
+    A match owned by another user is reused in every mode, so no Child is shared
+    between users' pages and no user loses a chunk to another user's text.
+    A chunk repeating an earlier chunk of the same page is a duplicate too.
+    Returns (children to write, uuids of existing children to link, fingerprints
+    of the new chunks for index_chunks once the page is written) and adds the
+    embeddings and nodes saved to stats.
+    """
+    fingerprints = [simhash(child["text"]) for child in children]
+    if mode == "off":
+        matches = [None] * len(children)
+    else:
+        matches = find_duplicates(driver, [child["text"] for child in children], fingerprints,
+                                  [child["id"] for child in children])
+
+    page_index, page_chunks = SimHashIndex(max(len(children), 1)), {}
+    to_write, links, new_chunks = [], [], []
+    for child, fingerprint, match in zip(children, fingerprints, matches):
+        if match is None and mode != "off":
+            # Repeats within the page are in neither the graph nor the process index yet
+            earlier = page_index.find(fingerprint, AppConfig.DEDUP_MAX_DISTANCE)
+            match = page_chunks.get(earlier)
+        if match is None:
+            child.update(embedding=embed(child["text"]), text_hash=text_hash(child["text"]), simhash=to_signed(fingerprint))
+            to_write.append(child)
+            page_index.add(fingerprint, child["id"])
+            page_chunks[child["id"]] = {"uuid": child["id"], "embedding": child["embedding"], "owner_uuid": owner_uuid}
+            new_chunks.append((fingerprint, child["id"]))
+            continue
+
+        stats["embeddings_saved"] += 1
+        if match["uuid"] == child["id"]:
+            # The same chunk written by an earlier run of this document
+            child.update(embedding=match["embedding"], text_hash=text_hash(child["text"]), simhash=to_signed(fingerprint))
+            to_write.append(child)
+            continue
+
+        stats["duplicates"] += 1
+        if mode == "reuse" or match["owner_uuid"] != owner_uuid:
+            child.update(embedding=match["embedding"], text_hash=text_hash(child["text"]), simhash=to_signed(fingerprint))
+            to_write.append(child)
+        elif mode == "link":
+            links.append(match["uuid"])
+            stats["nodes_saved"] += 1
+        else:
+            stats["nodes_saved"] += 1
+    return to_write, links, new_chunks
+
+
+def index_chunks(new_chunks: list):
+    """Add the (fingerprint, uuid) pairs returned by dedupe_children once their page is committed."""
+    for fingerprint, chunk_uuid in new_chunks:
+        chunk_index.add(fingerprint, chunk_uuid)
@@ -0,0 +1,212 @@
+"""
+Document-level summaries for coarse-to-fine retrieval.
+
+A document's page Summary nodes are the map step. They are reduced in page
+order: packed up to DOCUMENT_SUMMARY_PACK_TOKENS, each pack summarized, and the
+pack summaries reduced again until one summary is left. The result is stored
+as
+
+    (:Document)-[:HAS_DOCUMENT_SUMMARY]->(:DocumentSummary {text, embedding, source_hash})
+
+and indexed in the document_summary vector index, which chat's two-stage
+retrieval searches first to pick the documents whose chunks it then searches.
+
+Refresh is incremental: source_hash covers the page summaries it was built
+from, so an unchanged document is skipped without LLM or embedding calls, and
+each reduce call goes through the LLM cache. Packs are filled greedily in page
+order, so after a change to one page summary the packs before it are served
+from the cache, while its own pack and every later pack whose boundaries moved
+with the new length are summarized again, as are the packs above them at each
+level. summarize_document_task is queued by the
+summary or enrichment task that leaves every page with a summary.
+Existing documents can be backfilled with (--force also builds from partial
+summaries, e.g. with lazy enrichment):
+
+    python -m worker.document_summary refresh [--document UUID] [--force]
+"""
+import argparse
+import hashlib
+import logging
+
+from langchain.prompts import ChatPromptTemplate
+from neo4j import GraphDatabase
+
+from config import AppConfig
+from .llm_cache import llm_cache
+from .usage import count_tokens
+from .processing_functions import node_uuid
+
+
+INDEX_NAME = "document_summary"
+
+# Bounds the reduce depth when summaries do not shrink
+MAX_REDUCE_LEVELS = 5
+
+DOCUMENT_SUMMARY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            (
+                "You are combining the summaries of consecutive parts of one document "
+                "into a single concise and accurate summary of the whole. Keep the main "
+                "subjects, names and conclusions."
+            ),
+        ),
+        (
+            "human",
+            ("Summaries, in document order:\n{summaries}\n" "Summary:"),
+        ),
+    ]
+)
+
+
+_index_ready = False
+
+
+def ensure_index(driver):
+    global _index_ready
+    if not _index_ready:
+        with driver.session() as session:
+            if session.run("SHOW INDEXES YIELD name WHERE name = $name RETURN name", {"name": INDEX_NAME}).single() is None:
+                session.run(
+                    "CALL db.index.vector.createNodeIndex($name, 'DocumentSummary', 'embedding', $dimension, 'cosine')",
+                    {"name": INDEX_NAME, "dimension": AppConfig.EMBEDDING_DIMENSION},
+                )
+        _index_ready = True
+
+
+def load_page_summaries(driver, documentId: str) -> list:
+    with driver.session() as session:
+        result = session.run(
+            """
+            MATCH (d:Document {uuid: $uuid})-[:HAS_PAGE]->(p:Page)-[:HAS_SUMMARY]->(s:Summary)
+            RETURN p.uuid AS page, s.text AS text
+            ORDER BY toInteger(replace(p.name, 'Page ', ''))
+            """,
+            {"uuid": documentId},
+        )
+        return [(record["page"], record["text"]) for record in result if record["text"]]
+
+
+def pages_summarized(driver, documentId: str) -> bool:
+    """Whether every page of the document has a summary, counted without reading the summaries."""
+    with driver.session() as session:
+        record = session.run(
+            """
+            MATCH (d:Document {uuid: $uuid})
+            WITH d, [(d)-[:HAS_PAGE]->(p:Page) | p] AS pages
+            RETURN coalesce(d.page_count, size(pages)) AS page_count,
+                size([p IN pages WHERE EXISTS { (p)-[:HAS_SUMMARY]->(:Summary) }]) AS summarized
+            """,
+            {"uuid": documentId},
+        ).single()
+    return record is not None and 0 < record["page_count"] <= record["summarized"]
+
+
+def source_hash(summaries: list) -> str:
+    digest = hashlib.sha256()
+    for page, text in summaries:
+        digest.update(f"{page}\x00{text}\x00".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def pack_texts(texts: list, model: str, token_budget: int) -> list:
+    packs, current, current_tokens = [], [], 0
+    for text in texts:
+        tokens = count_tokens(text, model)
+        if current and current_tokens + tokens > token_budget:
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+
+def reduce_summaries(llm, texts: list, token_budget: int) -> str:
+    chain = DOCUMENT_SUMMARY_PROMPT | llm
+    for level in range(MAX_REDUCE_LEVELS):
+        packs = pack_texts(texts, llm.model_name, token_budget)
+        texts = [
+            llm_cache.get_or_compute(llm.model_name, DOCUMENT_SUMMARY_PROMPT, text,
+                                     lambda text=text: chain.invoke({"summaries": text}).content)
+            for text in ("\n\n".join(pack) for pack in packs)
+        ]
+        if len(texts) == 1:
+            return texts[0]
+    logging.warning(f"Document summary not reduced to one after {MAX_REDUCE_LEVELS} levels, joining {len(texts)} parts")
+    return "\n\n".join(texts)
+
+
+def refresh_document_summary(driver, llm, embeddings, documentId: str, force: bool = False) -> dict:
+    """
+    Build or refresh a document's summary. Returns what was done: 'created', 'updated',
+    'unchanged', 'no_summaries', or 'incomplete' while some pages have no summary yet
+    (pages enriched in batches; force builds from the summaries there are).
+    """
+    ensure_index(driver)
+    summaries = load_page_summaries(driver, documentId)
+    if not summaries:
+        return {"uuid": documentId, "status": "no_summaries"}
+    digest = source_hash(summaries)
+    with driver.session() as session:
+        record = session.run(
+            """
+            MATCH (d:Document {uuid: $uuid})
+            OPTIONAL MATCH (d)-[:HAS_DOCUMENT_SUMMARY]->(s:DocumentSummary)
+            RETURN d.page_count AS page_count, s.source_hash AS hash
+            """,
+            {"uuid": documentId},
+        ).single()
+    if not force and record["page_count"] and len(summaries) < record["page_count"]:
+        return {"uuid": documentId, "status": "incomplete", "pages": len(summaries)}
+    if not force and record["hash"] == digest:
+        return {"uuid": documentId, "status": "unchanged", "pages": len(summaries)}
+
+    text = reduce_summaries(llm, [text for _, text in summaries], AppConfig.DOCUMENT_SUMMARY_PACK_TOKENS)
+    with driver.session() as session:
+        session.run(
+            """
+            MATCH (d:Document {uuid: $document_uuid})
+            MERGE (d)-[:HAS_DOCUMENT_SUMMARY]->(s:DocumentSummary {uuid: $uuid})
+            SET s.text = $text, s.name = d.name, s.source = d.uuid, s.source_hash = $hash,
+                s.page_count = $pages, s.datecreated = datetime()
+            WITH s
+            CALL db.create.setVectorProperty(s, 'embedding', $embedding) YIELD node
+            RETURN count(*)
+            """,
+            {"document_uuid": documentId, "uuid": node_uuid(documentId, "document_summary"), "text": text,
+             "hash": digest, "pages": len(summaries), "embedding": embeddings.embed_query(text)},
+        )
+    return {"uuid": documentId, "status": "created" if record["hash"] is None else "updated", "pages": len(summaries)}
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build or refresh document-level summaries from page summaries")
+    parser.add_argument("command", choices=["refresh"])
+    parser.add_argument("--document", action="append", help="Document uuid (repeatable); default every document with page summaries")
+    parser.add_argument("--force", action="store_true", help="Rebuild even when the page summaries are unchanged")
+    args = parser.parse_args()
+
+    AppConfig.initialize_environment_variables()
+    from .resources import get_embeddings, get_llm
+    driver = GraphDatabase.driver(AppConfig.NEO4J_URI, auth=(AppConfig.NEO4J_USER, AppConfig.NEO4J_PASSWORD))
+    try:
+        documents = args.document
+        if not documents:
+            with driver.session() as session:
+                documents = [r["uuid"] for r in session.run(
+                    "MATCH (d:Document) WHERE EXISTS { (d)-[:HAS_PAGE]->(:Page)-[:HAS_SUMMARY]->(:Summary) } RETURN d.uuid AS uuid")]
+        statuses = {}
+        for documentId in documents:
+            status = refresh_document_summary(driver, get_llm(), get_embeddings(), documentId, args.force)["status"]
+            statuses[status] = statuses.get(status, 0) + 1
+        logging.info(f"Document summaries for {len(documents)} documents: {statuses}")
+    finally:
+        driver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Embedding backends, selected with AppConfig.EMBEDDING_BACKEND.
+
+* openai  - OpenAIEmbeddings (the default)
+* local   - a sentence-transformers model loaded from EMBEDDING_MODEL_PATH and run
+            on CPU; concurrent embed_query calls are coalesced into one batch
+            (up to EMBEDDING_MAX_BATCH_SIZE texts, waiting at most
+            EMBEDDING_BATCH_WAIT_MS for more) so a busy API or worker pays one
+            forward pass per batch instead of one per text
+* hashing - deterministic feature hashing of word unigrams and bigrams, for tests
+            and offline runs; no model, no network
+
+Every backend is a LangChain Embeddings, so it plugs into Neo4jVector and the
+processing functions unchanged. Vectors must match the dimension of the vector
+indexes they are written to or searched against; check_index_dimensions compares
+them with SHOW INDEXES.
+"""
+import hashlib
+import logging
+import math
+import os
+import queue
+import re
+import threading
+from concurrent.futures import Future
+from typing import List
+
+from langchain.schema.embeddings import Embeddings
+
+from config import AppConfig
+
+
+WORD = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """Signed feature hashing into `dimension` buckets, L2 normalized."""
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+
+    def _embed(self, text: str) -> List[float]:
+        words = WORD.findall(text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        vector = [0.0] * self.dimension
+        for feature in features:
+            h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+            vector[h % self.dimension] += 1.0 if h >> 63 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    A local sentence-transformers model behind a dynamic batching thread.
+
+    The model and the thread are created on first use in each process, so the
+    instance is safe to build before a fork.
+    """
+
+    def __init__(self, model_path: str, dimension: int, max_batch_size: int, batch_wait_ms: float):
+        self.model_path = model_path
+        self.dimension = dimension
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self._model = None
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                raise ImportError("EMBEDDING_BACKEND=local requires sentence-transformers (pip install -r requirements-local.txt)") from e
+            model = SentenceTransformer(self.model_path, device="cpu")
+            dimension = model.get_sentence_embedding_dimension()
+            if dimension != self.dimension:
+                raise ValueError(f"Model at {self.model_path} produces {dimension}-dimensional vectors, EMBEDDING_DIMENSION is {self.dimension}")
+            self._model = model
+            self._queue = queue.Queue()
+            threading.Thread(target=self._run, args=(self._queue,), name="embedding-batcher", daemon=True).start()
+            self._pid = os.getpid()
+            logging.info(f"Loaded local embedding model {self.model_path} in process {self._pid}")
+
+    def _run(self, requests: queue.Queue):
+        while True:
+            batch = [requests.get()]
+            # Gather whatever else arrives within the wait window, up to the batch size
+            try:
+                while len(batch) < self.max_batch_size:
+                    batch.append(requests.get(timeout=self.batch_wait))
+            except queue.Empty:
+                pass
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self._model.encode(texts, batch_size=len(texts), normalize_embeddings=True, convert_to_numpy=True)
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector.tolist())
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+    def _submit(self, text: str) -> Future:
+        if self._pid != os.getpid():
+            self._start()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        futures = [self._submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit(text).result()
+
+
+def create_embeddings(backend: str = None) -> Embeddings:
+    backend = backend or AppConfig.EMBEDDING_BACKEND
+    if backend == "openai":
+        from langchain.embeddings.openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(openai_api_key=AppConfig.OPENAI_API_KEY, embedding_dimension=AppConfig.EMBEDDING_DIMENSION)
+    if backend == "local":
+        return LocalEmbeddings(AppConfig.EMBEDDING_MODEL_PATH, AppConfig.EMBEDDING_DIMENSION,
+                               AppConfig.EMBEDDING_MAX_BATCH_SIZE, AppConfig.EMBEDDING_BATCH_WAIT_MS)
+    if backend == "hashing":
+        return HashingEmbeddings(AppConfig.EMBEDDING_DIMENSION)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}', expected openai, local or hashing")
+
+
+def check_index_dimensions(driver, dimension: int = None) -> dict:
+    """
+    Compare the embedding dimension with every vector index in the database.
+    Raises ValueError listing the indexes that do not match; returns {index name: dimensions}.
+    """
+    dimension = dimension or AppConfig.EMBEDDING_DIMENSION
+    with driver.session() as session:
+        result = session.run(
+            """
+            SHOW INDEXES YIELD name, type, options
+            WHERE type = 'VECTOR'
+            RETURN name, options.indexConfig['vector.dimensions'] AS dimensions
+            """
+        )
+        indexes = {record["name"]: record["dimensions"] for record in result}
+    mismatched = {name: dims for name, dims in indexes.items() if dims != dimension}
+    if mismatched:
+        raise ValueError(f"{AppConfig.EMBEDDING_BACKEND} embeddings have {dimension} dimensions but vector indexes differ: {mismatched}")
+    return indexes
@@ -0,0 +1,364 @@
+"""
+Bulk export and reload of the document graph as Parquet.
+
+Document, Page, Child, Question, Summary and DocumentSummary nodes are streamed out of Neo4j
+into one directory per label, rolling over to a new part file every
+ROWS_PER_FILE rows, so memory stays bounded by one batch. Each row holds the
+node uuid, its properties as JSON, its embedding as a fixed-size float32 list
+and the uuid(s) of the node it hangs off, which is enough to rebuild the
+relationships:
+
+    (:UserAction)-[:ADDED]-(:Document)-[:HAS_PAGE]->(:Page)-[:HAS_CHILD]->(:Child)
+    (:Page)-[:HAS_QUESTION]->(:Question), (:Page)-[:HAS_SUMMARY]->(:Summary)
+    (:Document)-[:HAS_DOCUMENT_SUMMARY]->(:DocumentSummary)
+
+Import MERGEs the rows back in large UNWIND batches with the vector indexes
+dropped, then recreates the indexes and waits for them to come online, so a
+restore makes no embedding or LLM calls. User nodes (and their passwords) are
+not exported; documents are re-attached to users that already exist.
+
+Usage:
+    python -m worker.graph_io export DIR [--batch-size N] [--rows-per-file N]
+    python -m worker.graph_io import DIR [--batch-size N] [--keep-indexes]
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from neo4j import GraphDatabase
+from neo4j.exceptions import Neo4jError
+from neo4j.time import Date, DateTime, Duration, Time
+
+from config import AppConfig
+
+
+FORMAT_VERSION = 1
+BATCH_SIZE = 1000
+ROWS_PER_FILE = 250000
+
+# Operational state that would be stale in another environment: batch and lazy
+# enrichment claims, and the feeder's and status lookups' task ids
+EXCLUDED_PROPERTIES = {"embedding", "batch_job", "enrichment_queued", "task_id", "queued_at"}
+
+
+def excluded_property(key: str) -> bool:
+    # checkpoint_<stage> and checkpoint_<stage>_task only resume that task; checkpoint_stage is the document's progress
+    return key in EXCLUDED_PROPERTIES or (key.startswith("checkpoint_") and key != "checkpoint_stage")
+
+TEMPORAL_TYPES = {"DateTime": DateTime, "Date": Date, "Time": Time}
+
+# label, parent column, parent expression (n is the exported node), parent column type, relink Cypher
+LABELS = [
+    (
+        "Document", "owner", "[(ua:UserAction)-[:ADDED]-(n) | ua.useruuid][0]", pa.string(),
+        """
+        UNWIND $rows AS row
+        WITH row WHERE row.owner IS NOT NULL
+        MATCH (n:Document {uuid: row.uuid})
+        MERGE (ua:UserAction {useruuid: row.owner})
+        ON CREATE SET ua.uuid = randomUUID()
+        MERGE (ua)-[:ADDED]-(n)
+        WITH ua, row
+        MATCH (u:User {uuid: row.owner})
+        SET ua.name = u.username
+        MERGE (u)-[:HAS_ACTION]->(ua)
+        """,
+    ),
+    (
+        "Page", "document_uuid", "[(d:Document)-[:HAS_PAGE]->(n) | d.uuid][0]", pa.string(),
+        """
+        UNWIND $rows AS row
+        MATCH (n:Page {uuid: row.uuid})
+        MATCH (d:Document {uuid: row.document_uuid})
+        MERGE (d)-[:HAS_PAGE]->(n)
+        """,
+    ),
+    (
+        # Deduplicated chunks may belong to several pages
+        "Child", "page_uuids", "[(p:Page)-[:HAS_CHILD]->(n) | p.uuid]", pa.list_(pa.string()),
+        """
+        UNWIND $rows AS row
+        MATCH (n:Child {uuid: row.uuid})
+        UNWIND row.page_uuids AS page_uuid
+        MATCH (p:Page {uuid: page_uuid})
+        MERGE (p)-[:HAS_CHILD]->(n)
+        """,
+    ),
+    (
+        "Question", "page_uuid", "[(p:Page)-[:HAS_QUESTION]->(n) | p.uuid][0]", pa.string(),
+        """
+        UNWIND $rows AS row
+        MATCH (n:Question {uuid: row.uuid})
+        MATCH (p:Page {uuid: row.page_uuid})
+        MERGE (p)-[:HAS_QUESTION]->(n)
+        """,
+    ),
+    (
+        "Summary", "page_uuid", "[(p:Page)-[:HAS_SUMMARY]->(n) | p.uuid][0]", pa.string(),
+        """
+        UNWIND $rows AS row
+        MATCH (n:Summary {uuid: row.uuid})
+        MATCH (p:Page {uuid: row.page_uuid})
+        MERGE (p)-[:HAS_SUMMARY]->(n)
+        """,
+    ),
+    (
+        "DocumentSummary", "document_uuid", "[(d:Document)-[:HAS_DOCUMENT_SUMMARY]->(n) | d.uuid][0]", pa.string(),
+        """
+        UNWIND $rows AS row
+        MATCH (n:DocumentSummary {uuid: row.uuid})
+        MATCH (d:Document {uuid: row.document_uuid})
+        MERGE (d)-[:HAS_DOCUMENT_SUMMARY]->(n)
+        """,
+    ),
+]
+
+# Vector indexes created by setup_database.ipynb and worker.document_summary, used when the target database has none
+DEFAULT_VECTOR_INDEXES = [
+    {"name": "parent_document", "label": "Child", "property": "embedding", "similarity": "cosine"},
+    {"name": "typical_rag", "label": "Page", "property": "embedding", "similarity": "cosine"},
+    {"name": "hypothetical_questions", "label": "Question", "property": "embedding", "similarity": "cosine"},
+    {"name": "summary", "label": "Summary", "property": "embedding", "similarity": "cosine"},
+    {"name": "document_summary", "label": "DocumentSummary", "property": "embedding", "similarity": "cosine"},
+]
+
+
+## Property encoding
+
+def encode_value(value):
+    for name, cls in TEMPORAL_TYPES.items():
+        if isinstance(value, cls):
+            return {"$type": name, "value": value.iso_format()}
+    if isinstance(value, Duration):
+        return {"$type": "Duration", "value": [value.months, value.days, value.seconds, value.nanoseconds]}
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict) and "$type" in value:
+        if value["$type"] == "Duration":
+            months, days, seconds, nanoseconds = value["value"]
+            return Duration(months=months, days=days, seconds=seconds, nanoseconds=nanoseconds)
+        return TEMPORAL_TYPES[value["$type"]].from_iso_format(value["value"])
+    return value
+
+
+def encode_properties(properties: dict) -> str:
+    return json.dumps({k: encode_value(v) for k, v in properties.items() if not excluded_property(k)})
+
+
+def decode_properties(properties: str) -> dict:
+    # Also filtered here for exports written before a key was excluded
+    return {k: decode_value(v) for k, v in json.loads(properties).items() if not excluded_property(k)}
+
+
+def label_schema(parent_column: str, parent_type, dimension: int) -> pa.Schema:
+    return pa.schema([
+        ("uuid", pa.string()),
+        ("properties", pa.string()),
+        ("embedding", pa.list_(pa.float32(), dimension)),
+        (parent_column, parent_type),
+    ])
+
+
+## Export
+
+class PartitionedWriter:
+    """Writes record batches to DIR/<label>/part-NNNNN.parquet, starting a new part every rows_per_file rows."""
+
+    def __init__(self, directory: str, schema: pa.Schema, rows_per_file: int):
+        self.directory = directory
+        self.schema = schema
+        self.rows_per_file = rows_per_file
+        self.writer = None
+        self.part = 0
+        self.rows_in_part = 0
+        self.rows = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, columns: dict):
+        batch = pa.RecordBatch.from_pydict(columns, schema=self.schema)
+        if self.writer is None or self.rows_in_part >= self.rows_per_file:
+            self.close()
+            path = os.path.join(self.directory, f"part-{self.part:05d}.parquet")
+            self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+            self.part += 1
+            self.rows_in_part = 0
+        self.writer.write_batch(batch)
+        self.rows_in_part += batch.num_rows
+        self.rows += batch.num_rows
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def export_label(driver, directory: str, label: str, parent_column: str, parent_expression: str, parent_type,
+                 dimension: int, batch_size: int, rows_per_file: int) -> int:
+    writer = PartitionedWriter(os.path.join(directory, label), label_schema(parent_column, parent_type, dimension), rows_per_file)
+    columns = {"uuid": [], "properties": [], "embedding": [], parent_column: []}
+
+    def flush():
+        if columns["uuid"]:
+            writer.write(columns)
+            for values in columns.values():
+                values.clear()
+
+    # Results are pulled from the server fetch_size records at a time, so only one batch is held here
+    with driver.session(fetch_size=batch_size) as session:
+        result = session.run(f"MATCH (n:{label}) RETURN n.uuid AS uuid, properties(n) AS properties, {parent_expression} AS parent")
+        for record in result:
+            properties = record["properties"]
+            embedding = properties.get("embedding")
+            if embedding is not None and len(embedding) != dimension:
+                raise ValueError(f"{label} {record['uuid']} has a {len(embedding)}-dimensional embedding, expected {dimension}")
+            columns["uuid"].append(record["uuid"])
+            columns["properties"].append(encode_properties(properties))
+            columns["embedding"].append(embedding)
+            columns[parent_column].append(record["parent"])
+            if len(columns["uuid"]) >= batch_size:
+                flush()
+        flush()
+    writer.close()
+    logging.info(f"Exported {writer.rows} {label} nodes")
+    return writer.rows
+
+
+def export_graph(driver, directory: str, batch_size: int = BATCH_SIZE, rows_per_file: int = ROWS_PER_FILE) -> dict:
+    dimension = AppConfig.EMBEDDING_DIMENSION
+    counts = {}
+    for label, parent_column, parent_expression, parent_type, _ in LABELS:
+        counts[label] = export_label(driver, directory, label, parent_column, parent_expression, parent_type,
+                                     dimension, batch_size, rows_per_file)
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "embedding_dimension": dimension,
+        "vector_indexes": vector_indexes(driver),
+        "counts": counts,
+    }
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+## Import
+
+def vector_indexes(driver) -> list:
+    with driver.session() as session:
+        result = session.run(
+            """
+            SHOW INDEXES YIELD name, type, labelsOrTypes, properties, options
+            WHERE type = 'VECTOR'
+            RETURN name, labelsOrTypes[0] AS label, properties[0] AS property, options.indexConfig AS config
+            """
+        )
+        return [
+            {"name": r["name"], "label": r["label"], "property": r["property"],
+             "similarity": r["config"].get("vector.similarity_function", "cosine").lower()}
+            for r in result
+        ]
+
+
+def ensure_uuid_constraints(driver):
+    """MERGE on uuid needs an index on every label, or each batch scans the label."""
+    with driver.session() as session:
+        for label, *_ in LABELS:
+            try:
+                session.run(f"CREATE CONSTRAINT {label.lower()}_unique_uuid IF NOT EXISTS FOR (n:{label}) REQUIRE n.uuid IS UNIQUE")
+            except Neo4jError as e:
+                # e.g. a plain index on uuid already exists, which serves MERGE as well
+                logging.warning(f"Could not create uuid constraint for {label}: {e}")
+
+
+def import_label(driver, directory: str, label: str, relink_query: str, batch_size: int) -> int:
+    node_query = f"""
+        UNWIND $rows AS row
+        MERGE (n:{label} {{uuid: row.uuid}})
+        SET n += row.properties
+        WITH n, row WHERE row.embedding IS NOT NULL
+        CALL db.create.setVectorProperty(n, 'embedding', row.embedding) YIELD node
+        RETURN count(*)
+    """
+
+    def write_batch(tx, rows):
+        tx.run(node_query, rows=rows).consume()
+        tx.run(relink_query, rows=rows).consume()
+
+    imported = 0
+    for path in sorted(glob.glob(os.path.join(directory, label, "part-*.parquet"))):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            rows = batch.to_pylist()
+            for row in rows:
+                row["properties"] = decode_properties(row["properties"])
+            with driver.session() as session:
+                session.execute_write(write_batch, rows)
+            imported += len(rows)
+        logging.info(f"Imported {imported} {label} nodes")
+    return imported
+
+
+def import_graph(driver, directory: str, batch_size: int = BATCH_SIZE, keep_indexes: bool = False) -> dict:
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest["embedding_dimension"] != AppConfig.EMBEDDING_DIMENSION:
+        raise ValueError(f"Export has {manifest['embedding_dimension']}-dimensional embeddings, "
+                         f"EMBEDDING_DIMENSION is {AppConfig.EMBEDDING_DIMENSION}")
+
+    ensure_uuid_constraints(driver)
+
+    # Populating an index once after the load is much cheaper than updating it on every write
+    indexes = vector_indexes(driver) or manifest.get("vector_indexes") or DEFAULT_VECTOR_INDEXES
+    if not keep_indexes:
+        with driver.session() as session:
+            for index in vector_indexes(driver):
+                session.run(f"DROP INDEX {index['name']} IF EXISTS")
+
+    counts = {}
+    for label, _, _, _, relink_query in LABELS:
+        counts[label] = import_label(driver, directory, label, relink_query, batch_size)
+
+    with driver.session() as session:
+        existing = {index["name"] for index in vector_indexes(driver)}
+        for index in indexes:
+            if index["name"] not in existing:
+                session.run(
+                    "CALL db.index.vector.createNodeIndex($name, $label, $property, $dimension, $similarity)",
+                    {**index, "dimension": AppConfig.EMBEDDING_DIMENSION},
+                )
+        logging.info("Waiting for vector indexes to come online")
+        session.run("CALL db.awaitIndexes(86400)").consume()
+    return counts
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export the document graph to Parquet or reload it")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("directory")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows per UNWIND batch / record batch")
+    parser.add_argument("--rows-per-file", type=int, default=ROWS_PER_FILE, help="Rows per Parquet part file (export)")
+    parser.add_argument("--keep-indexes", action="store_true", help="Leave vector indexes in place during import")
+    args = parser.parse_args()
+
+    AppConfig.initialize_environment_variables()
+    driver = GraphDatabase.driver(AppConfig.NEO4J_URI, auth=(AppConfig.NEO4J_USER, AppConfig.NEO4J_PASSWORD))
+    started = time.monotonic()
+    try:
+        if args.command == "export":
+            counts = export_graph(driver, args.directory, args.batch_size, args.rows_per_file)["counts"]
+        else:
+            counts = import_graph(driver, args.directory, args.batch_size, args.keep_indexes)
+    finally:
+        driver.close()
+    logging.info(f"{args.command.capitalize()} finished in {time.monotonic() - started:.1f}s: {counts}")
+
+
+if __name__ == "__main__":
+    main()
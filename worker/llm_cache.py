@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from config import AppConfig
+from .usage import count_tokens
+
+
+def prompt_hash(prompt) -> str:
+    """Stable hash of a prompt template, so editing a prompt invalidates its cached outputs."""
+    return hashlib.sha256(json.dumps(prompt.dict(), sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    On-disk memoization of LLM outputs for page enrichment.
+
+    Entries are keyed by (model, prompt template hash, extra params, page text hash)
+    and stored in sqlite so they survive restarts and are shared by the worker
+    processes on a host. Entries older than max_age_seconds are dropped, and the
+    least recently used entries are evicted once max_entries or max_bytes is exceeded.
+
+    mode is 'on' (read and write), 'refresh' (skip reads, overwrite entries; use
+    after changing prompts or models) or 'off'.
+    """
+
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str, max_entries: int, max_bytes: int, max_age_seconds: float, mode: str = "on"):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self.seconds_saved = 0.0
+        self._puts = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Connections are opened per process so prefork children never share one
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    seconds REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def key(model: str, prompt, text: str, **params) -> str:
+        parts = {
+            "model": model,
+            "prompt": prompt_hash(prompt),
+            "params": params,
+            "text": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        if self.mode != "on":
+            return None
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, tokens, seconds, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[3] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+            conn.commit()
+        self.hits += 1
+        self.tokens_saved += row[1]
+        self.seconds_saved += row[2]
+        return json.loads(row[0])
+
+    def put(self, key: str, value, tokens: int, seconds: float):
+        if self.mode == "off":
+            return
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, tokens, seconds, size, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, payload, tokens, seconds, len(payload), now, now),
+            )
+            conn.commit()
+            self._puts += 1
+            if self._puts % self.EVICT_EVERY == 0:
+                self._evict(conn, now)
+
+    def _evict(self, conn, now: float):
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.max_age_seconds,))
+        conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            "SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        total_bytes = conn.execute("SELECT coalesce(sum(size), 0) FROM llm_cache").fetchone()[0]
+        if total_bytes > self.max_bytes:
+            # Drop least recently used entries until under the byte budget
+            excess = total_bytes - self.max_bytes
+            freed = 0
+            stale = []
+            for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_used ASC"):
+                stale.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale)
+        conn.commit()
+
+    def get_or_compute(self, model: str, prompt, text: str, compute, **params):
+        """
+        Return the cached output for (model, prompt, text, params), or call compute()
+        and store its JSON-serializable result together with its token and time cost.
+        """
+        key = self.key(model, prompt, text, **params)
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        start = time.time()
+        value = compute()
+        seconds = time.time() - start
+        if self.mode != "off":
+            tokens = count_tokens(text, model) + count_tokens(json.dumps(value), model)
+            self.put(key, value, tokens, seconds)
+        return value
+
+    def counters(self) -> dict:
+        """The process's cumulative counters; pass them to stats() later to get what a task added."""
+        return {"hits": self.hits, "misses": self.misses, "tokens_saved": self.tokens_saved, "seconds_saved": self.seconds_saved}
+
+    def stats(self, since: dict = None) -> dict:
+        counters = self.counters()
+        if since:
+            counters = {name: value - since[name] for name, value in counters.items()}
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+            "tokens_saved": counters["tokens_saved"],
+            "seconds_saved": round(counters["seconds_saved"], 3),
+        }
+
+    def log_stats(self, documentId: str, since: dict = None):
+        logging.info(f"LLM cache stats for document {documentId}: {self.stats(since)}")
+
+
+llm_cache = LLMCache(
+    AppConfig.LLM_CACHE_PATH,
+    max_entries=AppConfig.LLM_CACHE_MAX_ENTRIES,
+    max_bytes=AppConfig.LLM_CACHE_MAX_BYTES,
+    max_age_seconds=AppConfig.LLM_CACHE_MAX_AGE_DAYS * 86400,
+    mode=AppConfig.LLM_CACHE_MODE,
+)
@@ -0,0 +1,86 @@
+"""
+Document ownership denormalized onto Page and Child nodes.
+
+Ownership is recorded when a document is added as
+(User)-[:HAS_ACTION]->(UserAction)-[:ADDED]-(Document). Ingest copies the
+owner's uuid onto every Page and Child it writes as owner_uuid, so scoped chat
+retrieval can search one user's chunks through the indexed Page.owner_uuid
+instead of the whole vector index.
+
+Graphs ingested before this can be backfilled with:
+    python -m worker.ownership backfill
+"""
+import argparse
+import logging
+
+from neo4j import GraphDatabase
+
+from config import AppConfig
+
+
+_indexes_ready = False
+
+
+def ensure_indexes(driver):
+    global _indexes_ready
+    if not _indexes_ready:
+        with driver.session() as session:
+            session.run("CREATE INDEX page_owner_uuid IF NOT EXISTS FOR (p:Page) ON (p.owner_uuid)")
+            session.run("CREATE INDEX child_owner_uuid IF NOT EXISTS FOR (c:Child) ON (c.owner_uuid)")
+        _indexes_ready = True
+
+
+def document_owner(driver, documentId: str):
+    # Ordered, so a document added by several users always resolves to the same owner as backfill() picks
+    with driver.session() as session:
+        record = session.run(
+            "MATCH (ua:UserAction)-[:ADDED]-(d:Document {uuid: $uuid}) RETURN ua.useruuid AS owner ORDER BY owner LIMIT 1",
+            {"uuid": documentId},
+        ).single()
+    return record["owner"] if record else None
+
+
+def backfill(driver, batch_size: int = 1000) -> int:
+    """Set owner_uuid on Pages, and their Children, that were written without one, using one owner per document."""
+    ensure_indexes(driver)
+    with driver.session() as session:
+        summary = session.run(
+            """
+            MATCH (d:Document)-[:HAS_PAGE]->(p:Page)
+            WHERE p.owner_uuid IS NULL
+            CALL {
+                WITH d
+                MATCH (ua:UserAction)-[:ADDED]-(d)
+                RETURN ua.useruuid AS owner ORDER BY owner LIMIT 1
+            }
+            CALL {
+                WITH owner, p
+                SET p.owner_uuid = owner
+                WITH owner, p
+                MATCH (p)-[:HAS_CHILD]->(c:Child)
+                WHERE c.owner_uuid IS NULL
+                SET c.owner_uuid = owner
+            } IN TRANSACTIONS OF $batch_size ROWS
+            """,
+            {"batch_size": batch_size},
+        ).consume()
+    return summary.counters.properties_set
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Denormalize document ownership onto Page and Child nodes")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--batch-size", type=int, default=1000, help="Pages per transaction")
+    args = parser.parse_args()
+
+    AppConfig.initialize_environment_variables()
+    driver = GraphDatabase.driver(AppConfig.NEO4J_URI, auth=(AppConfig.NEO4J_USER, AppConfig.NEO4J_PASSWORD))
+    try:
+        logging.info(f"Set owner_uuid on {backfill(driver, args.batch_size)} nodes")
+    finally:
+        driver.close()
+
+
+if __name__ == "__main__":
+    main()
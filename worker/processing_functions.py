@@ -1,4 +1,6 @@
+import json
 import logging
+import time
 import uuid
 from typing import List
 
@@ -6,9 +8,12 @@ from langchain.pydantic_v1 import BaseModel, Field
 from langchain.chains.openai_functions import create_structured_output_chain
 from langchain.chains.openai_functions import create_structured_output_chain
 from langchain.prompts import ChatPromptTemplate
+from langchain.docstore.document import Document
 
 from config import AppConfig
 from  models import Question
+from .llm_cache import llm_cache
+from .usage import count_tokens
 
 
 # internal classes
@@ -23,120 +28,359 @@ class Questions(BaseModel):
         ),
     )
 
+class PageEnrichment(BaseModel):
+    """Hypothetical questions and a summary for one page of text."""
+
+    page: int = Field(..., description="Number of the page, taken from its 'Page N:' header")
+    questions: List[str] = Field(
+        ...,
+        description=(
+            "Generated hypothetical questions based on " "the information from the page"
+        ),
+    )
+    summary: str = Field(..., description="Concise and accurate summary of the page")
+
+
+class PagesEnrichment(BaseModel):
+    """Generating hypothetical questions and summaries for pages of text."""
+
+    pages: List[PageEnrichment] = Field(..., description="One entry per input page")
+
 # Initialize environment variables if needed
 AppConfig.initialize_environment_variables()
 
-def generate_questions(self,llm, parent_documents, documentId, embeddings, driver):
+def load_pages(driver, documentId, page_uuids=None):
+    """
+    Read a document's pages back from the graph in page order, so enrichment
+    tasks do not need the parent documents from the ingest task.
+    Pass page_uuids to load only those pages.
+    """
+    with driver.session() as session:
+        result = session.run(
+            """
+            MATCH (d:Document {uuid: $document_uuid})-[:HAS_PAGE]->(p:Page)
+            WHERE $page_uuids IS NULL OR p.uuid IN $page_uuids
+            RETURN p.uuid AS uuid, p.name AS name, p.text AS text
+            ORDER BY toInteger(replace(p.name, 'Page ', ''))
+            """,
+            {"document_uuid": documentId, "page_uuids": page_uuids},
+        )
+        return [
+            Document(
+                page_content=record["text"],
+                metadata={
+                    "uuid": record["uuid"],
+                    "name": record["name"],
+                    "page_number": int(record["name"].replace("Page ", "")),
+                },
+            )
+            for record in result
+        ]
+
 
-    # Generate Questions for page node 
-    logging.info(f"Generating questions for document {documentId}")
-    questions_prompt = ChatPromptTemplate.from_messages(
-        [
+## Deterministic node ids, so re-running a document MERGEs onto the same nodes
+def node_uuid(documentId, *parts):
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, "menome:" + ":".join(str(part) for part in [documentId, *parts])))
+
+
+## Per-document checkpoints: d.checkpoint_<stage> holds the last page completed in that
+## stage by the task d.checkpoint_<stage>_task, and d.checkpoint_stage the last stage
+## completed for the whole document. Only a retry or redelivery of that task (same task
+## id) resumes; any other task, such as a reprocessing request, starts the stage over.
+def read_checkpoint(driver, documentId, stage, task_id):
+    key, task_key = f"checkpoint_{stage}", f"checkpoint_{stage}_task"
+    with driver.session() as session:
+        record = session.run(
+            "MATCH (d:Document {uuid: $document_uuid}) RETURN d[$key] AS page, d[$task_key] AS task_id",
+            {"document_uuid": documentId, "key": key, "task_key": task_key},
+        ).single()
+        if record is None:
+            return 0
+        if record["task_id"] == task_id:
+            return record["page"] or 0
+        session.run(
+            "MATCH (d:Document {uuid: $document_uuid}) SET d += $checkpoint",
+            {"document_uuid": documentId, "checkpoint": {key: 0, task_key: task_id}},
+        )
+    return 0
+
+
+def checkpoint_page(tx, documentId, stage, page_number):
+    tx.run(
+        "MATCH (d:Document {uuid: $document_uuid}) SET d += $checkpoint",
+        {"document_uuid": documentId, "checkpoint": {f"checkpoint_{stage}": page_number}},
+    )
+
+
+def complete_stage(driver, documentId, stage):
+    with driver.session() as session:
+        session.run(
+            "MATCH (d:Document {uuid: $document_uuid}) SET d.checkpoint_stage = $stage",
+            {"document_uuid": documentId, "stage": stage},
+        )
+
+
+def pending_pages(driver, documentId, stage, pages, task_id):
+    """Drop the pages an earlier attempt of this task already completed."""
+    done = read_checkpoint(driver, documentId, stage, task_id)
+    if done:
+        logging.info(f"Resuming {stage} for document {documentId} after page {done}")
+    return [page for page in pages if page.metadata["page_number"] > done]
+
+
+# Prompts, shared by the interactive chains and the batch enrichment files
+QUESTIONS_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
             (
-                "system",
-                (
-                    "You are generating hypothetical questions based on the information "
-                    "found in the text. Make sure to provide full context in the generated "
-                    "questions."
-                ),
+                "You are generating hypothetical questions based on the information "
+                "found in the text. Make sure to provide full context in the generated "
+                "questions."
             ),
+        ),
+        (
+            "human",
             (
-                "human",
-                (
-                    "Use the given format to generate hypothetical questions from the "
-                    "following input: {input}"
-                ),
+                "Use the given format to generate hypothetical questions from the "
+                "following input: {input}"
             ),
-        ]
-    )
-    
-    logging.info(f"LLM type: {type(llm)}, Prompt: {questions_prompt}")
+        ),
+    ]
+)
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            (
+                "You are generating concise and accurate summaries based on the "
+                "information found in the text."
+            ),
+        ),
+        (
+            "human",
+            ("Generate a summary of the following input: {question}\n" "Summary:"),
+        ),
+    ]
+)
+
+ENRICHMENT_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            (
+                "You are generating hypothetical questions and concise, accurate summaries "
+                "based on the information found in the text. The input contains one or more "
+                "pages, each starting with a 'Page N:' header. For every page, generate up to "
+                "{max_questions} hypothetical questions with full context, and a summary of "
+                "that page only. Return one entry per page, using the page number from its header."
+            ),
+        ),
+        (
+            "human",
+            "Use the given format to enrich the following input:\n\n{input}",
+        ),
+    ]
+)
+
+
+def write_questions(driver, documentId, page_number, questions, embeddings, checkpoint_stage=None):
+    params = {
+        "parent_id": f"Page {page_number}",
+        "document_uuid": documentId,
+        "questions": [
+            {
+                "text": q, 
+                "uuid": node_uuid(documentId, "question", page_number, iq+1), 
+                "name": f"{page_number}-{iq+1}", 
+                "embedding": embeddings.embed_query(q)
+            }
+            for iq, q in enumerate(questions) if q  # Iterate over limited questions
+        ],
+    }
+    params["uuids"] = [q["uuid"] for q in params["questions"]]
+
+    def write(tx):
+        # Replace questions from an earlier run that produced more of them
+        tx.run(
+            """
+        match (d:Document)-[]-(p:Page) where d.uuid=$document_uuid and p.name=$parent_id
+        MATCH (p)-[:HAS_QUESTION]->(old:Question) WHERE NOT old.uuid IN $uuids
+        DETACH DELETE old
+        """,
+            params,
+        )
+        tx.run(
+            """
+        match (d:Document)-[]-(p:Page) where d.uuid=$document_uuid and p.name=$parent_id
+        WITH p
+        UNWIND $questions AS question
+        MERGE (q:Question {uuid: question.uuid})
+        SET q.text = question.text, q.name = question.name, q.datecreated= datetime(), q.source=p.uuid
+        MERGE (q)<-[:HAS_QUESTION]-(p)
+        WITH q, question
+        CALL db.create.setVectorProperty(q, 'embedding', question.embedding)
+        YIELD node
+        RETURN count(*)
+        """,
+            params,
+        )
+        if checkpoint_stage:
+            checkpoint_page(tx, documentId, checkpoint_stage, page_number)
+
+    with driver.session() as session :
+        session.execute_write(write)
+
+
+def write_summary(driver, documentId, page_number, summary, embeddings, checkpoint_stage=None):
+    params = {
+        "parent_id": f"Page {page_number}",
+        "uuid": node_uuid(documentId, "summary", page_number),
+        "summary": summary,
+        "embedding": embeddings.embed_query(summary),
+        "document_uuid": documentId
+    }
+
+    def write(tx):
+        tx.run(
+            """
+        match (d:Document)-[]-(p:Page) where d.uuid=$document_uuid and p.name=$parent_id
+        with p
+        MERGE (p)-[:HAS_SUMMARY]->(s:Summary)
+        SET s.text = $summary, s.datecreated= datetime(), s.uuid= $uuid, s.source=p.uuid
+        WITH s
+        CALL db.create.setVectorProperty(s, 'embedding', $embedding)
+        YIELD node
+        RETURN count(*)
+        """,
+            params,
+        )
+        if checkpoint_stage:
+            checkpoint_page(tx, documentId, checkpoint_stage, page_number)
+
+    with driver.session() as session :
+        session.execute_write(write)
+
+
+def generate_questions(self,llm, parent_documents, documentId, embeddings, driver, checkpoint_stage=None, cancellation=None):
+
+    # Generate Questions for page node 
+    logging.info(f"Generating questions for document {documentId}")
+    logging.info(f"LLM type: {type(llm)}, Prompt: {QUESTIONS_PROMPT}")
     
-    question_chain = create_structured_output_chain(Questions, llm, questions_prompt)
+    question_chain = create_structured_output_chain(Questions, llm, QUESTIONS_PROMPT)
 
     for i, parent in enumerate(parent_documents):
+        if cancellation:
+            cancellation.check()
         self.update_state(state=AppConfig.PROCESSING_QUESTIONS, meta={"page": i+1, "total_pages": len(parent_documents), "documentId": documentId})
         logging.info(f"Generating questions for page {i+1} of {len(parent_documents)} for document {documentId}")
-        generated_questions = question_chain.run(parent.page_content).questions
-        limited_questions = generated_questions[:AppConfig.MAX_QUESTIONS_PER_PAGE]  # Limit the number of questions
-
-        params = {
-            "parent_id": f"Page {i+1}",
-            "document_uuid": documentId,
-            "questions": [
-                {
-                    "text": q, 
-                    "uuid": str(uuid.uuid4()), 
-                    "name": f"{i+1}-{iq+1}", 
-                    "embedding": embeddings.embed_query(q)
-                }
-                for iq, q in enumerate(limited_questions) if q  # Iterate over limited questions
-            ],
-        }
-        with driver.session() as session :
-            session.run(
-                """
-            match (d:Document)-[]-(p:Page) where d.uuid=$document_uuid and p.name=$parent_id
-            WITH p
-            UNWIND $questions AS question
-            CREATE (q:Question {uuid: question.uuid})
-            SET q.text = question.text, q.name = question.name, q.datecreated= datetime(), q.source=p.uuid
-            MERGE (q)<-[:HAS_QUESTION]-(p)
-            WITH q, question
-            CALL db.create.setVectorProperty(q, 'embedding', question.embedding)
-            YIELD node
-            RETURN count(*)
-            """,
-            params,
+        limited_questions = llm_cache.get_or_compute(
+            llm.model_name, QUESTIONS_PROMPT, parent.page_content,
+            lambda: question_chain.run(parent.page_content).questions[:AppConfig.MAX_QUESTIONS_PER_PAGE],  # Limit the number of questions
+            max_questions=AppConfig.MAX_QUESTIONS_PER_PAGE,
         )
+        write_questions(driver, documentId, parent.metadata.get("page_number", i+1), limited_questions, embeddings, checkpoint_stage)
         
 
-def generate_summaries(self,llm, parent_documents, documentId, embeddings, driver):
+def generate_summaries(self,llm, parent_documents, documentId, embeddings, driver, checkpoint_stage=None, cancellation=None):
     # Code for generating summaries
-       
-    # Ingest summaries
-
-    summary_prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                (
-                    "You are generating concise and accurate summaries based on the "
-                    "information found in the text."
-                ),
-            ),
-            (
-                "human",
-                ("Generate a summary of the following input: {question}\n" "Summary:"),
-            ),
-        ]
-    )
-
-    summary_chain = summary_prompt | llm
+    summary_chain = SUMMARY_PROMPT | llm
 
     for i, parent in enumerate(parent_documents):
+        if cancellation:
+            cancellation.check()
         self.update_state(state=AppConfig.PROCESSING_SUMMARY, meta={"page": i+1, "total_pages": len(parent_documents), "documentId": documentId})
         logging.info(f"Generating summary for page {i+1} of {len(parent_documents)} for document {documentId}")
         
-        summary = summary_chain.invoke({"question": parent.page_content}).content
-        params = {
-            "parent_id": f"Page {i+1}",
-            "uuid": str(uuid.uuid4()),
-            "summary": summary,
-            "embedding": embeddings.embed_query(summary),
-            "document_uuid": documentId
-        }
-        with driver.session() as session :
-            session.run(
-                """
-            match (d:Document)-[]-(p:Page) where d.uuid=$document_uuid and p.name=$parent_id
-            with p
-            MERGE (p)-[:HAS_SUMMARY]->(s:Summary)
-            SET s.text = $summary, s.datecreated= datetime(), s.uuid= $uuid, s.source=p.uuid
-            WITH s
-            CALL db.create.setVectorProperty(s, 'embedding', $embedding)
-            YIELD node
-            RETURN count(*)
-            """,
-                params,
-            )
\ No newline at end of file
+        summary = llm_cache.get_or_compute(
+            llm.model_name, SUMMARY_PROMPT, parent.page_content,
+            lambda: summary_chain.invoke({"question": parent.page_content}).content,
+        )
+        # Ingest summaries
+        write_summary(driver, documentId, parent.metadata.get("page_number", i+1), summary, embeddings, checkpoint_stage)
+
+
+def pack_pages(parent_documents, model, token_budget, max_pages):
+    """
+    Group consecutive pages into packs whose combined text fits token_budget,
+    with at most max_pages pages per pack. A page larger than the budget gets a pack of its own.
+    """
+    packs, current, current_tokens = [], [], 0
+    for i, parent in enumerate(parent_documents):
+        tokens = count_tokens(parent.page_content, model)
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_pages):
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append((parent.metadata.get("page_number", i+1), parent))
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+
+def enrich_pages(self, llm, parent_documents, documentId, embeddings, driver, checkpoint_stage=None, cancellation=None):
+    """
+    Generate questions and a summary for every page with one structured LLM call
+    per pack of pages, instead of one questions call and one summary call per page.
+    Pages are packed up to ENRICHMENT_PACK_TOKEN_BUDGET tokens; each page's output is
+    cached on its own so packs never have to line up between runs.
+    """
+    logging.info(f"Enriching document {documentId}")
+    enrichment_chain = create_structured_output_chain(PagesEnrichment, llm, ENRICHMENT_PROMPT)
+    max_questions = AppConfig.MAX_QUESTIONS_PER_PAGE
+
+    def page_key(parent):
+        return llm_cache.key(llm.model_name, ENRICHMENT_PROMPT, parent.page_content, max_questions=max_questions)
+
+    def enrich_alone(page_number, parent):
+        entries = enrichment_chain.run(input=f"Page {page_number}:\n{parent.page_content}", max_questions=max_questions).pages
+        if entries:
+            return entries[0].questions, entries[0].summary
+        # Nothing back even for the page alone: use the separate questions and summary prompts
+        logging.warning(f"Empty enrichment response for page {page_number} of document {documentId}, using the per-page prompts")
+        questions = create_structured_output_chain(Questions, llm, QUESTIONS_PROMPT).run(parent.page_content).questions
+        summary = (SUMMARY_PROMPT | llm).invoke({"question": parent.page_content}).content
+        return questions, summary
+
+    packs = pack_pages(parent_documents, llm.model_name, AppConfig.ENRICHMENT_PACK_TOKEN_BUDGET, AppConfig.ENRICHMENT_PACK_MAX_PAGES)
+    done = 0
+    for pack in packs:
+        if cancellation:
+            cancellation.check()
+        self.update_state(state=AppConfig.PROCESSING_ENRICHMENT, meta={"page": done + len(pack), "total_pages": len(parent_documents), "documentId": documentId})
+        logging.info(f"Enriching pages {pack[0][0]}-{pack[-1][0]} of document {documentId}")
+
+        results = {}
+        missing = []
+        for page_number, parent in pack:
+            cached = llm_cache.get(page_key(parent))
+            if cached is not None:
+                results[page_number] = cached
+            else:
+                missing.append((page_number, parent))
+
+        if missing:
+            start = time.time()
+            text = "\n\n".join(f"Page {page_number}:\n{parent.page_content}" for page_number, parent in missing)
+            response = enrichment_chain.run(input=text, max_questions=max_questions)
+            seconds = (time.time() - start) / len(missing)
+            returned = {entry.page: entry for entry in response.pages}
+            for page_number, parent in missing:
+                entry = returned.get(page_number)
+                if entry is None:
+                    # The model skipped a page of the pack: enrich it on its own
+                    logging.warning(f"Page {page_number} of document {documentId} missing from packed response, retrying alone")
+                    questions, summary = enrich_alone(page_number, parent)
+                else:
+                    questions, summary = entry.questions, entry.summary
+                value = {"questions": questions[:max_questions], "summary": summary}
+                tokens = count_tokens(parent.page_content, llm.model_name) + count_tokens(json.dumps(value), llm.model_name)
+                llm_cache.put(page_key(parent), value, tokens, seconds)
+                results[page_number] = value
+
+        for page_number, parent in pack:
+            write_questions(driver, documentId, page_number, results[page_number]["questions"], embeddings)
+            write_summary(driver, documentId, page_number, results[page_number]["summary"], embeddings, checkpoint_stage)
+        done += len(pack)
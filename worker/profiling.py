@@ -0,0 +1,210 @@
+"""
+On-demand sampling profiler for API requests and Celery tasks.
+
+A background thread samples the Python stacks of the profiled threads every
+PROFILE_SAMPLE_INTERVAL_MS with sys._current_frames, so the profiled code runs
+unmodified and nothing is installed when profiling is off. Each profile is
+saved under PROFILE_DIR (shared by the API and the workers through ./cache) as:
+
+    <id>.json    summary with the top PROFILE_TOP_N functions by self and total samples
+    <id>.folded  folded stacks, for flamegraph.pl or speedscope
+    <id>.svg     a rendered flame graph
+
+and fetched through the /admin/profiles endpoints. API requests are profiled
+by app/profiling.py.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from html import escape
+
+from config import AppConfig
+
+
+PROFILE_ID = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9a-f]{8}$")
+
+# Innermost frames of threads that are waiting rather than working
+IDLE_LEAVES = {
+    ("wait", "threading.py"),
+    ("_wait_for_tstate_lock", "threading.py"),
+    ("get", "queue.py"),
+    ("select", "selectors.py"),
+}
+
+
+def frame_label(code, cache={}) -> str:
+    label = cache.get(code)
+    if label is None:
+        label = cache[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+    return label
+
+
+class SamplingProfiler:
+    """Samples the stacks of thread_ids (all other threads when None) until stopped."""
+
+    def __init__(self, interval: float, thread_ids: set = None):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                if (frame.f_code.co_name, os.path.basename(frame.f_code.co_filename)) in IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def start(self):
+        self.started = time.time()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.time() - self.started
+
+
+## Reports
+
+def top_functions(stacks: Counter, n: int) -> dict:
+    self_samples, total_samples = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        self_samples[frames[-1]] += count
+        for frame in set(frames):
+            total_samples[frame] += count
+    samples = sum(stacks.values()) or 1
+
+    def rows(counter):
+        return [{"function": f, "samples": c, "percent": round(100 * c / samples, 1)} for f, c in counter.most_common(n)]
+
+    return {"top_self": rows(self_samples), "top_total": rows(total_samples)}
+
+
+def render_flamegraph(stacks: Counter, title: str, width: int = 1200, row_height: int = 16) -> str:
+    """Render folded stacks as an SVG flame graph (root at the bottom, widths proportional to samples)."""
+    tree = {"children": {}, "count": 0}
+    for stack, count in stacks.items():
+        node = tree
+        node["count"] += count
+        for frame in stack.split(";"):
+            node = node["children"].setdefault(frame, {"children": {}, "count": 0})
+            node["count"] += count
+
+    def depth(node):
+        return 1 + max((depth(child) for child in node["children"].values()), default=0)
+
+    total = tree["count"] or 1
+    height = (depth(tree) + 1) * row_height
+    rects = []
+
+    def draw(node, x, level):
+        for name, child in sorted(node["children"].items()):
+            w = width * child["count"] / total
+            y = height - (level + 1) * row_height
+            hue = 20 + (hash(name) % 40)
+            label = escape(name)
+            rects.append(
+                f'<g><title>{label} ({child["count"]} samples, {100 * child["count"] / total:.1f}%)</title>'
+                f'<rect x="{x:.2f}" y="{y}" width="{max(w - 0.5, 0.1):.2f}" height="{row_height - 1}" fill="hsl({hue},85%,60%)"/>'
+                + (f'<text x="{x + 3:.2f}" y="{y + row_height - 4}" font-size="11" font-family="monospace">'
+                   f'{escape(name[:int(w / 7)])}</text>' if w > 30 else "")
+                + "</g>"
+            )
+            draw(child, x, level + 1)
+            x += w
+
+    draw(tree, 0.0, 0)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height + row_height}">'
+        f'<text x="4" y="{row_height - 4}" font-size="12" font-family="sans-serif">{escape(title)}</text>'
+        + "".join(rects) + "</svg>"
+    )
+
+
+## Storage
+
+def profile_path(profile_id: str, extension: str) -> str:
+    return os.path.join(AppConfig.PROFILE_DIR, f"{profile_id}.{extension}")
+
+
+def new_profile_id(started: float = None) -> str:
+    return time.strftime("%Y%m%d-%H%M%S", time.gmtime(started)) + "-" + uuid.uuid4().hex[:8]
+
+
+def save_profile(profiler: SamplingProfiler, name: str, profile_id: str = None) -> str:
+    profile_id = profile_id or new_profile_id(profiler.started)
+    os.makedirs(AppConfig.PROFILE_DIR, exist_ok=True)
+    summary = {
+        "id": profile_id,
+        "name": name,
+        "pid": os.getpid(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(profiler.started)),
+        "duration": round(profiler.duration, 3),
+        "interval": profiler.interval,
+        "samples": profiler.samples,
+        **top_functions(profiler.stacks, AppConfig.PROFILE_TOP_N),
+    }
+    with open(profile_path(profile_id, "json"), "w") as f:
+        json.dump(summary, f)
+    with open(profile_path(profile_id, "folded"), "w") as f:
+        f.writelines(f"{stack} {count}\n" for stack, count in profiler.stacks.items())
+    with open(profile_path(profile_id, "svg"), "w") as f:
+        f.write(render_flamegraph(profiler.stacks, f"{name} - {profiler.samples} samples, {profiler.duration:.2f}s"))
+    prune_profiles()
+    return profile_id
+
+
+def prune_profiles():
+    summaries = sorted(name for name in os.listdir(AppConfig.PROFILE_DIR) if name.endswith(".json"))
+    for name in summaries[:-AppConfig.PROFILE_MAX_PROFILES]:
+        for extension in ("json", "folded", "svg"):
+            try:
+                os.remove(profile_path(name[:-5], extension))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(limit: int) -> list:
+    if not os.path.isdir(AppConfig.PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted((n for n in os.listdir(AppConfig.PROFILE_DIR) if n.endswith(".json")), reverse=True)[:limit]:
+        with open(os.path.join(AppConfig.PROFILE_DIR, name)) as f:
+            summary = json.load(f)
+        profiles.append({key: summary[key] for key in ("id", "name", "pid", "started_at", "duration", "samples")})
+    return profiles
+
+
+@contextmanager
+def profiled(name: str, current_thread_only: bool = True):
+    """
+    Profile the enclosed block. Yields a dict whose "id" is set once the profile
+    is saved. Samples only the calling thread unless current_thread_only is False.
+    """
+    profiler = SamplingProfiler(AppConfig.PROFILE_SAMPLE_INTERVAL_MS / 1000,
+                                {threading.get_ident()} if current_thread_only else None)
+    result = {"id": None}
+    profiler.start()
+    try:
+        yield result
+    finally:
+        profiler.stop()
+        result["id"] = save_profile(profiler, name)
@@ -0,0 +1,50 @@
+import time
+
+from config import AppConfig
+
+
+class ProgressReporter:
+    """
+    Coalesces Celery state updates for a task.
+
+    Exposes the same update_state(state, meta) call as a bound task so it can be
+    handed to the processing functions in place of the task. A write reaches the
+    result backend only when the state changes, when the last page of a stage is
+    reported, or when PROGRESS_MIN_INTERVAL seconds have passed since the last
+    write. Anything held back is sent by flush().
+    """
+
+    def __init__(self, task, documentId: str, min_interval: float = None):
+        self.task = task
+        self.documentId = documentId
+        self.min_interval = AppConfig.PROGRESS_MIN_INTERVAL if min_interval is None else min_interval
+        self._last_state = None
+        self._last_sent = 0.0
+        self._pending = None
+
+    def update_state(self, state: str, meta: dict = None, force: bool = False):
+        meta = dict(meta or {})
+        meta.setdefault("documentId", self.documentId)
+
+        now = time.monotonic()
+        last_page = meta.get("total_pages") is not None and meta.get("page") == meta.get("total_pages")
+        if (
+            force
+            or last_page
+            or state != self._last_state
+            or now - self._last_sent >= self.min_interval
+        ):
+            self._send(state, meta, now)
+        else:
+            self._pending = (state, meta)
+
+    def flush(self):
+        if self._pending:
+            state, meta = self._pending
+            self._send(state, meta, time.monotonic())
+
+    def _send(self, state: str, meta: dict, now: float):
+        self.task.update_state(state=state, meta=meta)
+        self._last_state = state
+        self._last_sent = now
+        self._pending = None
@@ -0,0 +1,109 @@
+"""
+Per-process worker resources.
+
+The Neo4j driver, the embedding backend, the chat client and the text splitters
+are created once in each worker child process by the worker_process_init hook,
+never in the parent, so no sockets are inherited across fork. Tasks fetch them
+with the get_* functions, which also initialize on first use for the
+solo/threads pools and command line tools. The pinned openai client keeps its
+own keep-alive session per thread, so there is no HTTP pool to configure here.
+"""
+import logging
+import os
+import threading
+
+from celery.signals import worker_process_init, worker_process_shutdown
+from neo4j import GraphDatabase
+from langchain.chat_models import ChatOpenAI
+from langchain.text_splitter import TokenTextSplitter
+
+from config import AppConfig
+from .embeddings import create_embeddings, check_index_dimensions
+
+
+_resources = {}
+_pid = None
+_lock = threading.Lock()
+
+
+def init_resources():
+    global _pid
+    with _lock:
+        if _pid == os.getpid():
+            return
+
+        _resources["driver"] = GraphDatabase.driver(
+            AppConfig.NEO4J_URI,
+            auth=(AppConfig.NEO4J_USER, AppConfig.NEO4J_PASSWORD),
+            max_connection_pool_size=AppConfig.NEO4J_MAX_POOL_SIZE,
+            connection_acquisition_timeout=AppConfig.NEO4J_CONNECTION_ACQUISITION_TIMEOUT,
+        )
+        _resources["embeddings"] = create_embeddings()
+        _resources["llm"] = ChatOpenAI(temperature=0, model=AppConfig.OPENAI_CHAT_MODEL)
+        # Splitters hold their tiktoken encoding, so building them once caches the tokenizer
+        _resources["parent_splitter"] = TokenTextSplitter(chunk_size=512, chunk_overlap=24)
+        _resources["child_splitter"] = TokenTextSplitter(chunk_size=100, chunk_overlap=24)
+        _pid = os.getpid()
+        logging.info(f"Initialized worker resources in process {_pid}")
+
+
+def close_resources():
+    global _pid
+    with _lock:
+        driver = _resources.pop("driver", None)
+        if driver is not None and _pid == os.getpid():
+            driver.close()
+        _resources.clear()
+        _pid = None
+
+
+@worker_process_init.connect
+def on_worker_process_init(**kwargs):
+    init_resources()
+
+
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(**kwargs):
+    close_resources()
+
+
+def get_resource(name: str):
+    if _pid != os.getpid():
+        init_resources()
+    return _resources[name]
+
+
+def get_driver():
+    return get_resource("driver")
+
+
+def get_embeddings():
+    embeddings = get_resource("embeddings")
+    if "index_dimensions" not in _resources:
+        # Fail before writing vectors the indexes cannot hold
+        _resources["index_dimensions"] = check_index_dimensions(get_driver())
+    return embeddings
+
+
+def get_llm():
+    return get_resource("llm")
+
+
+def get_splitters():
+    return get_resource("parent_splitter"), get_resource("child_splitter")
+
+
+def check_health() -> dict:
+    """Verify this process can reach Neo4j and report its resource settings."""
+    health = {"pid": os.getpid(), "neo4j": "ok", "neo4j_pool_size": AppConfig.NEO4J_MAX_POOL_SIZE,
+              "embedding_backend": AppConfig.EMBEDDING_BACKEND, "embedding_dimensions": "ok"}
+    try:
+        get_driver().verify_connectivity()
+    except Exception as e:
+        health["neo4j"] = f"error: {e}"
+        return health
+    try:
+        check_index_dimensions(get_driver())
+    except ValueError as e:
+        health["embedding_dimensions"] = f"error: {e}"
+    return health
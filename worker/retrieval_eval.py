@@ -0,0 +1,238 @@
+"""
+Offline retrieval evaluation.
+
+The generated Question nodes make a ready-made test set: each hangs off the
+Page it was written from, so a retrieval for the question text is a hit when
+it returns that page. Questions are sampled (by uuid order, which is random
+for the hash-based uuids), run against every target at every k, and scored:
+
+    recall@k   share of questions whose source page is in the top k results
+    MRR        mean of 1 / rank of the source page (0 when it is not retrieved)
+    p50 / p95  query latency, embedding excluded
+
+Results under a score threshold are dropped before scoring, as LangChain's
+score_threshold does. Targets are either a Neo4j vector index, with results
+mapped back to their page:
+
+    neo4j:index=parent_document    Child chunks (the chat index)
+    neo4j:index=typical_rag        whole Pages
+    neo4j:index=summary            page Summaries
+
+or an in-process index, built by re-chunking the pages of the sampled
+questions' documents, to compare chunk sizes and embedding backends or
+dimensions without re-ingesting (the corpus is smaller than the full graph,
+so compare in-process targets with each other):
+
+    inprocess:chunk=200,overlap=24,backend=hashing,dim=512
+
+Usage:
+    python -m worker.retrieval_eval --target neo4j:index=parent_document neo4j:index=typical_rag \\
+        --k 4 10 --threshold 0 0.8 --questions 500 [--output report.json]
+"""
+import argparse
+import json
+import logging
+import time
+
+from neo4j import GraphDatabase
+
+from config import AppConfig
+from .embeddings import HashingEmbeddings, create_embeddings
+
+
+QUESTIONS_QUERY = """
+MATCH (d:Document)-[:HAS_PAGE]->(p:Page)-[:HAS_QUESTION]->(q:Question)
+WHERE q.text IS NOT NULL
+RETURN q.uuid AS uuid, q.text AS text, p.uuid AS page, d.uuid AS document
+ORDER BY q.uuid LIMIT $limit
+"""
+
+# How a hit of each index maps back to its page
+PAGE_OF_HIT = {
+    "parent_document": "MATCH (page:Page)-[:HAS_CHILD]->(node)",
+    "typical_rag": "WITH node AS page, score",
+    "summary": "MATCH (page:Page)-[:HAS_SUMMARY]->(node)",
+}
+
+INDEX_QUERY = """
+CALL db.index.vector.queryNodes($index, $k, $embedding) YIELD node, score
+{page_of_hit}
+RETURN page.uuid AS page, score ORDER BY score DESC
+"""
+
+
+def parse_target(spec: str) -> dict:
+    kind, _, options = spec.partition(":")
+    target = {"name": spec, "kind": kind}
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition("=")
+        target[key] = value
+    if kind == "neo4j":
+        if target.get("index") not in PAGE_OF_HIT:
+            raise ValueError(f"{spec}: index must be one of {sorted(PAGE_OF_HIT)}")
+    elif kind == "inprocess":
+        target["chunk"] = int(target.get("chunk", 100))
+        target["overlap"] = int(target.get("overlap", 24))
+        target["backend"] = target.get("backend", AppConfig.EMBEDDING_BACKEND)
+        target["dim"] = int(target.get("dim", AppConfig.EMBEDDING_DIMENSION))
+    else:
+        raise ValueError(f"{spec}: expected neo4j:... or inprocess:...")
+    return target
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def ranked_pages(hits: list) -> list:
+    """(page, score) hits in score order, each page kept at its best rank."""
+    seen, pages = set(), []
+    for page, score in hits:
+        if page not in seen:
+            seen.add(page)
+            pages.append((page, score))
+    return pages
+
+
+def score_run(questions: list, results: list, threshold: float) -> dict:
+    hits, reciprocal_ranks = 0, []
+    for question, pages in zip(questions, results):
+        kept = [page for page, score in pages if score >= threshold]
+        rank = kept.index(question["page"]) + 1 if question["page"] in kept else None
+        hits += rank is not None
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    return {"recall": hits / len(questions), "mrr": sum(reciprocal_ranks) / len(questions)}
+
+
+## Embeddings
+_embeddings = {}
+
+
+def get_embeddings(backend: str, dim: int):
+    """One embedding client per backend; the hashing backend takes any dimension."""
+    key = (backend, dim if backend == "hashing" else None)
+    if key not in _embeddings:
+        _embeddings[key] = HashingEmbeddings(dim) if backend == "hashing" else create_embeddings(backend)
+    return _embeddings[key]
+
+
+def embed_questions(questions: list, embeddings) -> list:
+    started = time.monotonic()
+    vectors = embeddings.embed_documents([q["text"] for q in questions])
+    logging.info(f"Embedded {len(questions)} questions in {time.monotonic() - started:.1f}s")
+    return vectors
+
+
+## Targets
+class Neo4jTarget:
+    def __init__(self, driver, target: dict):
+        self.driver = driver
+        self.index = target["index"]
+        self.query = INDEX_QUERY.format(page_of_hit=PAGE_OF_HIT[self.index])
+        # Questions must be embedded like the indexed nodes were
+        self.embeddings = get_embeddings(AppConfig.EMBEDDING_BACKEND, AppConfig.EMBEDDING_DIMENSION)
+
+    def search(self, embedding: list, k: int) -> list:
+        with self.driver.session() as session:
+            result = session.run(self.query, {"index": self.index, "k": k, "embedding": embedding})
+            return ranked_pages([(record["page"], record["score"]) for record in result])
+
+
+class InProcessTarget:
+    """Brute-force cosine over the re-chunked pages of the sampled documents."""
+
+    def __init__(self, driver, target: dict, documents: list):
+        import numpy as np
+        from langchain.text_splitter import TokenTextSplitter
+
+        self.np = np
+        self.embeddings = get_embeddings(target["backend"], target["dim"])
+        splitter = TokenTextSplitter(chunk_size=target["chunk"], chunk_overlap=target["overlap"])
+        with driver.session() as session:
+            result = session.run(
+                "MATCH (d:Document)-[:HAS_PAGE]->(p:Page) WHERE d.uuid IN $documents RETURN p.uuid AS page, p.text AS text",
+                {"documents": documents},
+            )
+            chunks = [(record["page"], chunk) for record in result for chunk in splitter.split_text(record["text"] or "")]
+        self.pages = [page for page, _ in chunks]
+        matrix = np.array(self.embeddings.embed_documents([text for _, text in chunks]), dtype=np.float32)
+        self.matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        logging.info(f"{target['name']}: {len(chunks)} chunks")
+
+    def search(self, embedding: list, k: int) -> list:
+        np = self.np
+        query = np.asarray(embedding, dtype=np.float32)
+        scores = self.matrix @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return ranked_pages([(self.pages[i], float(scores[i])) for i in top])
+
+
+def evaluate(driver, questions: list, targets: list, ks: list, thresholds: list) -> list:
+    documents = sorted({q["document"] for q in questions})
+    rows, question_vectors = [], {}
+    for target in targets:
+        searcher = Neo4jTarget(driver, target) if target["kind"] == "neo4j" else InProcessTarget(driver, target, documents)
+        # Targets sharing an embedding client share the question embeddings
+        if id(searcher.embeddings) not in question_vectors:
+            question_vectors[id(searcher.embeddings)] = embed_questions(questions, searcher.embeddings)
+        vectors = question_vectors[id(searcher.embeddings)]
+        for k in ks:
+            results, latencies = [], []
+            for vector in vectors:
+                started = time.perf_counter()
+                results.append(searcher.search(vector, k))
+                latencies.append((time.perf_counter() - started) * 1000)
+            for threshold in thresholds:
+                rows.append({
+                    "target": target["name"], "k": k, "threshold": threshold, "questions": len(questions),
+                    **score_run(questions, results, threshold),
+                    "p50_ms": percentile(latencies, 0.5), "p95_ms": percentile(latencies, 0.95),
+                })
+    return rows
+
+
+def format_table(rows: list) -> str:
+    width = max([len("target")] + [len(row["target"]) for row in rows])
+    lines = [f"{'target':<{width}}  {'k':>4}  {'threshold':>9}  {'recall@k':>8}  {'MRR':>6}  {'p50 ms':>8}  {'p95 ms':>8}"]
+    for row in rows:
+        lines.append(f"{row['target']:<{width}}  {row['k']:>4}  {row['threshold']:>9.2f}  {row['recall']:>8.3f}  "
+                     f"{row['mrr']:>6.3f}  {row['p50_ms']:>8.1f}  {row['p95_ms']:>8.1f}")
+    return "\n".join(lines)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Evaluate retrieval configurations against the generated questions")
+    parser.add_argument("--target", nargs="+", default=["neo4j:index=parent_document"],
+                        help="neo4j:index=NAME or inprocess:chunk=N,overlap=N,backend=NAME,dim=N")
+    parser.add_argument("--k", type=int, nargs="+", default=[4, 10], help="Results per query")
+    parser.add_argument("--threshold", type=float, nargs="+", default=[0.0], help="Minimum score kept")
+    parser.add_argument("--questions", type=int, default=500, help="Questions sampled")
+    parser.add_argument("--output", help="Write the rows as JSON to this file")
+    args = parser.parse_args()
+
+    targets = [parse_target(spec) for spec in args.target]
+    AppConfig.initialize_environment_variables()
+    driver = GraphDatabase.driver(AppConfig.NEO4J_URI, auth=(AppConfig.NEO4J_USER, AppConfig.NEO4J_PASSWORD))
+    try:
+        with driver.session() as session:
+            questions = [record.data() for record in session.run(QUESTIONS_QUERY, {"limit": args.questions})]
+        if not questions:
+            raise SystemExit("No Question nodes to evaluate with; generate questions first")
+        logging.info(f"Evaluating {len(questions)} questions from {len({q['document'] for q in questions})} documents")
+        rows = evaluate(driver, questions, targets, sorted(set(args.k)), sorted(set(args.threshold)))
+    finally:
+        driver.close()
+
+    print(format_table(rows))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
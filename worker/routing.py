@@ -0,0 +1,77 @@
+"""
+Queues, routes and by-name dispatch shared by the worker and the API.
+
+Kept free of task code so the API can send tasks with send_task without
+importing worker.tasks (and its broker wait, Neo4j driver and LLM clients).
+"""
+from datetime import datetime, timezone
+from typing import List
+
+from kombu import Queue
+
+from config import AppConfig
+
+
+# Task names
+DIVIDE_TASK = "celery_worker.test_celery"
+HEALTH_CHECK_TASK = "celery_worker.health_check"
+PROCESS_TEXT_TASK = "celery_worker.process_text_task"
+GENERATE_QUESTIONS_TASK = "celery_worker.generate_questions_task"
+GENERATE_SUMMARIES_TASK = "celery_worker.generate_summaries_task"
+ENRICH_DOCUMENT_TASK = "celery_worker.enrich_document_task"
+COMPACT_GRAPH_TASK = "celery_worker.compact_graph_task"
+SUMMARIZE_DOCUMENT_TASK = "celery_worker.summarize_document_task"
+
+
+def configure_queues(app):
+    """Declare the queues and routes on a Celery app, identically for producers and consumers."""
+    app.conf.task_queues = (
+        Queue("celery"),
+        Queue(AppConfig.INGEST_QUEUE, queue_arguments={"x-max-priority": AppConfig.QUEUE_MAX_PRIORITY}),
+        Queue(AppConfig.ENRICHMENT_QUEUE, queue_arguments={"x-max-priority": AppConfig.QUEUE_MAX_PRIORITY}),
+    )
+    app.conf.task_routes = {
+        DIVIDE_TASK: "celery",
+        HEALTH_CHECK_TASK: "celery",
+        COMPACT_GRAPH_TASK: "celery",
+        PROCESS_TEXT_TASK: {"queue": AppConfig.INGEST_QUEUE},
+        GENERATE_QUESTIONS_TASK: {"queue": AppConfig.ENRICHMENT_QUEUE},
+        GENERATE_SUMMARIES_TASK: {"queue": AppConfig.ENRICHMENT_QUEUE},
+        ENRICH_DOCUMENT_TASK: {"queue": AppConfig.ENRICHMENT_QUEUE},
+        SUMMARIZE_DOCUMENT_TASK: {"queue": AppConfig.ENRICHMENT_QUEUE},
+    }
+    app.conf.update(task_track_started=True)
+
+
+def send_process_text(app, text: str, documentId: str, generateQuestions: bool, generateSummaries: bool, priority: int = None,
+                      profile: bool = False, deadline: float = None):
+    """Queue ingest of a document. A deadline (timestamp) also expires the message if no worker took it by then."""
+    kwargs = {}
+    if profile:
+        kwargs["profile"] = True
+    if deadline is not None:
+        kwargs["deadline"] = deadline
+    return app.send_task(PROCESS_TEXT_TASK, args=[text, documentId, generateQuestions, generateSummaries], kwargs=kwargs or None,
+                         expires=datetime.fromtimestamp(deadline, timezone.utc) if deadline is not None else None,
+                         priority=AppConfig.INGEST_PRIORITY if priority is None else priority)
+
+
+def queue_enrichment(app, documentId: str, generateQuestions: bool, generateSummaries: bool, page_uuids: List[str] = None) -> List[str]:
+    """
+    Queue question and summary generation for a document's pages on the enrichment queue.
+    With ENRICHMENT_STRATEGY=fused, one task produces both in a single LLM call per pack of pages.
+    """
+    args = [documentId, page_uuids]
+    if generateQuestions and generateSummaries and AppConfig.ENRICHMENT_STRATEGY == "fused":
+        return [app.send_task(ENRICH_DOCUMENT_TASK, args=args, priority=AppConfig.ENRICHMENT_PRIORITY).id]
+
+    task_ids = []
+    if generateQuestions:
+        task_ids.append(app.send_task(GENERATE_QUESTIONS_TASK, args=args, priority=AppConfig.ENRICHMENT_PRIORITY).id)
+    if generateSummaries:
+        task_ids.append(app.send_task(GENERATE_SUMMARIES_TASK, args=args, priority=AppConfig.ENRICHMENT_PRIORITY).id)
+    return task_ids
+
+
+def queue_document_summary(app, documentId: str, force: bool = False) -> str:
+    return app.send_task(SUMMARIZE_DOCUMENT_TASK, args=[documentId, force], priority=AppConfig.ENRICHMENT_PRIORITY).id
@@ -0,0 +1,66 @@
+"""
+Bounded-memory ingest for very large documents.
+
+Documents longer than INGEST_STREAMING_THRESHOLD_CHARS are not split up front.
+iter_parent_chunks feeds the parent splitter one INGEST_STREAMING_WINDOW_CHARS
+window of text at a time and carries the window's last, possibly short, chunk
+over into the next window, so pages are produced lazily and deterministically
+(checkpoints still line up on a retry). Child embeddings are held as float32
+arrays until their page is written, each page is flushed to Neo4j before the
+next is split, and enrichment is queued in batches of
+INGEST_STREAMING_ENRICHMENT_PAGES pages that the enrichment tasks read back
+from the graph. Worker memory then depends on the window and page sizes, not
+on the length of the document (tests/test_streaming.py checks the peak).
+"""
+from array import array
+from typing import Iterator
+
+from config import AppConfig
+from .processing_functions import node_uuid
+
+
+def use_streaming(text: str) -> bool:
+    threshold = AppConfig.INGEST_STREAMING_THRESHOLD_CHARS
+    return threshold >= 0 and len(text) > threshold
+
+
+def window_end(text: str, start: int, size: int) -> int:
+    """End of the window starting at start: size characters back to the last whitespace, or the end of the text."""
+    end = start + size
+    if end >= len(text):
+        return len(text)
+    cut = max(text.rfind("\n", start, end), text.rfind(" ", start, end))
+    return cut + 1 if cut > start else end
+
+
+def iter_parent_chunks(text: str, splitter, window_chars: int) -> Iterator[str]:
+    """Yield the parent chunks of text, splitting one window at a time."""
+    carry, start = "", 0
+    while start < len(text):
+        end = window_end(text, start, window_chars)
+        chunks = splitter.split_text(carry + text[start:end])
+        start = end
+        if start < len(text) and len(chunks) > 1:
+            # The last chunk may stop short at the window edge: split it again with the next window
+            carry = chunks.pop()
+        else:
+            carry = ""
+        yield from chunks
+    if carry:
+        yield carry
+
+
+def page_uuid_batches(documentId: str, page_count: int, size: int) -> Iterator[list]:
+    for first in range(1, page_count + 1, size):
+        yield [node_uuid(documentId, "page", n) for n in range(first, min(first + size, page_count + 1))]
+
+
+def compact_embedding(vector) -> array:
+    """Embeddings as float32 buffers, 4 bytes per dimension instead of a list of Python floats."""
+    return array("f", vector)
+
+
+def as_list(vector) -> list:
+    # The Neo4j driver only packs lists
+    return vector.tolist() if isinstance(vector, array) else vector
+
@@ -1,14 +1,10 @@
 from celery import Celery
-from celery.result import AsyncResult
 
-from neo4j import GraphDatabase
-from neo4j.exceptions import Neo4jError
+from neo4j.exceptions import Neo4jError, TransientError, ServiceUnavailable, SessionExpired
 
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.text_splitter import TokenTextSplitter
 from langchain.document_loaders import telegram
 from langchain.pydantic_v1 import BaseModel, Field
-from langchain.chat_models import ChatOpenAI
+import openai
 
 import uuid
 import logging 
@@ -19,13 +15,57 @@ from kombu.exceptions import OperationalError
 import threading
 
 from config import AppConfig
-from .processing_functions import generate_questions, generate_summaries
+from .processing_functions import generate_questions, generate_summaries, enrich_pages, load_pages
+from .processing_functions import node_uuid, read_checkpoint, complete_stage, pending_pages
+from .progress import ProgressReporter
+from .dedup import dedupe_children, index_chunks, ensure_index as ensure_dedup_index, record_dedup_stats
+from .resources import get_driver, get_embeddings, get_llm, get_splitters, check_health
+from .routing import configure_queues, queue_enrichment, DIVIDE_TASK, HEALTH_CHECK_TASK, PROCESS_TEXT_TASK, COMPACT_GRAPH_TASK
+from .routing import GENERATE_QUESTIONS_TASK, GENERATE_SUMMARIES_TASK, ENRICH_DOCUMENT_TASK, SUMMARIZE_DOCUMENT_TASK, queue_document_summary
+from .llm_cache import llm_cache
+from .compaction import compact, detach_superseded_pages
+from .ownership import document_owner, ensure_indexes as ensure_owner_indexes
+from .usage import UsageLedger, MeteredEmbeddings, record_document_usage
+from .profiling import profiled
+from .cancellation import CancellationToken, TaskCancelled, CANCELLATION_ERRORS, cancel_reason, mark_cancelled, task_deadline
+from .cancellation import release_enrichment_claims
+from .streaming import use_streaming, iter_parent_chunks, compact_embedding, as_list, page_uuid_batches
+from .document_summary import pages_summarized, refresh_document_summary
 
 
 # Initialize environment variables if needed
 AppConfig.initialize_environment_variables()
 logging.info(f"Starting worker")
 
+# Errors worth retrying: rate limits, timeouts and unavailable services on either side
+TRANSIENT_ERRORS = (
+    TransientError,
+    ServiceUnavailable,
+    SessionExpired,
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+# Bounded exponential backoff for processing tasks; acks_late redelivers tasks lost with their worker
+RETRY_OPTIONS = {
+    "autoretry_for": TRANSIENT_ERRORS,
+    "retry_backoff": AppConfig.TASK_RETRY_BACKOFF,
+    "retry_backoff_max": AppConfig.TASK_RETRY_BACKOFF_MAX,
+    "retry_jitter": True,
+    "max_retries": AppConfig.TASK_MAX_RETRIES,
+    "acks_late": True,
+}
+
+# Backstop for processing tasks that overrun within a page: SoftTimeLimitExceeded is
+# handled like a cancellation, the hard limit a minute later kills the child
+TIME_LIMIT_OPTIONS = {
+    "soft_time_limit": AppConfig.TASK_SOFT_TIME_LIMIT_SECONDS,
+    "time_limit": AppConfig.TASK_SOFT_TIME_LIMIT_SECONDS + 60,
+} if AppConfig.TASK_SOFT_TIME_LIMIT_SECONDS > 0 else {}
+
 # Assuming you have a global variable to track the number of active tasks
 active_tasks_lock = threading.Lock()
 active_tasks_count = 0
@@ -52,8 +92,7 @@ def create_celery_app(broker_url, result_backend, max_retries=5, wait_seconds=5)
 
     # Create the Celery app
     celery_app = Celery("worker", broker=broker_url, result_backend=result_backend)
-    celery_app.conf.task_routes = {"celery_worker.test_celery": "celery"}
-    celery_app.conf.update(task_track_started=True)
+    configure_queues(celery_app)
 
     return celery_app
 
@@ -69,77 +108,82 @@ celery_app.conf.broker_transport_options = {'confirm_publish': True, 'acknowledg
 # Set heartbeat interval and prefetch count
 celery_app.conf.broker_heartbeat = 10  # seconds
 celery_app.conf.worker_prefetch_multiplier = 1
+# Replace a worker child once its resident memory passes the limit, after its current task
+if AppConfig.WORKER_MAX_MEMORY_PER_CHILD_MB > 0:
+    celery_app.conf.worker_max_memory_per_child = AppConfig.WORKER_MAX_MEMORY_PER_CHILD_MB * 1024
+# Periodic compaction, run by the celery_beat service
+if AppConfig.COMPACTION_INTERVAL_SECONDS > 0:
+    celery_app.conf.beat_schedule = {
+        "compact-graph": {"task": COMPACT_GRAPH_TASK, "schedule": AppConfig.COMPACTION_INTERVAL_SECONDS},
+    }
 
 
-from celery.result import AsyncResult
-from celery.exceptions import TimeoutError, CeleryError
-
-from celery.app.control import Inspect
+# Neo4j driver, LLM and embedding clients are created per worker process (see resources.py)
 
-def purge_celery_queue():
-    i = Inspect(app=celery_app)
-    active_queues = i.active_queues()
-    if active_queues:
-        for queue in active_queues.keys():
-            celery_app.control.purge()
+## Worker tasks
 
+@celery_app.task(name=HEALTH_CHECK_TASK)
+def health_check():
+    return check_health()
 
-def get_task_info(task_id: str):
-    try:
-        task = AsyncResult(task_id)
-
-        # Task Not Ready
-        if not task.ready():
-            return {"task_id": str(task_id), "status": task.status}
-
-        # Task done: return the value
-        task_result = task.get(timeout=10)  # Set a timeout for task.get() if needed
-        return {
-            "task_id": str(task_id),
-            "result": task_result,
-            "status": task.status
-        }
-
-    except TimeoutError:
-        # Handle timeout exceptions
-        return {
-            "task_id": str(task_id),
-            "error": "Timeout while retrieving the task result",
-            "status": "TIMEOUT"
-        }
-
-    except CeleryError as e:
-        # Handle general Celery errors
-        return {
-            "task_id": str(task_id),
-            "error": str(e),
-            "status": "ERROR"
-        }
 
-    except Exception as e:
-        # Handle other exceptions
-        return {
-            "task_id": str(task_id),
-            "error": f"An error occurred: {e}",
-            "status": "FAILURE"
-        }
+# Removes expired documents and orphaned or superseded nodes in batches
+@celery_app.task(name=COMPACT_GRAPH_TASK, acks_late=True)
+def compact_graph_task():
+    return compact(get_driver())
 
-# Set up Neo4j driver (replace with your actual connection details)
-driver = GraphDatabase.driver(AppConfig.NEO4J_URI, auth=(AppConfig.NEO4J_USER, AppConfig.NEO4J_PASSWORD))
-llm = ChatOpenAI(temperature=0, model="gpt-4-1106-preview")
 
-## Worker tasks
-
-@celery_app.task(name="celery_worker.test_celery")
+@celery_app.task(name=DIVIDE_TASK)
 def divide(x, y):
     import time
     print("Starting divide task")
     time.sleep(5)
     return x / y
 
+def save_usage(driver, documentId: str, ledger: UsageLedger):
+    """Record a task's usage; called from finally blocks, so a ledger failure never replaces the task's outcome."""
+    if not ledger.stages:
+        return
+    try:
+        record_document_usage(driver, documentId, ledger)
+    except Exception as e:
+        logging.error(f"Failed to record usage for document {documentId}: {e}")
+
+
+def cancelled_result(self, driver, documentId: str, stage: str, error: Exception, page_uuids: List[str] = None) -> dict:
+    reason = cancel_reason(error)
+    mark_cancelled(driver, documentId, stage, reason)
+    if page_uuids:
+        release_enrichment_claims(driver, page_uuids)
+    self.update_state(state=AppConfig.PROCESSING_CANCELLED, meta={"documentId": documentId, "stage": stage, "reason": reason})
+    return {"message": "Cancelled", "uuid": documentId, "task_id": self.request.id, "stage": stage, "reason": reason}
+
+
+class EnrichmentTask(celery_app.Task):
+    """Page enrichment; a task that fails for good releases the lazy enrichment claims of its pages."""
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        page_uuids = kwargs.get("page_uuids", args[1] if len(args) > 1 else None)
+        if page_uuids:
+            try:
+                release_enrichment_claims(get_driver(), page_uuids)
+            except Exception as e:
+                logging.error(f"Failed to release the enrichment claims of task {task_id}: {e}")
+
+
 # Celery task for processing text
-@celery_app.task(bind=True, rate_limit="1/m", name="celery_worker.process_text_task")
-def process_text_task(self, textToProcess: str, documentId: str, generateQuestions: bool, generateSummaries: bool):
+@celery_app.task(bind=True, name=PROCESS_TEXT_TASK, priority=AppConfig.INGEST_PRIORITY, **RETRY_OPTIONS, **TIME_LIMIT_OPTIONS)
+def process_text_task(self, textToProcess: str, documentId: str, generateQuestions: bool, generateSummaries: bool, profile: bool = False, deadline: float = None):
+    if not profile:
+        return process_text(self, textToProcess, documentId, generateQuestions, generateSummaries, deadline)
+    # Sample this task's thread only and return the id of the saved profile with the result
+    with profiled(f"process_text_task {documentId}") as saved:
+        result = process_text(self, textToProcess, documentId, generateQuestions, generateSummaries, deadline)
+    result["profile_id"] = saved["id"]
+    return result
+
+
+def process_text(self, textToProcess: str, documentId: str, generateQuestions: bool, generateSummaries: bool, deadline: float = None):
     logging.info(f"Starting process for document {documentId}")
     self.update_state(state=AppConfig.PROCESSING_DOCUMENT, meta={"documentId": documentId})
  
@@ -155,83 +199,177 @@ def process_text_task(self, textToProcess: str, documentId: str, generateQuestio
         # Increment the count of active tasks
         active_tasks_count += 1
 
+    ledger = UsageLedger()
+    # Page loops report through the reporter so the backend sees coalesced writes
+    progress = ProgressReporter(self, documentId)
     try: 
-        doc = telegram.text_to_docs(textToProcess)  
-
-        # Setup splitters 
-        parent_splitter = TokenTextSplitter(chunk_size=512, chunk_overlap=24)
-        child_splitter = TokenTextSplitter(chunk_size=100, chunk_overlap=24)
-        parent_documents = parent_splitter.split_documents(doc)
-
-        # Setup embeddings
-        embeddings = OpenAIEmbeddings(openai_api_key=AppConfig.OPENAI_API_KEY, embedding_dimension=AppConfig.EMBEDDING_DIMENSION)
-
-        # Iterate through parent and child chunks for document and generate structure
-        for i, parent in enumerate(parent_documents):
-
-            self.update_state(state=AppConfig.PROCESSING_PAGES, meta={"page": i+1, "total_pages": len(parent_documents), "documentId": documentId})
-            logging.info(f"processing chunk {i+1} of {len(parent_documents)} for document {documentId}")
+        with ledger.stage("pages"):
+            # Process-wide splitters, embeddings and driver
+            parent_splitter, child_splitter = get_splitters()
+            embeddings = MeteredEmbeddings(get_embeddings(), ledger)
+            embed = embeddings.embed_query
+
+            # Very large documents are split lazily and their pages flushed as they go (see streaming.py)
+            streaming = use_streaming(textToProcess)
+            if streaming:
+                logging.info(f"Streaming document {documentId} ({len(textToProcess)} characters)")
+                parent_texts = iter_parent_chunks(textToProcess, parent_splitter, AppConfig.INGEST_STREAMING_WINDOW_CHARS)
+                total_pages = None
+                embed = lambda text: compact_embedding(embeddings.embed_query(text))
+            else:
+                doc = telegram.text_to_docs(textToProcess)
+                parent_texts = [parent.page_content for parent in parent_splitter.split_documents(doc)]
+                total_pages = len(parent_texts)
+            page_count = 0
+            driver = get_driver()
+            # Checked between pages: stops on a cancel request or past the deadline
+            cancellation = CancellationToken(driver, documentId, task_deadline(deadline))
+            cancellation.check()
+            ensure_dedup_index(driver)
+            ensure_owner_indexes(driver)
+            # Owner copied onto every Page and Child for scoped retrieval
+            owner_uuid = document_owner(driver, documentId)
+            dedup_stats = {"duplicates": 0, "embeddings_saved": 0, "nodes_saved": 0}
+
+            # Pages are split deterministically, so a retried or redelivered task
+            # resumes after the last page it completed; a new task starts over
+            done = read_checkpoint(driver, documentId, "pages", self.request.id)
+            if done:
+                logging.info(f"Resuming document {documentId} after page {done}")
+
+            # Iterate through parent and child chunks for document and generate structure
+            for i, parent_text in enumerate(parent_texts):
+                page_count = i+1
+                if i+1 <= done:
+                    continue
+                cancellation.check()
+
+                progress.update_state(state=AppConfig.PROCESSING_PAGES, meta={"page": i+1, "total_pages": total_pages, "documentId": documentId})
+                logging.info(f"processing chunk {i+1} of {total_pages or 'a streamed document'} for document {documentId}")
             
-            child_documents = child_splitter.split_documents([parent])
-            params = {
-                "document_uuid": documentId,
-                "parent_uuid": str(uuid.uuid4()),
-                "name": f"Page {i+1}",
-                "parent_text": parent.page_content,
-                "parent_id": i,
-                "parent_embedding": embeddings.embed_query(parent.page_content),
-                "children": [
-                    {
-                        "text": c.page_content,
-                        "id": str(uuid.uuid4()),
-                        "name": f"{i}-{ic+1}",
-                        "embedding": embeddings.embed_query(c.page_content),
-                    }
-                    for ic, c in enumerate(child_documents)
-                ],
-            }
-
-            try:
-                # Ingest data
-                with driver.session() as session :
-                    session.run(
-                    """
-                        MERGE (p:Page {uuid: $parent_uuid})
-                        SET p.text = $parent_text,
-                        p.name = $name,
-                        p.type = "Page",
-                        p.datecreated= datetime(),
-                        p.source=$parent_uuid
-                        WITH p
-                        CALL db.create.setVectorProperty(p, 'embedding', $parent_embedding) YIELD node
-                        WITH p
-                            MATCH (d:Document {uuid: $document_uuid})
-                            MERGE (d)-[:HAS_PAGE]->(p)
-                        WITH p 
-                        UNWIND $children AS child
-                            MERGE (c:Child {uuid: child.id})
-                            SET 
-                                c.text = child.text,
-                                c.name = child.name,
-                                c.source=child.id
-                            MERGE (c)<-[:HAS_CHILD]-(p)
-                            WITH c, child       
-                                CALL db.create.setVectorProperty(c, 'embedding', child.embedding)
-                            YIELD node
-                            RETURN count(*)
-                        """,
-                            params,
-                        )
-            except Neo4jError as e:
-                logging.error(f"Neo4j error in document {documentId}, chunk {i+1}: {e}")
-                raise    
+                child_texts = child_splitter.split_text(parent_text)
+                params = {
+                    "document_uuid": documentId,
+                    "parent_uuid": node_uuid(documentId, "page", i+1),
+                    "name": f"Page {i+1}",
+                    "parent_text": parent_text,
+                    "parent_id": i,
+                    "page_number": i+1,
+                    "owner_uuid": owner_uuid,
+                    "parent_embedding": embed(parent_text),
+                }
+                # Duplicate chunks reuse an existing embedding, link to the existing node or are dropped
+                params["children"], params["links"], new_chunks = dedupe_children(
+                    driver,
+                    [
+                        {
+                            "text": c,
+                            "id": node_uuid(documentId, "child", i+1, ic+1),
+                            "name": f"{i}-{ic+1}",
+                        }
+                        for ic, c in enumerate(child_texts)
+                    ],
+                    embed,
+                    AppConfig.DEDUP_MODE,
+                    dedup_stats,
+                    owner_uuid,
+                )
+                # Float32 buffers become lists only for the page's write
+                params["parent_embedding"] = as_list(params["parent_embedding"])
+                for child in params["children"]:
+                    child["embedding"] = as_list(child["embedding"])
+
+                def write_page(tx):
+                    tx.run(
+                        """
+                            MERGE (p:Page {uuid: $parent_uuid})
+                            SET p.text = $parent_text,
+                            p.name = $name,
+                            p.type = "Page",
+                            p.datecreated= datetime(),
+                            p.source=$parent_uuid,
+                            p.owner_uuid=$owner_uuid
+                            WITH p
+                            CALL db.create.setVectorProperty(p, 'embedding', $parent_embedding) YIELD node
+                            WITH p
+                                MATCH (d:Document {uuid: $document_uuid})
+                                MERGE (d)-[:HAS_PAGE]->(p)
+                            WITH p 
+                            UNWIND $children AS child
+                                MERGE (c:Child {uuid: child.id})
+                                SET 
+                                    c.text = child.text,
+                                    c.name = child.name,
+                                    c.source=child.id,
+                                    c.text_hash = child.text_hash,
+                                    c.simhash = child.simhash,
+                                    c.owner_uuid = $owner_uuid
+                                MERGE (c)<-[:HAS_CHILD]-(p)
+                                WITH c, child       
+                                    CALL db.create.setVectorProperty(c, 'embedding', child.embedding)
+                                YIELD node
+                                RETURN count(*)
+                            """,
+                        params,
+                    )
+                    # Existing chunks of the same owner that dedup linked to this page
+                    tx.run(
+                        """
+                            MATCH (p:Page {uuid: $parent_uuid})
+                            UNWIND $links AS link
+                                MATCH (c:Child {uuid: link})
+                                MERGE (c)<-[:HAS_CHILD]-(p)
+                            """,
+                        params,
+                    )
+                    # Children this run no longer produced are detached and left for compaction
+                    tx.run(
+                        """
+                            MATCH (p:Page {uuid: $parent_uuid})-[r:HAS_CHILD]->(c:Child)
+                            WHERE NOT c.uuid IN $child_uuids
+                            DELETE r
+                            """,
+                        {"parent_uuid": params["parent_uuid"], "child_uuids": [c["id"] for c in params["children"]] + params["links"]},
+                    )
+                    tx.run(
+                        "MATCH (d:Document {uuid: $document_uuid}) SET d.checkpoint_pages = $page_number",
+                        params,
+                    )
+
+                try:
+                    # Ingest data
+                    with driver.session() as session :
+                        session.execute_write(write_page)
+                except Neo4jError as e:
+                    logging.error(f"Neo4j error in document {documentId}, chunk {i+1}: {e}")
+                    raise    
+                # Only committed chunks can be matched by later pages
+                index_chunks(new_chunks)
         
-        if generateQuestions:
-            generate_questions(self,llm, parent_documents, documentId, embeddings, driver)
-
-            
-        if generateSummaries:
-            generate_summaries(self, llm, parent_documents, documentId, embeddings, driver) 
+        # Enrichment runs as separate tasks on the enrichment queue; the document
+        # is searchable as soon as its pages and children are written.
+        progress.flush()
+        detach_superseded_pages(driver, documentId, page_count)
+        complete_stage(driver, documentId, "pages")
+        record_dedup_stats(driver, documentId, dedup_stats)
+        logging.info(f"Deduplication for document {documentId}: {dedup_stats}")
+        if streaming:
+            # Enrichment tasks read their pages back from the graph, a bounded batch each
+            enrichment_task_ids = []
+            for page_uuids in page_uuid_batches(documentId, page_count, AppConfig.INGEST_STREAMING_ENRICHMENT_PAGES):
+                enrichment_task_ids += queue_enrichment(celery_app, documentId, generateQuestions, generateSummaries, page_uuids)
+        else:
+            enrichment_task_ids = queue_enrichment(celery_app, documentId, generateQuestions, generateSummaries)
+
+    except TRANSIENT_ERRORS as e:
+        # Retried with backoff; completed pages are kept and skipped next time
+        logging.warning(f"Transient error processing document {documentId}, retrying: {e}")
+        raise
+
+    except CANCELLATION_ERRORS as e:
+        # Pages written so far are complete and checkpointed; enrichment is not queued
+        progress.flush()
+        return cancelled_result(self, get_driver(), documentId, "pages", e)
 
     except Exception as e:
         logging.error(f"Failed to process document {documentId}: {e}")
@@ -242,9 +380,86 @@ def process_text_task(self, textToProcess: str, documentId: str, generateQuestio
         with active_tasks_lock:
             # Decrement the count of active tasks
             active_tasks_count -= 1
+        # Tokens spent before a failure or retry count too
+        save_usage(get_driver(), documentId, ledger)
 
-    self.update_state(state=AppConfig.PROCESSING_DONE, meta={"documentId": documentId})
+    self.update_state(state=AppConfig.PROCESSING_DONE, meta={"documentId": documentId, "enrichment_task_ids": enrichment_task_ids})
     logging.info(f"Successfully processed document {documentId}")
-    return {"message": "Success", "uuid": documentId, "task_id": self.request.id}
+    return {"message": "Success", "uuid": documentId, "task_id": self.request.id, "enrichment_task_ids": enrichment_task_ids, "dedup": dedup_stats, "usage": ledger.as_dict()}
+
+
+def run_enrichment(self, documentId: str, page_uuids: List[str], deadline: float, stage_name: str, enrich, summarize: bool) -> dict:
+    """
+    Shared body of the enrichment tasks: run enrich (generate_questions, generate_summaries
+    or enrich_pages) over the document's pages, or the given ones, with cancellation,
+    checkpoints, usage and cache statistics, and queue the document summary if summarize.
+    """
+    driver, llm, embeddings = get_driver(), get_llm(), get_embeddings()
+    # A cancelled document's queued enrichment stops here, before loading any page
+    cancellation = CancellationToken(driver, documentId, task_deadline(deadline))
+    try:
+        cancellation.check()
+    except TaskCancelled as e:
+        return cancelled_result(self, driver, documentId, stage_name, e, page_uuids)
+    pages = load_pages(driver, documentId, page_uuids)
+    progress = ProgressReporter(self, documentId)
+    # Whole-document runs checkpoint each page; a retry of this task resumes after the last one completed
+    stage = stage_name if page_uuids is None else None
+    if stage:
+        pages = pending_pages(driver, documentId, stage, pages, self.request.id)
+    ledger = UsageLedger()
+    # The cache counters are per process; the task reports what it added
+    cache_counters = llm_cache.counters()
+    try:
+        with ledger.stage(stage_name):
+            enrich(progress, llm, pages, documentId, MeteredEmbeddings(embeddings, ledger), driver, stage, cancellation)
+    except CANCELLATION_ERRORS as e:
+        progress.flush()
+        return cancelled_result(self, driver, documentId, stage_name, e, page_uuids)
+    finally:
+        save_usage(driver, documentId, ledger)
+    progress.flush()
+    if stage:
+        complete_stage(driver, documentId, stage)
+    llm_cache.log_stats(documentId, cache_counters)
+    # Only the task that completes the last page summary rolls them up; batches
+    # finishing earlier leave the document to it
+    if summarize and AppConfig.DOCUMENT_SUMMARIES_ENABLED and pages_summarized(driver, documentId):
+        queue_document_summary(celery_app, documentId)
+    return {"message": "Success", "uuid": documentId, "task_id": self.request.id, "pages": len(pages), "cache": llm_cache.stats(cache_counters), "usage": ledger.as_dict()}
+
+
+# Celery tasks for LLM enrichment of pages already written to the graph
+@celery_app.task(bind=True, base=EnrichmentTask, rate_limit=AppConfig.ENRICHMENT_RATE_LIMIT, name=GENERATE_QUESTIONS_TASK, priority=AppConfig.ENRICHMENT_PRIORITY, **RETRY_OPTIONS, **TIME_LIMIT_OPTIONS)
+def generate_questions_task(self, documentId: str, page_uuids: List[str] = None, deadline: float = None):
+    logging.info(f"Starting question generation for document {documentId}")
+    return run_enrichment(self, documentId, page_uuids, deadline, "questions", generate_questions, summarize=False)
+
+
+@celery_app.task(bind=True, base=EnrichmentTask, rate_limit=AppConfig.ENRICHMENT_RATE_LIMIT, name=GENERATE_SUMMARIES_TASK, priority=AppConfig.ENRICHMENT_PRIORITY, **RETRY_OPTIONS, **TIME_LIMIT_OPTIONS)
+def generate_summaries_task(self, documentId: str, page_uuids: List[str] = None, deadline: float = None):
+    logging.info(f"Starting summary generation for document {documentId}")
+    return run_enrichment(self, documentId, page_uuids, deadline, "summaries", generate_summaries, summarize=True)
 
 
+@celery_app.task(bind=True, base=EnrichmentTask, rate_limit=AppConfig.ENRICHMENT_RATE_LIMIT, name=ENRICH_DOCUMENT_TASK, priority=AppConfig.ENRICHMENT_PRIORITY, **RETRY_OPTIONS, **TIME_LIMIT_OPTIONS)
+def enrich_document_task(self, documentId: str, page_uuids: List[str] = None, deadline: float = None):
+    logging.info(f"Starting fused enrichment for document {documentId}")
+    return run_enrichment(self, documentId, page_uuids, deadline, "enrichment", enrich_pages, summarize=True)
+
+
+@celery_app.task(bind=True, rate_limit=AppConfig.ENRICHMENT_RATE_LIMIT, name=SUMMARIZE_DOCUMENT_TASK, priority=AppConfig.ENRICHMENT_PRIORITY, **RETRY_OPTIONS, **TIME_LIMIT_OPTIONS)
+def summarize_document_task(self, documentId: str, force: bool = False):
+    driver = get_driver()
+    try:
+        CancellationToken(driver, documentId).check()
+    except TaskCancelled as e:
+        return cancelled_result(self, driver, documentId, "document_summary", e)
+    ledger = UsageLedger()
+    try:
+        with ledger.stage("document_summary"):
+            result = refresh_document_summary(driver, get_llm(), MeteredEmbeddings(get_embeddings(), ledger), documentId, force)
+    finally:
+        save_usage(driver, documentId, ledger)
+    logging.info(f"Document summary for {documentId}: {result['status']}")
+    return {"message": "Success", "task_id": self.request.id, **result, "usage": ledger.as_dict()}
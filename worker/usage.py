@@ -0,0 +1,158 @@
+"""
+Token and latency ledger.
+
+A UsageLedger accumulates, per stage, the prompt and completion tokens and
+call counts of every LLM call made inside `with ledger.stage(name)` (through
+LangChain's OpenAI callback), the tokens and calls of embeddings made through
+MeteredEmbeddings, and wall time.
+
+Worker tasks add their ledger to the Document in one atomic increment at the
+end of the task (record_document_usage), as flat usage_<stage>_<field> properties plus
+usage_tokens / usage_seconds totals, accumulated across retries and reruns.
+Chat requests are appended to one JSONL file per day under USAGE_LOG_DIR
+(append_chat_usage).
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import List
+
+from config import AppConfig
+
+
+FIELDS = ("prompt_tokens", "completion_tokens", "embedding_tokens", "llm_calls", "embedding_calls", "seconds")
+TOKEN_FIELDS = ("prompt_tokens", "completion_tokens", "embedding_tokens")
+
+# Stages recorded on Document nodes
+DOCUMENT_STAGES = ("pages", "questions", "summaries", "enrichment", "document_summary")
+
+
+@lru_cache(maxsize=None)
+def embedding_encoding():
+    # Imported on first use; the API only needs the ledger files and property names
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=None)
+def model_encoding(model: str):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str) -> int:
+    """Tokens of text for a chat model, shared by the worker and the API's context packing."""
+    return len(model_encoding(model).encode(text))
+
+
+class UsageLedger:
+
+    def __init__(self):
+        self.stages = {}
+        self._current = None
+
+    @contextmanager
+    def stage(self, name: str):
+        from langchain.callbacks import get_openai_callback
+
+        usage = self.stages.setdefault(name, dict.fromkeys(FIELDS, 0))
+        previous, self._current = self._current, usage
+        started = time.perf_counter()
+        with get_openai_callback() as callback:
+            try:
+                yield usage
+            finally:
+                usage["prompt_tokens"] += callback.prompt_tokens
+                usage["completion_tokens"] += callback.completion_tokens
+                usage["llm_calls"] += callback.successful_requests
+                usage["seconds"] += time.perf_counter() - started
+                self._current = previous
+
+    def record_embeddings(self, texts: List[str]):
+        if self._current is not None:
+            encoding = embedding_encoding()
+            self._current["embedding_tokens"] += sum(len(encoding.encode(text)) for text in texts)
+            self._current["embedding_calls"] += 1
+
+    def totals(self) -> dict:
+        totals = dict.fromkeys(FIELDS, 0)
+        for usage in self.stages.values():
+            for field in FIELDS:
+                totals[field] += usage[field]
+        totals["tokens"] = sum(totals[field] for field in TOKEN_FIELDS)
+        return totals
+
+    def as_dict(self) -> dict:
+        return {"stages": self.stages, "totals": self.totals()}
+
+
+class MeteredEmbeddings:
+    """Embeddings wrapper that reports every call to a ledger."""
+
+    def __init__(self, embeddings, ledger: UsageLedger):
+        self.embeddings = embeddings
+        self.ledger = ledger
+
+    def embed_query(self, text: str) -> List[float]:
+        self.ledger.record_embeddings([text])
+        return self.embeddings.embed_query(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.ledger.record_embeddings(texts)
+        return self.embeddings.embed_documents(texts)
+
+
+## Documents
+
+def usage_property(stage: str, field: str) -> str:
+    return f"usage_{stage}_{field}"
+
+
+def record_document_usage(driver, documentId: str, ledger: UsageLedger):
+    """Add a task's usage to its Document's usage_* properties in one statement."""
+    increments = {}
+    for stage, usage in ledger.stages.items():
+        for field in FIELDS:
+            increments[usage_property(stage, field)] = usage[field]
+    totals = ledger.totals()
+    increments["usage_tokens"] = totals["tokens"]
+    increments["usage_seconds"] = totals["seconds"]
+
+    # Each property is read and incremented inside SET, which write-locks the node first,
+    # so tasks updating the same document concurrently do not overwrite each other.
+    # The property names come from the stage and field names, not from input.
+    assignments = ", ".join(f"d.`{key}` = coalesce(d.`{key}`, 0) + $usage.`{key}`" for key in increments)
+    with driver.session() as session:
+        session.run(f"MATCH (d:Document {{uuid: $uuid}}) SET {assignments}", uuid=documentId, usage=increments)
+
+
+## Chat requests
+
+def chat_usage_path(day: datetime) -> str:
+    return os.path.join(AppConfig.USAGE_LOG_DIR, f"chat-{day:%Y-%m-%d}.jsonl")
+
+
+def append_chat_usage(record: dict):
+    now = datetime.now(timezone.utc)
+    os.makedirs(AppConfig.USAGE_LOG_DIR, exist_ok=True)
+    line = json.dumps({"ts": now.isoformat(timespec="seconds"), **record}, separators=(",", ":"))
+    # One short append per request; O_APPEND keeps lines whole across API workers
+    with open(chat_usage_path(now), "a") as f:
+        f.write(line + "\n")
+
+
+def read_chat_usage(days: List[datetime]):
+    for day in days:
+        path = chat_usage_path(day)
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)